@@ -3,7 +3,7 @@ from .models import Question, Answer, QuestionLike, AnswerLike, Tag, Profile
 
 
 class QuestionAdmin(admin.ModelAdmin):
-    list_display = ('id', 'title', 'author', 'creating_time', 'editing_time')
+    list_display = ('id', 'title', 'author', 'rating', 'answer_count', 'creating_time', 'editing_time')
 
 
 class ProfileAdmin(admin.ModelAdmin):
@@ -15,7 +15,7 @@ class TagAdmin(admin.ModelAdmin):
 
 
 class AnswerAdmin(admin.ModelAdmin):
-    list_display = ('id', 'description', 'author', 'creating_time', 'editing_time')
+    list_display = ('id', 'description', 'author', 'rating', 'creating_time', 'editing_time')
 
 
 class AnswerLikeAdmin(admin.ModelAdmin):
@@ -0,0 +1,199 @@
+import hashlib
+import json
+from functools import wraps
+
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.views.decorators.http import require_http_methods
+
+from . import page_cache
+from .checks import is_shared
+from .models import Answer, Question, Tag
+from .pagination import CursorPaginator
+
+# Read API over the same id loaders and cursors as the HTML feeds.
+#   ?fields=a,b  only these fields; relations nobody asked for are not loaded
+#   ?cursor=     the "next" value of the previous page, ?limit= up to MAX_LIMIT
+#   ?export=1    every row as one streamed response, read EXPORT_CHUNK rows at a time
+# With a shared page cache, ETags are built from the page cache versions of the rows,
+# so revalidating a page costs its id query and a cache read.
+
+PAGE_LIMIT = 20
+MAX_LIMIT = 100
+EXPORT_CHUNK = 500
+
+# name -> (getter, select_related, prefetch_related), loaded by the managers' get_all
+QUESTION_FIELDS = {
+    'id': (lambda question: question.pk, None, None),
+    'title': (lambda question: question.title, None, None),
+    'text': (lambda question: question.description, None, None),
+    'rating': (lambda question: question.rating, None, None),
+    'answers': (lambda question: question.answer_count, None, None),
+    'created': (lambda question: question.creating_time.isoformat(), None, None),
+    'author': (lambda question: question.author.nickname, 'author', None),
+    'tags': (lambda question: [tag.title for tag in question.tags.all()], None, 'tags'),
+}
+ANSWER_FIELDS = {
+    'id': (lambda answer: answer.pk, None, None),
+    'text': (lambda answer: answer.description, None, None),
+    'rating': (lambda answer: answer.rating, None, None),
+    'correct': (lambda answer: answer.is_correct, None, None),
+    'created': (lambda answer: answer.creating_time.isoformat(), None, None),
+    'author': (lambda answer: answer.author.nickname, 'author', None),
+}
+TAG_FIELDS = {
+    'id': (lambda tag: tag.pk, None, None),
+    'title': (lambda tag: tag.title, None, None),
+    'questions': (lambda tag: tag.question_count, None, None),
+}
+
+FEEDS = {
+    'new': (Question.objects.get_new_ids, Question.objects.new_ordering),
+    'hot': (Question.objects.get_hot_ids, Question.objects.hot_ordering),
+    'best': (Question.objects.get_best_ids, Question.objects.best_ordering),
+}
+
+
+class APIError(Exception):
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def api_view(view):
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except APIError as error:
+            return JsonResponse({'error': str(error)}, status=error.status)
+    return require_http_methods(['GET', 'HEAD'])(wrapper)
+
+
+def get_fields(request, spec):
+    if not request.GET.get('fields'):
+        return list(spec)
+    fields = [name.strip() for name in request.GET['fields'].split(',') if name.strip()]
+    unknown = [name for name in fields if name not in spec]
+    if unknown or not fields:
+        raise APIError(f'Unknown fields {", ".join(unknown)}, choose from {", ".join(spec)}')
+    return fields
+
+
+def get_limit(request):
+    try:
+        limit = int(request.GET.get('limit', PAGE_LIMIT))
+    except ValueError:
+        raise APIError('limit must be a number')
+    if not 1 <= limit <= MAX_LIMIT:
+        raise APIError(f'limit must be between 1 and {MAX_LIMIT}')
+    return limit
+
+
+def load(model, ids, fields, spec):
+    # The feeds' batch loader with the fields asked for
+    return model.objects.get_all(ids, {name: spec[name] for name in fields})
+
+
+def use_etags():
+    # The versions live in the page cache. On a per-process cache a write bumps them in
+    # one worker only, and the others would answer 304 for the changed rows for ever.
+    return is_shared(getattr(settings, 'PAGE_CACHE_ALIAS', 'default'))
+
+
+def get_etag(request, versions):
+    digest = hashlib.md5(request.get_full_path().encode())
+    for name in sorted(versions):
+        digest.update(f'{name}={versions[name]};'.encode())
+    return f'"{digest.hexdigest()}"'
+
+
+def export_rows(paginator, model, fields, spec):
+    # Keyset pages keep each read an index range and memory at one chunk
+    paginator.per_page = EXPORT_CHUNK
+    yield '{"results": ['
+    cursor = None
+    separator = ''
+    while True:
+        page = paginator.get_page(after=cursor)
+        for row in load(model, page.object_list, fields, spec):
+            yield separator + json.dumps(row)
+            separator = ','
+        if not page.has_next:
+            break
+        cursor = page.next_cursor
+    yield ']}'
+
+
+def respond(request, paginator, model, spec, names, item_names=None):
+    # Versions are read before the rows they describe, like page_cache.depend: a write
+    # in between leaves the response with an already outdated ETag, never the reverse.
+    fields = get_fields(request, spec)
+    etags = use_etags()
+    if etags:
+        if 'author' in fields:
+            names = [*names, page_cache.profiles()]
+        versions = page_cache.get_versions(names)
+    response = etag = None
+    if request.GET.get('export'):
+        if etags:
+            etag = get_etag(request, versions)
+            response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = StreamingHttpResponse(export_rows(paginator, model, fields, spec), content_type='application/json')
+    else:
+        paginator.per_page = get_limit(request)
+        page = paginator.get_page(after=request.GET.get('cursor'))
+        if etags:
+            if item_names:
+                versions.update(page_cache.get_versions(map(item_names, page.object_list)))
+            etag = get_etag(request, versions)
+            response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = JsonResponse({'results': load(model, page.object_list, fields, spec), 'next': page.next_cursor})
+    if etag:
+        response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=0)
+    return response
+
+
+@api_view
+def questions(request):
+    tag = request.GET.get('tag')
+    if tag:
+        title = Tag.objects.normalize(tag)
+        paginator = CursorPaginator(Question.objects.get_by_tag_ids(title), Question.objects.tag_ordering, key='question_id')
+        feeds = [page_cache.tag_feed(title)]
+    else:
+        order = request.GET.get('order', 'new')
+        if order not in FEEDS:
+            raise APIError(f'Unknown order {order}, choose from {", ".join(FEEDS)}')
+        ids, ordering = FEEDS[order]
+        paginator = CursorPaginator(ids(), ordering)
+        feeds = [page_cache.feed(order)]
+    if request.GET.get('export'):
+        # A vote bumps the hot and best feeds, an answer the hot feed and a new
+        # question every feed it is in: together they cover every row exported.
+        feeds += [page_cache.feed(name) for name in FEEDS]
+    return respond(request, paginator, Question, QUESTION_FIELDS, feeds, page_cache.question)
+
+
+@api_view
+def answers(request, question_id):
+    if not Question.objects.filter(pk=question_id).exists():
+        raise APIError('Question not found', 404)
+    return respond(
+        request, CursorPaginator(Answer.objects.get_all_ids(question_id), ('-rating', 'id')), Answer, ANSWER_FIELDS,
+        [page_cache.question(question_id), page_cache.answers(question_id)]
+    )
+
+
+@api_view
+def tags(request):
+    # Question counts change when questions are asked, which bumps the new feed
+    return respond(
+        request, CursorPaginator(Tag.objects.values_list('id', flat=True), ('-question_count', '-id')), Tag, TAG_FIELDS,
+        [page_cache.feed('new')]
+    )
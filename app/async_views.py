@@ -0,0 +1,154 @@
+import asyncio
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.db import connection
+from django.http import Http404, HttpResponseNotAllowed, JsonResponse
+from django.shortcuts import render
+from django.utils import timezone
+
+from . import page_cache, views
+from .forms import AnswerForm
+from .models import Question, QuestionLike, AnswerLike, Answer
+from .page_cache import cache_anonymous_page
+from .pagination import CursorPaginator
+from .sidebar import get_sidebar
+
+# Async counterparts of the question, vote and correct views, used when
+# settings.ASYNC_VIEWS is on and the site runs under an ASGI server. The question page
+# runs its header, answers, profile and sidebar queries side by side; vote and correct
+# are a few queries with no thread hop. A feed is one paging query and one batch load
+# with prefetch_related, which Django 4.1 has no async version of, so the feeds stay
+# on the sync views. Templates render in the sync thread for the same reason.
+
+
+def require_http_methods(methods):
+    # django.views.decorators.http.require_http_methods returns a sync wrapper in Django 4.1
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return HttpResponseNotAllowed(methods)
+            return await view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def login_required(view):
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if not await sync_to_async(lambda: request.user.is_authenticated)():
+            return redirect_to_login(request.get_full_path(), 'login', 'continue')
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+@sync_to_async
+def get_profile(request):
+    return getattr(request.user, 'profile', None) if request.user.is_authenticated else None
+
+
+def load_sidebar():
+    # Runs outside the request thread, so whatever connection it opened is its own.
+    try:
+        return get_sidebar()
+    finally:
+        connection.close()
+
+
+async def get_answers(question_id, request):
+    answers = Answer.objects.get_all_ids(question_id)
+    paginator = CursorPaginator(answers, Answer.objects.best_ordering, views.ANSWERS_PER_PAGE)
+    page_obj = await paginator.aget_page(
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+        last='last' in request.GET
+    )
+    by_id = {
+        answer.pk: answer async for answer in Answer.objects.filter(pk__in=page_obj.object_list).select_related('author')
+    }
+    data = [Answer.objects.get_obj(by_id[id]) for id in page_obj.object_list if id in by_id]
+    return page_obj, data
+
+
+@require_http_methods(['GET', 'POST'])
+@cache_anonymous_page
+async def question(request, question_id: int):
+    if request.method == 'POST':
+        return await sync_to_async(views.question)(request, question_id)
+
+    await sync_to_async(page_cache.depend)(
+        request, page_cache.question(question_id), page_cache.answers(question_id)
+    )
+    # The header comes from the batch loader of the sync view, tags prefetched
+    header, (page_obj, data), profile, request.sidebar = await asyncio.gather(
+        sync_to_async(Question.objects.get_all)([question_id]),
+        get_answers(question_id, request),
+        get_profile(request),
+        sync_to_async(load_sidebar, thread_sensitive=False)()
+    )
+    if not header:
+        raise Http404
+    context = {
+        'question': header[0],
+        'page_obj': page_obj,
+        'data': data,
+        'form': AnswerForm(),
+        'author': profile is not None and header[0]['author_id'] == profile.pk
+    }
+    return await sync_to_async(render)(request, 'question.html', context=context)
+
+
+@login_required
+@require_http_methods(['POST'])
+async def vote(request):
+    id = request.POST.get("id")
+    vote = request.POST.get("vote")
+    type = request.POST.get("type")
+    if not (id and vote and type):
+        raise Http404
+    if vote not in ["like", "dislike"]:
+        raise Http404
+    profile = await get_profile(request)
+    if profile is None:
+        raise Http404
+    if type == "question":
+        model, likes = Question, QuestionLike.objects
+    elif type == "answer":
+        model, likes = Answer, AnswerLike.objects
+    else:
+        raise Http404
+    try:
+        item = await model.objects.aget(pk=id)
+    except model.DoesNotExist:
+        raise Http404
+    return JsonResponse({
+        'likes': await sync_to_async(likes.create_or_change_like)(item, profile, vote)
+    })
+
+
+@login_required
+@require_http_methods(['POST'])
+async def correct(request):
+    id = request.POST.get("id")
+    correct = request.POST.get("correct")
+    enum_states = {"true": True, "false": False}
+    if not (id and correct):
+        raise Http404
+    profile = await get_profile(request)
+    if profile is None:
+        raise Http404
+    if correct not in enum_states.keys():
+        raise Http404
+    try:
+        answer = await Answer.objects.select_related('question').aget(pk=id)
+    except Answer.DoesNotExist:
+        raise Http404
+    if answer.question.author_id != profile.pk:
+        raise Http404
+    await Answer.objects.filter(pk=answer.pk).aupdate(is_correct=enum_states[correct], editing_time=timezone.now())
+    await sync_to_async(page_cache.invalidate)(page_cache.answers(answer.question_id))
+    return JsonResponse({
+        'correct': correct
+    })
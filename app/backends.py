@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Profile
+
+USER_KEY = 'user:{}'
+
+
+def get_cache():
+    # None unless a cache shared by all workers is configured, see app.checks
+    alias = getattr(settings, 'USER_CACHE_ALIAS', None)
+    return caches[alias] if alias else None
+
+
+def get_timeout():
+    return getattr(settings, 'USER_CACHE_TIMEOUT', 300)
+
+
+def forget_user(user_id):
+    cache = get_cache()
+    if cache is not None:
+        cache.delete(USER_KEY.format(user_id))
+
+
+class CachedModelBackend(ModelBackend):
+    # Loads the user of a session together with the profile the page header shows in
+    # one query, or from the shared USER_CACHE_ALIAS when one is set: with cached
+    # sessions an authenticated page then reads nothing from the database to know who
+    # is asking. Saving either model drops the entry in every worker, and Django still
+    # checks the session against the cached password hash.
+
+    def get_user(self, user_id):
+        cache = get_cache()
+        key = USER_KEY.format(user_id)
+        user = cache.get(key) if cache is not None else None
+        if user is None:
+            user = User._default_manager.select_related('profile').filter(pk=user_id).first()
+            if user is None:
+                return None
+            if cache is not None:
+                cache.set(key, user, get_timeout())
+        return user if self.user_can_authenticate(user) else None
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    forget_user(instance.pk)
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def profile_changed(sender, instance, **kwargs):
+    forget_user(instance.user_id)
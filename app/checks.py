@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Error, register
+
+
+def is_shared(alias):
+    # Whether every worker process reads what one of them wrote to the cache alias.
+    # A LocMemCache is a dict per process, a DummyCache keeps nothing at all.
+    return bool(alias) and not isinstance(caches[alias], (LocMemCache, DummyCache))
+
+
+@register()
+def check_shared_caches(app_configs, **kwargs):
+    # A logout, a flushed session or a new password only reach the cache of the
+    # process that handled them; the other workers would go on trusting their copy.
+    errors = []
+    if settings.SESSION_ENGINE in ('django.contrib.sessions.backends.cache',
+                                   'django.contrib.sessions.backends.cached_db'):
+        if not is_shared(settings.SESSION_CACHE_ALIAS):
+            errors.append(Error(
+                f'{settings.SESSION_ENGINE} needs SESSION_CACHE_ALIAS to be a cache shared by all workers',
+                hint="Use 'django.contrib.sessions.backends.db' or a memcached, redis or file cache",
+                id='app.E001',
+            ))
+    alias = getattr(settings, 'USER_CACHE_ALIAS', None)
+    if alias and not is_shared(alias):
+        errors.append(Error(
+            'USER_CACHE_ALIAS needs to be a cache shared by all workers',
+            hint='Set it to None to read the user of a session from the database',
+            id='app.E002',
+        ))
+    return errors
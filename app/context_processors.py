@@ -0,0 +1,15 @@
+from django.conf import settings
+
+from .sidebar import get_sidebar
+
+
+def sidebar(request):
+    # The async views load it alongside their queries and leave it on the request
+    if hasattr(request, 'sidebar'):
+        return request.sidebar
+    return get_sidebar()
+
+
+def fragment_cache(request):
+    # For the {% cache %} tags of question_item.html and answer_item.html
+    return {'fragment_cache_timeout': getattr(settings, 'FRAGMENT_CACHE_TIMEOUT', 600)}
@@ -0,0 +1,88 @@
+import gzip
+import json
+import os
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, time as dt_time
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+
+from .models import Answer, AnswerLike, Profile, Question, QuestionLike, QuestionTag, Tag
+
+# Questions and answers with their authors, tags and likes as gzip JSON Lines, written by
+# export_qa and read by import_qa. Every chunk is a gzip member of its own, so an
+# interrupted export is cut back to its last whole chunk and continued, while zcat still
+# reads the file as one stream:
+#   {"format": "askme-qa", "version": 1, "bounds": {"app.question": 1000, ...}}
+#   {"model": "app.question", "fields": ["id", "title", ...]}
+#   [[1, "title", ...], [2, "title", ...]]    one line per chunk
+#   {"end": "app.question", "rows": 1000}
+# The file holds password hashes. The search index is left out, rebuild_search_index
+# makes it from the questions.
+
+FORMAT = 'askme-qa'
+VERSION = 1
+# In the order they are imported, every model after the ones it points to
+MODELS = [User, Profile, Tag, Question, QuestionTag, Answer, QuestionLike, AnswerLike]
+
+
+def get_fields(model):
+    return [field.attname for field in model._meta.concrete_fields]
+
+
+def encode(value):
+    if isinstance(value, (datetime, date, dt_time)):
+        # DjangoJSONEncoder cuts microseconds, the new feed is ordered by them
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def write_member(file, lines, level):
+    data = ''.join(json.dumps(line, default=encode, ensure_ascii=False, separators=(',', ':')) + '\n'
+                   for line in lines)
+    file.write(gzip.compress(data.encode(), level))
+    file.flush()
+
+
+def read_lines(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as file:
+        for line in file:
+            yield json.loads(line)
+
+
+def load_checkpoint(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def save_checkpoint(path, state):
+    # Replaced in one rename, an interruption leaves the previous checkpoint whole
+    with open(path + '.tmp', 'w') as file:
+        json.dump(state, file)
+    os.replace(path + '.tmp', path)
+
+
+def get_rate(rows, started):
+    elapsed = time.monotonic() - started
+    return rows / elapsed if elapsed else 0
+
+
+@contextmanager
+def historical_times(*models):
+    # auto_now/auto_now_add would stamp every written row with the current time.
+    fields = [field for model in models for field in model._meta.concrete_fields
+              if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)]
+    saved = [(field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, saved):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
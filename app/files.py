@@ -0,0 +1,130 @@
+import mimetypes
+import posixpath
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.views.decorators.http import require_http_methods
+
+# Serves uploads and static files with validators and byte ranges, so a repeat visit
+# costs a 304 and a resumed download only the missing bytes. Full responses go out as
+# FileResponse, which WSGI servers with wsgi.file_wrapper send with sendfile().
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeFile:
+    # Reads length bytes from offset; it has no tell() so FileResponse leaves
+    # Content-Length to the caller.
+
+    def __init__(self, file, offset, length):
+        file.seek(offset)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def get_range(request, size, etag, last_modified):
+    # Returns (start, end) of the one satisfiable range asked for, None to send the
+    # whole file, or False when nothing of it exists.
+    header = request.META.get('HTTP_RANGE', '').strip()
+    match = RANGE_RE.match(header)
+    if not match or match.groups() == ('', ''):
+        # Several ranges would need a multipart body, the whole file is a valid answer
+        return None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range and if_range not in (etag, http_date(last_modified)):
+        # The client holds part of another version
+        return None
+    first, last = match.groups()
+    if not first:
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def serve(request, path, root, max_age, immutable=False):
+    # A path out of root raises SuspiciousFileOperation, answered with a 400
+    fullpath = Path(safe_join(root, posixpath.normpath(path).lstrip('/')))
+    return serve_file(request, fullpath, max_age, immutable)
+
+
+def serve_file(request, fullpath, max_age, immutable=False):
+    try:
+        stat = fullpath.stat()
+    except OSError:
+        raise Http404
+    if not fullpath.is_file():
+        raise Http404
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    last_modified = int(stat.st_mtime)
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        content_type = mimetypes.guess_type(fullpath.name)[0] or 'application/octet-stream'
+        byte_range = get_range(request, stat.st_size, etag, last_modified)
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stat.st_size}'
+        elif byte_range:
+            start, end = byte_range
+            response = FileResponse(RangeFile(fullpath.open('rb'), start, end - start + 1),
+                                    status=206, content_type=content_type)
+            response['Content-Length'] = end - start + 1
+            response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+        else:
+            response = FileResponse(fullpath.open('rb'), content_type=content_type)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Accept-Ranges'] = 'bytes'
+    if immutable:
+        patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=max_age)
+    return response
+
+
+@require_http_methods(['GET', 'HEAD'])
+def media(request, path):
+    # Upload names are never reused and thumbnails are named after their original,
+    # so only replaced files like the default avatar need the revalidation.
+    path = posixpath.normpath(path).lstrip('/')
+    return serve(request, path, settings.MEDIA_ROOT, getattr(settings, 'MEDIA_CACHE_MAX_AGE', 86400),
+                 immutable=path.startswith('thumbs/'))
+
+
+@require_http_methods(['GET', 'HEAD'])
+def static(request, path):
+    # Collected files are served from STATIC_ROOT, their content-hashed names forever.
+    # Without collectstatic the plain names come from the app directories and are
+    # revalidated on every use.
+    path = posixpath.normpath(path).lstrip('/')
+    if settings.STATIC_ROOT and Path(settings.STATIC_ROOT).is_dir():
+        return serve(request, path, settings.STATIC_ROOT, 0, immutable=is_hashed(path))
+    found = finders.find(path)
+    if not found:
+        raise Http404
+    return serve_file(request, Path(found), 0)
+
+
+def is_hashed(path):
+    return path in getattr(staticfiles_storage, 'hashed_names', ())
@@ -1,8 +1,11 @@
 from django import forms
 from django.core.exceptions import ValidationError
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
+from django.db.models import F
 from .models import Profile, Question, Tag, Answer
+from . import page_cache, search, suggest, thumbnails
 from django.contrib.auth.models import User
+from django.contrib import auth
 from django.contrib.auth import hashers
 
 
@@ -20,20 +23,21 @@ class LoginForm(forms.Form):
         label="Password"
     )
 
-    def clean_username(self):
-        super().clean()
-        username = self.cleaned_data['username']
-        if not Profile.objects.get_user_by_username(username):
-            self.add_error(field=None, error="Wrong username or password")
-        return username
+    def __init__(self, *args, request=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.request = request
+        self.user = None
 
     def clean(self):
         super().clean()
-        password = self.cleaned_data['password']
-        username = self.cleaned_data['username']
-        user = Profile.objects.get_user_by_username(username)
-        if not user.check_password(password):
-            self.add_error(field=None, error="Wrong username or password")
+        username = self.cleaned_data.get('username')
+        password = self.cleaned_data.get('password')
+        if username and password:
+            # authenticate() looks the user up and hashes the password once; the view
+            # logs in the user it returned instead of authenticating again.
+            self.user = auth.authenticate(self.request, username=username, password=password)
+            if self.user is None:
+                self.add_error(field=None, error="Wrong username or password")
         return self.cleaned_data
 
 
@@ -53,29 +57,25 @@ class RegistrationForm(forms.ModelForm):
         model = User
         fields = ['username', 'email', 'nickname', 'password', 'password_check', 'avatar']
 
-    def clean_username(self):
+    def clean(self):
         super().clean()
         username = self.cleaned_data.get('username')
-
-        if Profile.objects.get_user_by_username(username):
-            self.add_error('username', IntegrityError("User already exists"))
-        return username
-
-    def clean_email(self):
-        super().clean()
         email = self.cleaned_data.get('email')
-        if Profile.objects.get_user_by_email(email):
-            self.add_error('email', IntegrityError("User already exists"))
-        return email
-
-    def clean(self):
-        super().clean()
+        for user in Profile.objects.get_users_by_username_or_email(username, email):
+            if user.username == username:
+                self.add_error('username', IntegrityError("User already exists"))
+            if email and user.email.lower() == email.lower():
+                self.add_error('email', IntegrityError("User already exists"))
         pas1 = self.cleaned_data.get("password")
         pas2 = self.cleaned_data.get("password_check")
         if pas1 and pas1 != pas2:
             self.add_error('password_check', ValidationError("Passwords don't match", code='invalid'))
         return self.cleaned_data
 
+    def validate_unique(self):
+        # clean() has checked the username already, with the email in the same query
+        pass
+
     def save(self):
         self.cleaned_data.pop('password_check')
         nickname = self.cleaned_data.pop('nickname')
@@ -86,6 +86,7 @@ class RegistrationForm(forms.ModelForm):
         if avatar:
             profile.avatar = avatar
         profile.save()
+        thumbnails.schedule(profile)
         return profile
 
 
@@ -140,8 +141,14 @@ class SettingsForm(forms.ModelForm):
         profile = user.profile
         if avatar:
             profile.avatar = avatar
+            profile.avatar_thumbnail = ''
+        if profile.nickname != nickname:
+            page_cache.invalidate(page_cache.profiles())
         profile.nickname = nickname
-        profile.save()
+        # The profile may come from the user cache, its counters can be out of date
+        profile.save(update_fields=['avatar', 'avatar_thumbnail', 'nickname'])
+        if avatar:
+            thumbnails.schedule(profile)
         user.save()
 
 
@@ -156,18 +163,24 @@ class QuestionForm(forms.ModelForm):
 
     def save(self, profile):
         super().clean()
-        question = Question.objects.create(
-            title=self.cleaned_data['title'],
-            description=self.cleaned_data['description'],
-            author=profile
-        )
-        tag_names = self.cleaned_data['tags'].split(',')
-        tags = []
-        for tag_name in tag_names:
-            tag, created = Tag.objects.get_or_create(title=tag_name)
-            tags.append(tag)
+        with transaction.atomic():
+            question = Question.objects.create(
+                title=self.cleaned_data['title'],
+                description=self.cleaned_data['description'],
+                author=profile
+            )
+            question.hot_score = Question.objects.hot_score(0, 0, question.creating_time)
+            question.save(update_fields=['hot_score'])
+            tags = Tag.objects.resolve(self.cleaned_data['tags'].split(','))
+            question.tags.add(*tags, through_defaults={'creating_time': question.creating_time})
+            Tag.objects.filter(id__in=[tag.id for tag in tags]).update(question_count=F('question_count') + 1)
+            search.index_question(question)
+            page_cache.invalidate(
+                *map(page_cache.feed, ['new', 'hot', 'best']), *(page_cache.tag_feed(tag.title) for tag in tags)
+            )
+        suggest.index.add_question(question.id, question.title)
         for tag in tags:
-            question.tags.add(tag)
+            suggest.index.add_tag(tag.title)
         return question.id
 
 
@@ -176,9 +189,17 @@ class AnswerForm(forms.Form):
 
     def save(self, profile, question):
         super().clean()
-        answer = Answer.objects.create(
-            description=self.cleaned_data['description'],
-            author=profile,
-            question=question
-        )
+        with transaction.atomic():
+            answer = Answer.objects.create(
+                description=self.cleaned_data['description'],
+                author=profile,
+                question=question
+            )
+            Question.objects.filter(pk=question.pk).update(
+                answer_count=F('answer_count') + 1,
+                hot_score=F('hot_score') + Question.objects.hot_answer_weight
+            )
+            Profile.objects.filter(pk=profile.pk).update(answer_count=F('answer_count') + 1)
+            search.index_answer(answer)
+            page_cache.invalidate(page_cache.question(question.pk), page_cache.answers(question.pk), page_cache.feed('hot'))
         return answer.id
@@ -0,0 +1,163 @@
+import json
+import random
+import statistics
+import subprocess
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from app.models import Question, Tag, Profile
+
+ENDPOINTS = ['index', 'hot_questions', 'best_questions', 'new_questions', 'tag_questions', 'question', 'vote', 'ask']
+HOST = 'localhost'
+QUERY_TOLERANCE = 0.5
+
+
+def percentile(timings, p):
+    return timings[min(len(timings) - 1, int(len(timings) * p / 100))]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=settings.BASE_DIR
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Measure latency, queries per request and throughput of the main pages (vote and ask write to the database)'
+
+    def handle(self, *args, **options):
+        if options['ratio']:
+            call_command('fill_db', options['ratio'], seed=options['seed'], stdout=self.stdout)
+        if not Question.objects.exists() or not Tag.objects.exists():
+            raise CommandError('Database is empty, run fill_db or pass --ratio')
+
+        user, created = User.objects.get_or_create(username='bench')
+        if created:
+            Profile.objects.create(user=user)
+        client = Client(HTTP_HOST=HOST)
+        client.force_login(user)
+
+        max_id = Question.objects.order_by('-id').values_list('id', flat=True).first()
+        tags = list(Tag.objects.get_popular(100))
+
+        def question_id(rnd):
+            return Question.objects.filter(id__gte=rnd.randint(1, max_id)).order_by('id').values_list(
+                'id', flat=True
+            ).first() or max_id
+
+        requests = {
+            'index': lambda rnd: ('get', reverse('index'), None),
+            'hot_questions': lambda rnd: ('get', reverse('hot_questions'), None),
+            'best_questions': lambda rnd: ('get', reverse('best_questions'), None),
+            'new_questions': lambda rnd: ('get', reverse('new_questions'), None),
+            'tag_questions': lambda rnd: ('get', reverse('tag_questions', args=[rnd.choice(tags)]), None),
+            'question': lambda rnd: ('get', reverse('question', args=[question_id(rnd)]), None),
+            'vote': lambda rnd: ('post', reverse('vote'), {
+                'id': question_id(rnd), 'type': 'question', 'vote': rnd.choice(['like', 'dislike'])
+            }),
+            'ask': lambda rnd: ('post', reverse('ask'), {
+                'title': f'Benchmark question {rnd.random()}', 'description': 'Benchmark', 'tags': rnd.choice(tags)
+            }),
+        }
+
+        results = {}
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, HOST]):
+            for name in options['endpoints'] or ENDPOINTS:
+                if name not in requests:
+                    raise CommandError(f'Unknown endpoint {name}, choose from {", ".join(ENDPOINTS)}')
+                # Every page draws from its own generator, so a page gets the same requests
+                # with the same seed whichever other pages are measured with it.
+                rnd = random.Random(f"{options['seed']}:{name}")
+                calls = [requests[name](rnd) for _ in range(options['warmup'] + options['requests'])]
+                for method, url, data in calls[:options['warmup']]:
+                    getattr(client, method)(url, data)
+                results[name] = self.measure(client, calls[options['warmup']:])
+                self.report(name, results[name])
+
+        data = {
+            'commit': git_commit(),
+            'time': timezone.now().isoformat(),
+            'vendor': connection.vendor,
+            'questions': Question.objects.count(),
+            'endpoints': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(data, file, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+        if options['compare']:
+            self.compare(options['compare'], results, options['threshold'])
+
+    @staticmethod
+    def measure(client, calls):
+        timings = []
+        queries = []
+        errors = 0
+        started = time.perf_counter()
+        for method, url, data in calls:
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                response = getattr(client, method)(url, data)
+                timings.append((time.perf_counter() - start) * 1000)
+            queries.append(len(context.captured_queries))
+            errors += response.status_code >= 400
+        elapsed = time.perf_counter() - started
+        timings.sort()
+        return {
+            'requests': len(timings),
+            'errors': errors,
+            'mean_ms': round(statistics.mean(timings), 3),
+            'p50_ms': round(percentile(timings, 50), 3),
+            'p95_ms': round(percentile(timings, 95), 3),
+            'p99_ms': round(percentile(timings, 99), 3),
+            'queries': round(statistics.mean(queries), 2),
+            'rps': round(len(timings) / elapsed, 1),
+        }
+
+    def report(self, name, result):
+        self.stdout.write(
+            f"{name:<15} p50 {result['p50_ms']:8.2f} ms  p95 {result['p95_ms']:8.2f} ms  "
+            f"p99 {result['p99_ms']:8.2f} ms  {result['queries']:6.1f} queries  {result['rps']:7.1f} rps"
+            + (f"  {result['errors']} errors" if result['errors'] else '')
+        )
+
+    def compare(self, path, results, threshold):
+        with open(path) as file:
+            baseline = json.load(file)
+        self.stdout.write(f"Compared with {baseline.get('commit') or path}:")
+        regressions = []
+        for name, result in results.items():
+            base = baseline['endpoints'].get(name)
+            if not base:
+                continue
+            change = (result['p95_ms'] - base['p95_ms']) / base['p95_ms'] * 100 if base['p95_ms'] else 0
+            line = f"{name:<15} p95 {base['p95_ms']:8.2f} -> {result['p95_ms']:8.2f} ms ({change:+.0f}%)  " \
+                   f"queries {base['queries']:.1f} -> {result['queries']:.1f}"
+            if change > threshold or result['queries'] > base['queries'] + QUERY_TOLERANCE:
+                regressions.append(name)
+                line = self.style.ERROR(line)
+            self.stdout.write(line)
+        if regressions:
+            raise CommandError(f'Regression over {threshold}% in: {", ".join(regressions)}')
+        self.stdout.write(self.style.SUCCESS('No regressions'))
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ratio', type=int, default=0, help='Сначала заполнить базу через fill_db с этим коэффициентом')
+        parser.add_argument('--requests', type=int, default=100, help='Число замеряемых запросов на страницу')
+        parser.add_argument('--warmup', type=int, default=5, help='Число прогревочных запросов на страницу')
+        parser.add_argument('--endpoints', nargs='+', help=f'Какие страницы замерять: {", ".join(ENDPOINTS)}')
+        parser.add_argument('--seed', type=int, default=0, help='Зерно генератора данных и запросов')
+        parser.add_argument('--output', help='Файл для результатов в JSON')
+        parser.add_argument('--compare', help='JSON с прошлого запуска для сравнения')
+        parser.add_argument('--threshold', type=float, default=20, help='Допустимый рост p95 в процентах')
@@ -0,0 +1,172 @@
+import asyncio
+import importlib
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from io import BytesIO
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.test import override_settings
+from django.urls import clear_url_caches, reverse
+from app.models import Question, Tag
+from .bench import percentile
+
+HOST = 'localhost'
+MODES = ['wsgi', 'asgi', 'asgi-sync']
+
+
+@contextmanager
+def views_mode(async_views):
+    # The url modules pick their views at import time, so they are reloaded for each mode.
+    with override_settings(ASYNC_VIEWS=async_views, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, HOST],
+                           REQUEST_LOG_SAMPLE_RATE=0):
+        for module in ('app.urls', settings.ROOT_URLCONF):
+            importlib.reload(importlib.import_module(module))
+        clear_url_caches()
+        try:
+            yield
+        finally:
+            for module in ('app.urls', settings.ROOT_URLCONF):
+                importlib.reload(importlib.import_module(module))
+            clear_url_caches()
+
+
+def wsgi_get(application, url):
+    parts = urlsplit(url)
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': parts.path,
+        'QUERY_STRING': parts.query,
+        'SERVER_NAME': HOST,
+        'SERVER_PORT': '80',
+        'HTTP_HOST': HOST,
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.input': BytesIO(),
+        'wsgi.errors': BytesIO(),
+        'wsgi.url_scheme': 'http',
+        'wsgi.version': (1, 0),
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    status = []
+    body = application(environ, lambda code, headers: status.append(code))
+    try:
+        b''.join(body)
+    finally:
+        body.close()
+    return int(status[0].split()[0])
+
+
+async def asgi_get(application, url):
+    parts = urlsplit(url)
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': parts.path,
+        'raw_path': parts.path.encode(),
+        'query_string': parts.query.encode(),
+        'root_path': '',
+        'headers': [(b'host', HOST.encode())],
+        'server': (HOST, 80),
+        'client': ('127.0.0.1', 50000),
+    }
+    status = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await application(scope, receive, send)
+    return status[0]
+
+
+class Command(BaseCommand):
+    help = 'Compare throughput of sync views under WSGI with async views under ASGI for concurrent clients'
+
+    def handle(self, *args, **options):
+        if not Question.objects.exists():
+            raise CommandError('Database is empty, run fill_db first')
+        rnd = random.Random(options['seed'])
+        max_id = Question.objects.order_by('-id').values_list('id', flat=True).first()
+        tags = list(Tag.objects.get_popular(50))
+        pages = [reverse('index'), reverse('hot_questions'), reverse('best_questions'), reverse('new_questions')]
+        urls = []
+        for _ in range(options['requests']):
+            kind = rnd.random()
+            if kind < 0.4:
+                urls.append(rnd.choice(pages))
+            elif kind < 0.6 and tags:
+                urls.append(reverse('tag_questions', args=[rnd.choice(tags)]))
+            else:
+                urls.append(reverse('question', args=[rnd.randint(1, max_id)]))
+
+        # Without the page cache every request renders; with it both modes mostly measure cache reads.
+        timeout = {} if options['page_cache'] else {'PAGE_CACHE_TIMEOUT': 0}
+        with override_settings(**timeout):
+            for mode in options['modes']:
+                with views_mode(mode == 'asgi'):
+                    if mode == 'wsgi':
+                        result = self.run_wsgi(urls, options['concurrency'])
+                    else:
+                        result = asyncio.run(self.run_asgi(urls, options['concurrency']))
+                self.report(mode, *result)
+
+    @staticmethod
+    def run_wsgi(urls, concurrency):
+        application = get_wsgi_application()
+
+        def timed(url):
+            start = time.perf_counter()
+            status = wsgi_get(application, url)
+            return (time.perf_counter() - start) * 1000, status
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(timed, urls))
+        return results, time.perf_counter() - started
+
+    @staticmethod
+    async def run_asgi(urls, concurrency):
+        application = get_asgi_application()
+        queue = list(reversed(urls))
+        results = []
+
+        async def client():
+            while queue:
+                url = queue.pop()
+                start = time.perf_counter()
+                status = await asgi_get(application, url)
+                results.append(((time.perf_counter() - start) * 1000, status))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        return results, time.perf_counter() - started
+
+    def report(self, mode, results, elapsed):
+        timings = sorted(timing for timing, _ in results)
+        errors = sum(status >= 500 for _, status in results)
+        self.stdout.write(
+            f'{mode:<10} {len(results) / elapsed:7.1f} rps  mean {statistics.mean(timings):8.2f} ms  '
+            f'p50 {percentile(timings, 50):8.2f} ms  p95 {percentile(timings, 95):8.2f} ms  '
+            f'p99 {percentile(timings, 99):8.2f} ms' + (f'  {errors} errors' if errors else '')
+        )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Число запросов на режим')
+        parser.add_argument('--concurrency', type=int, default=20, help='Число одновременных клиентов')
+        parser.add_argument('--modes', nargs='+', choices=MODES, default=MODES, help='Какие режимы сравнивать')
+        parser.add_argument('--page-cache', action='store_true', help='Не отключать кеш страниц')
+        parser.add_argument('--seed', type=int, default=0, help='Зерно генератора адресов')
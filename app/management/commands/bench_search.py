@@ -0,0 +1,54 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from app.models import Question, SearchTerm
+from app.search import search_ids, tokenize
+
+
+class Command(BaseCommand):
+    help = 'Measure full-text search latency on the current database'
+
+    def handle(self, *args, **options):
+        rnd = random.Random(options['seed'])
+        total = Question.objects.count()
+        terms = SearchTerm.objects.count()
+        if not terms:
+            self.stderr.write('Search index is empty, run rebuild_search_index first')
+            return
+        self.stdout.write(f'{total} questions, {terms} terms')
+
+        max_id = Question.objects.order_by('-id').values_list('id', flat=True).first()
+        queries = []
+        while len(queries) < options['queries']:
+            title = Question.objects.filter(id__gte=rnd.randint(1, max_id)).order_by('id').values_list(
+                'title', flat=True
+            ).first()
+            words = tokenize(title or '')
+            if words:
+                queries.append(' '.join(rnd.sample(words, min(options['words'], len(words)))))
+
+        timings = []
+        for query in queries:
+            start = time.perf_counter()
+            ids = list(search_ids(query)[:options['page_size']])
+            Question.objects.get_all(ids)
+            timings.append((time.perf_counter() - start) * 1000)
+
+        timings.sort()
+
+        def percentile(p):
+            return timings[min(len(timings) - 1, int(len(timings) * p / 100))]
+
+        self.stdout.write(
+            f"{len(timings)} queries of {options['words']} words: "
+            f'mean {statistics.mean(timings):.2f} ms, p50 {percentile(50):.2f} ms, '
+            f'p95 {percentile(95):.2f} ms, p99 {percentile(99):.2f} ms'
+        )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queries', type=int, default=200, help='Число поисковых запросов')
+        parser.add_argument('--words', type=int, default=2, help='Слов в запросе')
+        parser.add_argument('--page-size', type=int, default=10, help='Размер страницы выдачи')
+        parser.add_argument('--seed', type=int, default=0, help='Зерно генератора запросов')
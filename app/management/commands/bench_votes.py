@@ -0,0 +1,130 @@
+import random
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from app.models import Question, Answer, QuestionLike, AnswerLike, Profile
+from app.vote_buffer import VoteBuffer
+from .bench import percentile
+
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE')
+
+
+class WriteCounter:
+    # Counts write statements on every connection, the flush thread's included.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.writes = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.lstrip().upper().startswith(WRITE_STATEMENTS):
+            with self.lock:
+                self.writes += 1
+        return execute(sql, params, many, context)
+
+    def install(self, connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def __enter__(self):
+        connection_created.connect(self.install)
+        for conn in connections.all():
+            self.install(conn)
+        return self
+
+    def __exit__(self, *exc):
+        connection_created.disconnect(self.install)
+        for conn in connections.all():
+            if self in conn.execute_wrappers:
+                conn.execute_wrappers.remove(self)
+
+
+class Command(BaseCommand):
+    help = 'Compare latency and database writes of synchronous votes with the write-behind vote buffer'
+
+    def handle(self, *args, **options):
+        if not Question.objects.exists() or not Answer.objects.exists():
+            raise CommandError('Database is empty, run fill_db first')
+        voters = []
+        for i in range(options['voters']):
+            user, created = User.objects.get_or_create(username=f'bench-voter{i}')
+            voters.append(Profile.objects.create(user=user) if created else user.profile)
+
+        rnd = random.Random(options['seed'])
+        question_ids = list(Question.objects.order_by('?').values_list('id', flat=True)[:options['objects']])
+        answer_ids = list(Answer.objects.order_by('?').values_list('id', flat=True)[:options['objects']])
+        # Users click the same few objects, so some clicks fold into earlier ones. Both
+        # modes replay the same clicks; each leaves its changes in the database.
+        clicks = []
+        for _ in range(options['clicks']):
+            if rnd.random() < 0.5:
+                click = QuestionLike.objects, Question, rnd.choice(question_ids)
+            else:
+                click = AnswerLike.objects, Answer, rnd.choice(answer_ids)
+            clicks.append((*click, rnd.choice(voters), rnd.choice(['like', 'dislike'])))
+        objs = {Question: Question.objects.in_bulk(question_ids), Answer: Answer.objects.in_bulk(answer_ids)}
+        clicks = [(manager, objs[model][id], profile, vote) for manager, model, id, profile, vote in clicks]
+
+        threads = options['threads']
+        self.report('sync', *self.run(clicks, threads, lambda manager, obj, profile, vote: manager.create_or_change_like(
+            obj, profile, vote
+        )))
+
+        directory = tempfile.mkdtemp()
+        try:
+            buffer = VoteBuffer(directory, options['flush_ms'] / 1000, options['fsync'])
+            self.report('buffered', *self.run(clicks, threads, lambda manager, obj, profile, vote: buffer.vote(
+                manager, obj.pk, profile.pk, manager.like_enum[vote]
+            ), buffer.close))
+        finally:
+            shutil.rmtree(directory)
+
+    @staticmethod
+    def run(clicks, threads, vote, finish=None):
+        timings = []
+
+        def client(clicks):
+            try:
+                for click in clicks:
+                    start = time.perf_counter()
+                    vote(*click)
+                    timings.append((time.perf_counter() - start) * 1000)
+            finally:
+                if threads > 1:
+                    connection.close()
+
+        with WriteCounter() as counter:
+            started = time.perf_counter()
+            if threads > 1:
+                with ThreadPoolExecutor(threads) as pool:
+                    list(pool.map(client, [clicks[i::threads] for i in range(threads)]))
+            else:
+                client(clicks)
+            if finish:
+                finish()
+            elapsed = time.perf_counter() - started
+        return sorted(timings), elapsed, counter.writes
+
+    def report(self, mode, timings, elapsed, writes):
+        self.stdout.write(
+            f'{mode:<9} {len(timings) / elapsed:8.1f} votes/s  mean {statistics.mean(timings):7.3f} ms  '
+            f'p50 {percentile(timings, 50):7.3f} ms  p99 {percentile(timings, 99):7.3f} ms  '
+            f'{writes} writes ({writes / len(timings):.2f} per vote)'
+        )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clicks', type=int, default=2000, help='Число кликов на режим')
+        parser.add_argument('--voters', type=int, default=20, help='Число голосующих пользователей')
+        parser.add_argument('--objects', type=int, default=50, help='Число вопросов и ответов под голосование')
+        parser.add_argument('--threads', type=int, default=1, help='Число одновременно голосующих потоков')
+        parser.add_argument('--flush-ms', type=int, default=200, help='Интервал записи буфера в миллисекундах')
+        parser.add_argument('--fsync', action='store_true', help='fsync журнала после каждого клика')
+        parser.add_argument('--seed', type=int, default=0, help='Зерно генератора кликов')
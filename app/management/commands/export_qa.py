@@ -0,0 +1,71 @@
+import os
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+from app.dump import FORMAT, MODELS, VERSION, get_fields, get_rate, load_checkpoint, save_checkpoint, write_member
+
+
+class Command(BaseCommand):
+    help = 'Export questions, answers, tags and likes with their authors to a gzip JSON Lines file'
+
+    def handle(self, *args, **options):
+        path = options['output']
+        checkpoint = path + '.export-checkpoint'
+        labels = [model._meta.label_lower for model in MODELS]
+        state = load_checkpoint(checkpoint)
+        if state:
+            self.stdout.write(f'Resuming {state["model"]} after id {state["last"]}')
+            file = open(path, 'r+b')
+            # Whatever follows the last whole chunk was cut short by the interruption
+            file.truncate(state['offset'])
+            file.seek(state['offset'])
+        else:
+            # Rows added while the export runs are left out, so a like never points at an
+            # answer that came too late for the answers section.
+            bounds = {label: model.objects.aggregate(last=Max('pk'))['last'] or 0
+                      for label, model in zip(labels, MODELS)}
+            state = {'model': labels[0], 'last': None, 'rows': 0, 'offset': 0, 'bounds': bounds}
+            file = open(path, 'wb')
+            self.write(file, [{'format': FORMAT, 'version': VERSION, 'bounds': bounds}], state, checkpoint, options)
+
+        total, started = 0, time.monotonic()
+        with file:
+            first = labels.index(state['model']) if state['model'] else len(labels)
+            for index in range(first, len(labels)):
+                total += self.export(file, MODELS[index], state, checkpoint, options)
+                rows = state['rows']
+                state.update(model=labels[index + 1] if index + 1 < len(labels) else None, last=None, rows=0)
+                self.write(file, [{'end': labels[index], 'rows': rows}], state, checkpoint, options)
+        os.remove(checkpoint)
+        self.stdout.write(self.style.SUCCESS(f'Exported {total} rows, {get_rate(total, started):.0f} rows/s'))
+
+    def export(self, file, model, state, checkpoint, options):
+        label = model._meta.label_lower
+        fields = get_fields(model)
+        if state['last'] is None:
+            state['last'] = 0
+            self.write(file, [{'model': label, 'fields': fields}], state, checkpoint, options)
+        pk = fields.index(model._meta.pk.attname)
+        rows = model.objects.filter(pk__gt=state['last'], pk__lte=state['bounds'][label]).order_by('pk')
+        rows = rows.values_list(*fields).iterator(chunk_size=options['chunk_size'])
+        exported, started = 0, time.monotonic()
+        while chunk := list(islice(rows, options['chunk_size'])):
+            state['last'] = chunk[-1][pk]
+            state['rows'] += len(chunk)
+            exported += len(chunk)
+            self.write(file, [chunk], state, checkpoint, options)
+        self.stdout.write(f'{label}: {state["rows"]} rows, {get_rate(exported, started):.0f} rows/s')
+        return exported
+
+    @staticmethod
+    def write(file, lines, state, checkpoint, options):
+        write_member(file, lines, options['compress_level'])
+        state['offset'] = file.tell()
+        save_checkpoint(checkpoint, state)
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Файл выгрузки, .jsonl.gz')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Сколько строк читать и сжимать за раз')
+        parser.add_argument('--compress-level', type=int, default=6, help='Степень сжатия gzip, от 1 до 9')
@@ -1,76 +1,208 @@
-from django.core.management.base import BaseCommand
+import random
+import string
+from collections import Counter, deque
+from datetime import datetime, time as dt_time, timedelta, timezone
+from multiprocessing import Pool
+
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
-from app.models import Question, Answer, AnswerLike, QuestionLike, Tag, Profile
-from django.utils.crypto import get_random_string
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import F, Max
+from app.dump import historical_times
+from app.models import Question, Answer, AnswerLike, QuestionLike, QuestionTag, Tag, Profile
 from faker import Faker
-import random
 
-Fake = Faker()
+IMAGES = ['img/avatar-1.png', 'img/avatar-2.jpeg', 'img/avatar-3.jpeg']
+QUESTIONS_PER_USER = 10
+MAX_ANSWERS = 9
+MAX_LIKES = 9
+MAX_TAGS = 3
+PERIOD = timedelta(days=5 * 365)
+
+# Set in every worker by init_worker: (first profile id, profile count, tag ids, seed, end of period)
+_context = None
+
+
+def init_worker(context):
+    global _context
+    _context = context
+
+
+def generate_chunk(chunk):
+    # Builds one batch of questions with their answers, tags and likes as plain tuples.
+    # Rows point at each other by their position in the batch; the writer turns positions
+    # into ids, so a chunk depends only on its number and the seed, never on the database.
+    first_profile, profile_count, tag_ids, seed, end = _context
+    number, size = chunk
+    rnd = random.Random(seed * 1000003 + number)
+    fake = Faker()
+    fake.seed_instance(seed * 1000003 + number)
+
+    def profile():
+        return first_profile + rnd.randrange(profile_count)
+
+    def likes(target):
+        authors = rnd.sample(range(profile_count), min(rnd.randrange(MAX_LIKES + 1), profile_count))
+        return [(target, first_profile + author, rnd.choice((1, -1))) for author in authors]
+
+    questions, answers, question_tags, question_likes, answer_likes = [], [], [], [], []
+    tag_counts, profile_counts = Counter(), Counter()
+    for i in range(size):
+        time = end - PERIOD * rnd.random()
+        for tag in rnd.sample(tag_ids, min(rnd.randint(1, MAX_TAGS), len(tag_ids))):
+            question_tags.append((i, tag, time))
+            tag_counts[tag] += 1
+        new_likes = likes(i)
+        question_likes.extend(new_likes)
+        answer_count = rnd.randrange(MAX_ANSWERS + 1)
+        for _ in range(answer_count):
+            author = profile()
+            new_answer_likes = likes(len(answers))
+            answer_likes.extend(new_answer_likes)
+            answers.append((
+                i, author, fake.text(max_nb_chars=rnd.randrange(30, 330)),
+                time + (end - time) * rnd.random(),
+                sum(like[2] for like in new_answer_likes)
+            ))
+            profile_counts[author] += 1
+        questions.append((
+            profile(), fake.text(max_nb_chars=rnd.randrange(10, 30)), fake.text(max_nb_chars=rnd.randrange(30, 730)),
+            time, sum(like[2] for like in new_likes), answer_count
+        ))
+    return questions, answers, question_tags, question_likes, answer_likes, tag_counts, profile_counts
+
+
+def generate_ahead(pool, chunks, window):
+    # Chunks in order, with at most window of them generated or waiting for the writer.
+    # Pool.imap would run ahead of a slow database and keep every finished chunk in memory.
+    pending = deque()
+    for chunk in chunks:
+        if len(pending) >= window:
+            yield pending.popleft().get()
+        pending.append(pool.apply_async(generate_chunk, (chunk,)))
+    while pending:
+        yield pending.popleft().get()
+
+
+def next_id(model):
+    return (model.objects.aggregate(last=Max('id'))['last'] or 0) + 1
 
 
 class Command(BaseCommand):
     help = 'Fiil database with fake data'
-    images = ['img/avatar-1.png', 'img/avatar-2.jpeg', 'img/avatar-3.jpeg']
 
     def handle(self, *args, **options):
         ratio = options['ratio']
-        words = list(set([get_random_string(int((random.random() * 100)) % 6 + 1) for _ in range(ratio * 2)]))[:ratio]
-        # tags_words = list(set([Fake.word() for _ in range(ratio * 2)]))[:ratio]
-        print(len(words))
-        tags = [Tag(title=word) for word in words]
-        Tag.objects.bulk_create(tags)
-        users = []
-        profiles = []
-        for i in range(ratio):
-            user = User(username=get_random_string(7), email='', password='1234567890')
-            users.append(user)
-            profiles.append(Profile(user=user, avatar=Fake.word(ext_word_list=self.images)))
-        User.objects.bulk_create(users)
-        Profile.objects.bulk_create(profiles)
-        questions = []
-        answers = []
-        questions_likes = []
-        answers_likes = []
-        for i in range(ratio * 10):
-            time = Fake.date_between()
-            question = Question(
-                author=profiles[int((random.random() * 10000)) % ratio],
-                title=Fake.text(max_nb_chars=int((random.random() * 10000)) % 20 + 10),
-                description=Fake.text(max_nb_chars=int((random.random() * 10000)) % 700 + 30),
-                creating_time=Fake.date_time_between()
+        batch_size = options['batch_size']
+        seed = options['seed']
+        rnd = random.Random(seed)
+
+        words = {
+            ''.join(rnd.choices(string.ascii_lowercase, k=rnd.randint(1, 6))) for _ in range(ratio * 2)
+        }
+        titles = sorted(words)[:ratio]
+        rnd.shuffle(titles)
+        for start in range(0, len(titles), batch_size):
+            Tag.objects.bulk_create(
+                [Tag(title=title) for title in titles[start:start + batch_size]], ignore_conflicts=True
+            )
+        tag_ids = list(Tag.objects.order_by('id').values_list('id', flat=True))
+        self.stdout.write(f'Tags: {len(tag_ids)}')
+
+        first_user, first_profile = next_id(User), next_id(Profile)
+        password = make_password('1234567890')
+        for start in range(0, ratio, batch_size):
+            ids = range(start, min(start + batch_size, ratio))
+            with transaction.atomic():
+                User.objects.bulk_create([
+                    User(id=first_user + i, username=f'user{first_user + i}', email='', password=password)
+                    for i in ids
+                ])
+                Profile.objects.bulk_create([
+                    Profile(id=first_profile + i, user_id=first_user + i, avatar=rnd.choice(IMAGES)) for i in ids
+                ])
+        self.stdout.write(f'Users: {ratio}')
+
+        total = ratio * QUESTIONS_PER_USER
+        chunks = [(number, min(batch_size, total - start)) for number, start in enumerate(range(0, total, batch_size))]
+        # Midnight rather than now, so the same seed gives the same timestamps all day.
+        end = datetime.combine(datetime.now(timezone.utc).date(), dt_time(), timezone.utc)
+        context = (first_profile, ratio, tag_ids, seed, end)
+        tag_counts, profile_counts = Counter(), Counter()
+        next_question, next_answer = next_id(Question), next_id(Answer)
+        done = 0
+
+        if options['workers'] > 1:
+            pool = Pool(options['workers'], initializer=init_worker, initargs=(context,))
+            results = generate_ahead(pool, chunks, 2 * options['workers'])
+        else:
+            pool = None
+            init_worker(context)
+            results = map(generate_chunk, chunks)
+        try:
+            with historical_times(Question, Answer):
+                for chunk in results:
+                    self.write_chunk(chunk, next_question, next_answer, batch_size)
+                    tag_counts.update(chunk[5])
+                    profile_counts.update(chunk[6])
+                    next_question += len(chunk[0])
+                    next_answer += len(chunk[1])
+                    done += len(chunk[0])
+                    self.stdout.write(f'Questions: {done}/{total}')
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+        with transaction.atomic():
+            Tag.objects.bulk_update(
+                [Tag(id=id, question_count=F('question_count') + count) for id, count in tag_counts.items()],
+                ['question_count'], batch_size=batch_size
             )
-            for _ in range(int((random.random() * 100)) % 10):
-                questions_likes.append(QuestionLike(
-                    question=question,
-                    type=1 if int((random.random() * 100)) % 2 == 0 else -1,
-                    author=profiles[int((random.random() * 10000)) % ratio]
-                ))
-            for _ in range(int((random.random() * 100)) % 10):
-                answer = Answer(
-                    author=profiles[int((random.random() * 10000)) % ratio],
-                    description=Fake.text(max_nb_chars=int((random.random() * 10000)) % 300 + 30),
-                    creating_time=Fake.date_time_between(time),
-                    question=question
+            Profile.objects.bulk_update(
+                [Profile(id=id, answer_count=F('answer_count') + count) for id, count in profile_counts.items()],
+                ['answer_count'], batch_size=batch_size
+            )
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [User, Profile, Question, Answer]):
+                cursor.execute(sql)
+        self.stdout.write(self.style.SUCCESS(
+            'Done, run rebuild_search_index to make the new questions searchable'
+        ))
+
+    @staticmethod
+    def write_chunk(chunk, first_question, first_answer, batch_size):
+        questions, answers, question_tags, question_likes, answer_likes = chunk[:5]
+        with transaction.atomic():
+            Question.objects.bulk_create([
+                Question(
+                    id=first_question + i, author_id=author, title=title, description=description,
+                    creating_time=time, editing_time=time, rating=rating, answer_count=answer_count,
+                    hot_score=Question.objects.hot_score(rating, answer_count, time)
                 )
-                for _ in range(int((random.random() * 100)) % 10):
-                    answers_likes.append(AnswerLike(
-                        answer=answer,
-                        type=1 if int((random.random() * 100)) % 2 == 0 else -1,
-                        author=profiles[int((random.random() * 10000)) % ratio]
-                    ))
-                answers.append(answer)
-            questions.append(question)
-        Question.objects.bulk_create(questions)
-        Answer.objects.bulk_create(answers)
-        AnswerLike.objects.bulk_create(answers_likes)
-        QuestionLike.objects.bulk_create(questions_likes)
-        q_obj = Question.objects.filter(tags__isnull=True)
-        tags_obj = Tag.objects.order_by('?')
-        tags_ids = list(tags_obj.values_list('id'))
-        print((int((random.random() * 10)) % 4 + 1))
-        for query in q_obj:
-            for i in range(int((random.random() * 10)) % 3 + 1):
-                query.tags.add(Tag.objects.get(pk=tags_ids[int((random.random() * 100000)) % len(tags_ids)][0]))
+                for i, (author, title, description, time, rating, answer_count) in enumerate(questions)
+            ], batch_size=batch_size)
+            QuestionTag.objects.bulk_create([
+                QuestionTag(question_id=first_question + i, tag_id=tag, creating_time=time)
+                for i, tag, time in question_tags
+            ], batch_size=batch_size)
+            QuestionLike.objects.bulk_create([
+                QuestionLike(question_id=first_question + i, author_id=author, type=type)
+                for i, author, type in question_likes
+            ], batch_size=batch_size)
+            Answer.objects.bulk_create([
+                Answer(
+                    id=first_answer + i, question_id=first_question + question, author_id=author,
+                    description=description, creating_time=time, editing_time=time, rating=rating
+                )
+                for i, (question, author, description, time, rating) in enumerate(answers)
+            ], batch_size=batch_size)
+            AnswerLike.objects.bulk_create([
+                AnswerLike(answer_id=first_answer + i, author_id=author, type=type)
+                for i, author, type in answer_likes
+            ], batch_size=batch_size)
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -78,4 +210,22 @@ class Command(BaseCommand):
             type=int,
             default=0,
             help='Коэфициент заполнения сущностей'
-        )
\ No newline at end of file
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Сколько вопросов генерировать и записывать за раз'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Число процессов, генерирующих данные'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Начальное значение генератора, один seed даёт одни и те же данные'
+        )
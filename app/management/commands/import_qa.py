@@ -0,0 +1,92 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from app.dump import FORMAT, MODELS, VERSION, get_fields, get_rate, historical_times, load_checkpoint, read_lines, \
+    save_checkpoint
+
+
+class Command(BaseCommand):
+    help = 'Import an export_qa file into a freshly migrated database'
+
+    def handle(self, *args, **options):
+        path = options['input']
+        checkpoint = path + '.import-checkpoint'
+        models = {model._meta.label_lower: model for model in MODELS}
+        # Sections before the checkpoint's are in, and its first rows of that one
+        state = load_checkpoint(checkpoint)
+        resuming = state is not None
+        if resuming:
+            self.stdout.write(f'Resuming section {state["section"]} after {state["rows"]} rows')
+        elif any(model.objects.exists() for model in MODELS):
+            raise CommandError('The database already has users or questions, import into a freshly migrated one')
+        else:
+            state = {'section': 0, 'rows': 0}
+
+        lines = read_lines(path)
+        header = next(lines, None)
+        if not isinstance(header, dict) or header.get('format') != FORMAT:
+            raise CommandError(f'{path} is not an export_qa file')
+        if header['version'] > VERSION:
+            raise CommandError(f'{path} has format version {header["version"]}, this one reads up to {VERSION}')
+
+        section, model, fields, rows, imported = -1, None, None, 0, 0
+        total, started, section_started = 0, time.monotonic(), time.monotonic()
+        # As in loaddata: foreign keys are checked once at the end, not on every insert
+        with connection.constraint_checks_disabled(), historical_times(*MODELS):
+            for line in lines:
+                if isinstance(line, list):
+                    rows += len(line)
+                    if section < state['section'] or section == state['section'] and rows <= state['rows']:
+                        continue
+                    # The chunk right after the checkpoint may have been committed
+                    # without the checkpoint that says so
+                    self.write(model, fields, line, resuming, options)
+                    resuming = False
+                    imported += len(line)
+                    total += len(line)
+                    state.update(section=section, rows=rows)
+                    save_checkpoint(checkpoint, state)
+                elif 'model' in line:
+                    if line['model'] not in models:
+                        raise CommandError(f'{path} has rows of {line["model"]}, which are not imported')
+                    model, fields = models[line['model']], line['fields']
+                    unknown = set(fields) - set(get_fields(model))
+                    if unknown:
+                        raise CommandError(f'{line["model"]} has no fields {", ".join(sorted(unknown))}')
+                    section, rows, imported, section_started = section + 1, 0, 0, time.monotonic()
+                elif 'end' in line:
+                    if line['rows'] != rows:
+                        raise CommandError(f'{line["end"]} should have {line["rows"]} rows, the file has {rows}')
+                    if imported:
+                        self.stdout.write(
+                            f'{line["end"]}: {rows} rows, {get_rate(imported, section_started):.0f} rows/s'
+                        )
+                    model = None
+            if model is not None:
+                raise CommandError(f'{path} ends inside {model._meta.label_lower}, was the export finished?')
+
+        connection.check_constraints(table_names=[model._meta.db_table for model in MODELS])
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), MODELS):
+                cursor.execute(sql)
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {total} rows, {get_rate(total, started):.0f} rows/s, '
+            'run rebuild_search_index to make the questions searchable'
+        ))
+
+    @staticmethod
+    def write(model, fields, chunk, ignore_conflicts, options):
+        with transaction.atomic():
+            model.objects.bulk_create(
+                [model(**dict(zip(fields, row))) for row in chunk],
+                batch_size=options['batch_size'], ignore_conflicts=ignore_conflicts
+            )
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='Файл, записанный export_qa')
+        parser.add_argument('--batch-size', type=int, default=500, help='Сколько строк вставлять одним запросом')
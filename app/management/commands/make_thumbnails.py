@@ -0,0 +1,38 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from app.models import Profile
+from app.thumbnails import make_thumbnails
+
+
+class Command(BaseCommand):
+    help = 'Make the avatar thumbnails of existing profiles'
+
+    def handle(self, *args, **options):
+        profiles = Profile.objects.exclude(avatar='').exclude(avatar=None)
+        if not options['force']:
+            profiles = profiles.filter(avatar_thumbnail='')
+        # Many profiles share an avatar (the default one, fill_db's), each is made once.
+        names = list(profiles.order_by().values_list('avatar', flat=True).distinct())
+
+        def make(name):
+            try:
+                return make_thumbnails(name, options['force']), None
+            except Exception as error:
+                return None, error
+
+        made = failed = 0
+        # Pillow releases the GIL while it decodes, resizes and encodes
+        with ThreadPoolExecutor(options['workers']) as pool:
+            for name, (prefix, error) in zip(names, pool.map(make, names)):
+                if error:
+                    failed += 1
+                    self.stderr.write(f'{name}: {error}')
+                    continue
+                made += 1
+                profiles.filter(avatar=name).update(avatar_thumbnail=prefix)
+        self.stdout.write(f'Made thumbnails of {made} avatars' + (f', {failed} failed' if failed else ''))
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Число потоков')
+        parser.add_argument('--force', action='store_true', help='Пересоздать уже готовые миниатюры')
@@ -0,0 +1,33 @@
+import time
+from importlib import import_module
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = 'Delete expired sessions in batches, so the table is never locked for long'
+
+    def handle(self, *args, **options):
+        store = import_module(settings.SESSION_ENGINE).SessionStore
+        if not hasattr(store, 'get_model_class'):
+            # Cache and cookie sessions expire by themselves
+            self.stdout.write(f'{settings.SESSION_ENGINE} keeps no sessions in the database')
+            return
+        model = store.get_model_class()
+        now = timezone.now()
+        deleted = 0
+        while True:
+            # expire_date is indexed, each batch is an index range scan
+            keys = list(model.objects.filter(expire_date__lt=now).values_list('pk', flat=True)[:options['batch_size']])
+            if not keys:
+                break
+            deleted += model.objects.filter(pk__in=keys).delete()[0]
+            if options['pause']:
+                time.sleep(options['pause'] / 1000)
+        self.stdout.write(f'Deleted {deleted} expired sessions')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Сколько сессий удалять за один запрос')
+        parser.add_argument('--pause', type=int, default=0, help='Пауза между пачками в миллисекундах')
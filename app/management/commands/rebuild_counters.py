@@ -0,0 +1,83 @@
+from functools import reduce
+from operator import or_
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from app.models import Question, Answer, QuestionLike, AnswerLike, QuestionTag, Tag, Profile
+
+
+class Command(BaseCommand):
+    help = 'Rebuild rating, answer and tag counters from the like, answer and tag tables'
+
+    def handle(self, *args, **options):
+        question_likes = QuestionLike.objects.filter(question=OuterRef('pk')).order_by().values('question')
+        answers = Answer.objects.filter(question=OuterRef('pk')).order_by().values('question')
+        answer_likes = AnswerLike.objects.filter(answer=OuterRef('pk')).order_by().values('answer')
+        tagged = QuestionTag.objects.filter(tag=OuterRef('pk')).order_by().values('tag')
+        authored = Answer.objects.filter(author=OuterRef('pk')).order_by().values('author')
+
+        question_counters = {
+            'rating': Coalesce(Subquery(question_likes.annotate(total=Sum('type')).values('total')), 0),
+            'answer_count': Coalesce(Subquery(answers.annotate(cnt=Count('pk')).values('cnt')), 0),
+        }
+        self.fix(Question, question_counters, options, lambda batch: {
+            # Moves with the counters it is made of, in the same statement
+            'hot_score': Question.objects.hot_score_expression(
+                {question.pk: question.creating_time for question in batch}, **question_counters
+            )
+        })
+        self.fix(Answer, {
+            'rating': Coalesce(Subquery(answer_likes.annotate(total=Sum('type')).values('total')), 0)
+        }, options)
+        self.fix(Tag, {
+            'question_count': Coalesce(Subquery(tagged.annotate(cnt=Count('pk')).values('cnt')), 0)
+        }, options)
+        self.fix(Profile, {
+            'answer_count': Coalesce(Subquery(authored.annotate(cnt=Count('pk')).values('cnt')), 0)
+        }, options)
+
+    def fix(self, model, counters, options, derived=None):
+        # counters maps a field to the expression that counts it. The rows are written by
+        # an UPDATE that evaluates the expressions again, so a vote or an answer added
+        # after the drifted rows were read is counted rather than overwritten.
+        drifted = model.objects.annotate(**{'actual_' + field: counter for field, counter in counters.items()}).filter(
+            reduce(or_, [~Q(**{field: F('actual_' + field)}) for field in counters])
+        ).order_by('pk')
+        last_id = 0
+        drift = 0
+        while True:
+            batch = list(drifted.filter(pk__gt=last_id)[:options['batch_size']])
+            if not batch:
+                break
+            last_id = batch[-1].pk
+            for obj in batch[:max(options['show'] - drift, 0)]:
+                changes = ', '.join(f'{field} {getattr(obj, field)} -> {getattr(obj, "actual_" + field)}'
+                                    for field in counters)
+                self.stdout.write(f'{model.__name__} #{obj.pk}: {changes}')
+            drift += len(batch)
+            if not options['dry_run']:
+                model.objects.filter(pk__in=[obj.pk for obj in batch]).update(
+                    **counters, **(derived(batch) if derived else {})
+                )
+        style = self.style.WARNING if drift else self.style.SUCCESS
+        self.stdout.write(style(f'{model.__name__}: {drift} rows drifted'))
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только отчёт о расхождениях, без исправления'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Размер пачки обновлений'
+        )
+        parser.add_argument(
+            '--show',
+            type=int,
+            default=10,
+            help='Сколько расхождений вывести'
+        )
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from app.models import Question
+
+
+class Command(BaseCommand):
+    help = 'Recompute question hot scores from rating, answer count and creation time'
+
+    def handle(self, *args, **options):
+        # Votes and answers move the score incrementally; a full pass picks up counters
+        # repaired by rebuild_counters and changes of the decay parameters.
+        last_id = 0
+        changed = 0
+        while True:
+            batch = list(Question.objects.filter(id__gt=last_id).order_by('id').values_list(
+                'id', 'rating', 'answer_count', 'creating_time', 'hot_score'
+            )[:options['batch_size']])
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            stale = {
+                pk: creating_time for pk, rating, answer_count, creating_time, hot_score in batch
+                if abs(hot_score - Question.objects.hot_score(rating, answer_count, creating_time)) > 1e-6
+            }
+            if stale and not options['dry_run']:
+                # Computed by the UPDATE from the row it writes: a vote between the read
+                # above and this statement moves rating and hot_score together and stays.
+                Question.objects.filter(pk__in=stale).update(
+                    hot_score=Question.objects.hot_score_expression(stale)
+                )
+            changed += len(stale)
+        self.stdout.write(f'Question: {changed} hot scores rebuilt')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только посчитать устаревшие значения, без исправления'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Размер пачки вопросов'
+        )
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from app.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index from questions and answers'
+
+    def handle(self, *args, **options):
+        done = rebuild_index(batch_size=options['batch_size'], stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(f'Search index rebuilt: {done} questions'))
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Сколько вопросов индексировать за раз'
+        )
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from app.sidebar import refresh_sidebar
+
+
+class Command(BaseCommand):
+    help = 'Prewarm the popular tags and best members sidebar cache'
+
+    def handle(self, *args, **options):
+        data = refresh_sidebar()
+        self.stdout.write(self.style.SUCCESS(
+            f"Sidebar cached: {len(data['ptags'])} tags, {len(data['bmembers'])} members"
+        ))
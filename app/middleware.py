@@ -0,0 +1,177 @@
+import json
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.backends.django import DjangoTemplates, Template
+
+logger = logging.getLogger('app.requests')
+
+IN_LIST_RE = re.compile(r'\(\s*%s(?:\s*,\s*%s)*\s*\)')
+NUMBER_RE = re.compile(r'\b\d+\b')
+
+_current = ContextVar('request_stats', default=None)
+
+
+class RequestStats:
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.rendering = False
+        self.statements = Counter()
+        # The queries of an async view run on several threads at once
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.db_time += elapsed
+                self.queries += 1
+                self.statements[sql] += 1
+
+    def duplicates(self, threshold):
+        # Statements differing only in the length of an IN list or in inlined numbers
+        # are the same query repeated, which is what an N+1 loop looks like.
+        fingerprints = Counter()
+        for sql, count in self.statements.items():
+            fingerprints[NUMBER_RE.sub('N', IN_LIST_RE.sub('(...)', sql))] += count
+        return [(sql, count) for sql, count in fingerprints.most_common() if count >= threshold]
+
+
+def record_query(execute, sql, params, many, context):
+    # Installed on every connection once. Async views run their queries on other
+    # threads with their own connections, so the request is found through the context
+    # variable, which asgiref copies into those threads.
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    return stats(execute, sql, params, many, context)
+
+
+def install_wrapper(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(install_wrapper)
+
+class TimedTemplate(Template):
+
+    def render(self, context=None, request=None):
+        stats = _current.get()
+        if stats is None or stats.rendering:
+            return super().render(context, request)
+        # Queries a template runs (lazy querysets, the sidebar) count as database time
+        # only; templates rendered from inside one are part of its time.
+        stats.rendering = True
+        start, db_start = time.perf_counter(), stats.db_time
+        try:
+            return super().render(context, request)
+        finally:
+            stats.rendering = False
+            stats.template_time += time.perf_counter() - start - (stats.db_time - db_start)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    # The Django template backend whose templates add their render time to the
+    # request's RequestStats, set as the BACKEND in TEMPLATES
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+class RequestTimingMiddleware:
+    # Counts queries and database, template, view and total time of every request,
+    # adds them to the Server-Timing header and writes a JSON log line for a sample of
+    # requests and for every request over budget.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        self.sample_rate = getattr(settings, 'REQUEST_LOG_SAMPLE_RATE', 0.01)
+        self.query_budget = getattr(settings, 'REQUEST_QUERY_BUDGET', 30)
+        self.time_budget = getattr(settings, 'REQUEST_TIME_BUDGET_MS', 500)
+        self.duplicate_threshold = getattr(settings, 'REQUEST_DUPLICATE_THRESHOLD', 5)
+        # Connections opened before the middleware was loaded missed the signal.
+        for connection in connections.all():
+            install_wrapper(connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, stats, start)
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, stats, start)
+
+    def finish(self, request, response, stats, start):
+        total = (time.perf_counter() - start) * 1000
+        db_time = stats.db_time * 1000
+        template_time = stats.template_time * 1000
+        # Whatever is neither a query nor a template: view code and the other middleware
+        view_time = max(total - db_time - template_time, 0)
+
+        response['Server-Timing'] = (
+            f'db;dur={db_time:.1f};desc="{stats.queries} queries", '
+            f'tpl;dur={template_time:.1f}, view;dur={view_time:.1f}, total;dur={total:.1f}'
+        )
+
+        over_budget = []
+        if stats.queries > self.query_budget:
+            over_budget.append('queries')
+        if total > self.time_budget:
+            over_budget.append('time')
+        duplicates = stats.duplicates(self.duplicate_threshold)
+        if duplicates:
+            over_budget.append('duplicates')
+        if over_budget or random.random() < self.sample_rate:
+            match = request.resolver_match
+            line = json.dumps({
+                'method': request.method,
+                'path': request.path,
+                'view': match.view_name if match else None,
+                'status': response.status_code,
+                'total_ms': round(total, 1),
+                'db_ms': round(db_time, 1),
+                'template_ms': round(template_time, 1),
+                'view_ms': round(view_time, 1),
+                'queries': stats.queries,
+                'duplicates': [{'sql': sql, 'count': count} for sql, count in duplicates],
+                'over_budget': over_budget,
+            })
+            logger.log(logging.WARNING if over_budget else logging.INFO, line)
+        return response
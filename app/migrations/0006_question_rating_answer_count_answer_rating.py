@@ -0,0 +1,49 @@
+# Generated by Django 4.1.7 on 2026-10-18 20:01
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    Question = apps.get_model('app', 'Question')
+    Answer = apps.get_model('app', 'Answer')
+    QuestionLike = apps.get_model('app', 'QuestionLike')
+    AnswerLike = apps.get_model('app', 'AnswerLike')
+
+    question_likes = QuestionLike.objects.filter(question=OuterRef('pk')).order_by().values('question')
+    answers = Answer.objects.filter(question=OuterRef('pk')).order_by().values('question')
+    answer_likes = AnswerLike.objects.filter(answer=OuterRef('pk')).order_by().values('answer')
+    Question.objects.update(
+        rating=Coalesce(Subquery(question_likes.annotate(total=Sum('type')).values('total')), 0),
+        answer_count=Coalesce(Subquery(answers.annotate(cnt=Count('pk')).values('cnt')), 0)
+    )
+    Answer.objects.update(
+        rating=Coalesce(Subquery(answer_likes.annotate(total=Sum('type')).values('total')), 0)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_alter_profile_avatar'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='answer',
+            name='rating',
+            field=models.IntegerField(default=0, verbose_name='Рейтинг'),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='answer_count',
+            field=models.IntegerField(default=0, verbose_name='Количество ответов'),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='rating',
+            field=models.IntegerField(default=0, verbose_name='Рейтинг'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.1.7 on 2026-10-18 20:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_question_rating_answer_count_answer_rating'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('word', models.CharField(max_length=40, unique=True, verbose_name='Слово')),
+                ('doc_count', models.IntegerField(default=0, verbose_name='Число вопросов')),
+            ],
+            options={
+                'verbose_name': 'Поисковый терм',
+                'verbose_name_plural': 'Поисковые термы',
+            },
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='search_length',
+            field=models.IntegerField(default=0, verbose_name='Длина в поисковом индексе'),
+        ),
+        migrations.CreateModel(
+            name='SearchPosting',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('frequency', models.IntegerField(default=0, verbose_name='Частота')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='postings', to='app.question', verbose_name='Вопрос')),
+                ('term', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='postings', to='app.searchterm', verbose_name='Терм')),
+            ],
+            options={
+                'verbose_name': 'Вхождение терма',
+                'verbose_name_plural': 'Вхождения термов',
+                'unique_together': {('term', 'question')},
+            },
+        ),
+    ]
@@ -0,0 +1,42 @@
+from collections import defaultdict
+
+from django.db import migrations
+
+
+def normalize(title):
+    return ' '.join(title.split()).lower()[:20]
+
+
+def merge_duplicate_tags(apps, schema_editor):
+    Tag = apps.get_model('app', 'Tag')
+    Question = apps.get_model('app', 'Question')
+    Through = Question.tags.through
+
+    groups = defaultdict(list)
+    for tag in Tag.objects.order_by('id'):
+        groups[normalize(tag.title)].append(tag)
+
+    for title, tags in groups.items():
+        keep, duplicates = tags[0], [tag.id for tag in tags[1:]]
+        if duplicates:
+            tagged = set(Through.objects.filter(tag_id=keep.id).values_list('question_id', flat=True))
+            moved = set(Through.objects.filter(tag_id__in=duplicates).values_list('question_id', flat=True))
+            Through.objects.bulk_create([
+                Through(question_id=question_id, tag_id=keep.id) for question_id in moved - tagged
+            ])
+            Through.objects.filter(tag_id__in=duplicates).delete()
+            Tag.objects.filter(id__in=duplicates).delete()
+        if keep.title != title:
+            keep.title = title
+            keep.save(update_fields=['title'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_tags, migrations.RunPython.noop),
+    ]
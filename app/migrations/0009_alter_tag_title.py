@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 20:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_merge_duplicate_tags'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tag',
+            name='title',
+            field=models.CharField(max_length=20, unique=True, verbose_name='Тег'),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 4.1.7 on 2026-10-18 20:25
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    Tag = apps.get_model('app', 'Tag')
+    Profile = apps.get_model('app', 'Profile')
+    Question = apps.get_model('app', 'Question')
+    Answer = apps.get_model('app', 'Answer')
+
+    tagged = Question.tags.through.objects.filter(tag=OuterRef('pk')).order_by().values('tag')
+    answers = Answer.objects.filter(author=OuterRef('pk')).order_by().values('author')
+    Tag.objects.update(question_count=Coalesce(Subquery(tagged.annotate(cnt=Count('pk')).values('cnt')), 0))
+    Profile.objects.update(answer_count=Coalesce(Subquery(answers.annotate(cnt=Count('pk')).values('cnt')), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_alter_tag_title'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='answer_count',
+            field=models.IntegerField(default=0, verbose_name='Количество ответов'),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='question_count',
+            field=models.IntegerField(default=0, verbose_name='Количество вопросов'),
+        ),
+        migrations.AddIndex(
+            model_name='answer',
+            index=models.Index(fields=['question', '-rating', 'id'], name='answer_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='profile',
+            index=models.Index(fields=['answer_count', 'id'], name='profile_best_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['creating_time', 'id'], name='question_new_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['rating', 'id'], name='question_best_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['answer_count', 'id'], name='question_hot_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['question_count', 'id'], name='tag_popular_idx'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+        migrations.RunSQL(
+            'CREATE INDEX app_auth_user_email_idx ON auth_user (email)',
+            'DROP INDEX app_auth_user_email_idx',
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.1.7 on 2026-10-18 20:26
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def copy_creating_time(apps, schema_editor):
+    Question = apps.get_model('app', 'Question')
+    QuestionTag = apps.get_model('app', 'QuestionTag')
+    QuestionTag.objects.update(
+        creating_time=Subquery(Question.objects.filter(pk=OuterRef('question_id')).values('creating_time')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_query_indexes'),
+    ]
+
+    operations = [
+        # The auto-created app_question_tags table becomes an explicit through model.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='QuestionTag',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.question', verbose_name='Вопрос')),
+                        ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.tag', verbose_name='Тег')),
+                    ],
+                    options={
+                        'verbose_name': 'Тег вопроса',
+                        'verbose_name_plural': 'Теги вопросов',
+                        'db_table': 'app_question_tags',
+                        'unique_together': {('question', 'tag')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='question',
+                    name='tags',
+                    field=models.ManyToManyField(blank=True, related_name='questions', through='app.QuestionTag', to='app.tag', verbose_name='Тег'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='questiontag',
+            name='creating_time',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Время создания вопроса'),
+        ),
+        migrations.RunPython(copy_creating_time, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='questiontag',
+            index=models.Index(fields=['tag', 'creating_time', 'question'], name='question_tag_new_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.1.7 on 2026-10-18 20:35
+
+from datetime import datetime, timezone
+
+from django.db import migrations, models
+
+HOT_EPOCH = datetime(2020, 1, 1, tzinfo=timezone.utc)
+HOT_DECAY = 45000
+HOT_ANSWER_WEIGHT = 2
+
+
+def fill_hot_score(apps, schema_editor):
+    Question = apps.get_model('app', 'Question')
+    last_id = 0
+    while True:
+        batch = list(Question.objects.filter(id__gt=last_id).order_by('id').only(
+            'id', 'rating', 'answer_count', 'creating_time'
+        )[:1000])
+        if not batch:
+            break
+        last_id = batch[-1].id
+        for question in batch:
+            age = (question.creating_time - HOT_EPOCH).total_seconds()
+            question.hot_score = question.rating + HOT_ANSWER_WEIGHT * question.answer_count + age / HOT_DECAY
+        Question.objects.bulk_update(batch, ['hot_score'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_question_tag_through'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='question',
+            name='question_hot_idx',
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='hot_score',
+            field=models.FloatField(default=0, verbose_name='Горячесть'),
+        ),
+        migrations.RunPython(fill_hot_score, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['hot_score', 'id'], name='question_hot_idx'),
+        ),
+    ]
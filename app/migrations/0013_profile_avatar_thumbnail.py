@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 21:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_hot_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='avatar_thumbnail',
+            field=models.CharField(blank=True, default='', max_length=64, verbose_name='Миниатюры аватарки'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_profile_avatar_thumbnail'),
+    ]
+
+    operations = [
+        # Email lookups compare LOWER(email), see ProfileManager.get_user_by_email
+        migrations.RunSQL(
+            'DROP INDEX app_auth_user_email_idx',
+            'CREATE INDEX app_auth_user_email_idx ON auth_user (email)',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX app_auth_user_email_lower_idx ON auth_user (LOWER(email))',
+            'DROP INDEX app_auth_user_email_lower_idx',
+        ),
+    ]
@@ -1,46 +1,100 @@
-from django.db import models
-from django.db.models import Count, Sum
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connections, models, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import Lower
 from django.contrib.auth.models import User
+from django.utils import timezone
 from django.core.exceptions import ObjectDoesNotExist
 
+from . import page_cache, vote_buffer
+from .votes import SAME_VOTE, compose_votes, toggle_vote
+
+
+def load_fields(queryset, ids, fields):
+    # Rows of ids in their order as dicts of fields, which map a name to (getter,
+    # select_related, prefetch_related). One query for the rows plus one per prefetched
+    # relation, whatever the number of ids; relations no field needs are not loaded.
+    ids = list(ids)
+    queryset = queryset.filter(pk__in=ids).order_by()
+    select = {select for _, select, _ in fields.values() if select}
+    prefetch = {prefetch for _, _, prefetch in fields.values() if prefetch}
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    by_id = {obj.pk: obj for obj in queryset}
+    return [{name: getter(by_id[id]) for name, (getter, _, _) in fields.items()} for id in ids if id in by_id]
+
 
 class QuestionManager(models.Manager):
 
+    # What the question templates show, see load_fields
+    page_fields = {
+        'id': (lambda query: query.pk, None, None),
+        'tags': (lambda query: query.tags.all(), None, 'tags'),
+        'answer_number': (lambda query: query.answer_count, None, None),
+        'title': (lambda query: query.title, None, None),
+        'text': (lambda query: query.description, None, None),
+        'like': (lambda query: query.rating, None, None),
+        'image': (lambda query: query.author.avatar, 'author', None),
+        'author_id': (lambda query: query.author_id, None, None),
+    }
+
     def get_obj(self, query):
-        return {
-                'id': query.pk,
-                'tags': query.tags.all(),
-                'answer_number': query.answer.count(),
-                'title': query.title,
-                'text': query.description,
-                'like': query.like.all().aggregate(Sum('type', default=0))['type__sum'],
-                'image': query.author.avatar
-            }
+        return {name: getter(query) for name, (getter, _, _) in self.page_fields.items()}
 
     def get_likes(self, q_id):
-        query = self.filter(pk=q_id).last()
-        return query.like.all().aggregate(Sum('type', default=0))['type__sum']
-
-    def get_all(self, ids):
-        data = []
-        for id in ids:
-            data.append(self.get_obj(self.filter(pk=id).last()))
-        return data
+        return self.filter(pk=q_id).values_list('rating', flat=True).last()
+
+    def get_all(self, ids, fields=None):
+        return load_fields(self.all(), ids, fields or self.page_fields)
+
+    new_ordering = ('-creating_time', '-id')
+    best_ordering = ('-rating', '-id')
+    hot_ordering = ('-hot_score', '-id')
+
+    # Hot score: activity plus the creation time in HOT_DECAY second units, so a
+    # question needs one more point of activity for every HOT_DECAY seconds it is
+    # older. Newer questions never lose points: the score only changes on writes,
+    # by the same amount as rating or answer_count.
+    hot_epoch = datetime(2020, 1, 1, tzinfo=dt_timezone.utc)
+    hot_decay = 45000
+    hot_answer_weight = 2
+
+    def hot_score(self, rating, answer_count, creating_time):
+        age = (creating_time - self.hot_epoch).total_seconds()
+        return rating + self.hot_answer_weight * answer_count + age / self.hot_decay
+
+    def hot_score_expression(self, creating_times, rating=F('rating'), answer_count=F('answer_count')):
+        # hot_score of the rows an UPDATE writes, from the rating and answer count they
+        # have at that moment; creating_times maps their ids to the creation time, which
+        # never changes, so it goes in as a constant per row.
+        ages = [When(pk=pk, then=Value(self.hot_score(0, 0, time))) for pk, time in creating_times.items()]
+        return rating + self.hot_answer_weight * answer_count + Case(*ages, output_field=models.FloatField())
 
     def get_all_ids(self):
-        return self.values_list('id', flat=True)
+        return self.order_by(*self.new_ordering).values_list('id', flat=True)
+
+    def get_new_ids(self, count=None):
+        ids = self.get_all_ids()
+        return ids[:count] if count else ids
 
-    def get_new_ids(self, count=10):
-        return self.get_all_ids()[:count]
+    def get_best_ids(self, count=None):
+        ids = self.order_by(*self.best_ordering).values_list('id', flat=True)
+        return ids[:count] if count else ids
 
-    def get_best_ids(self, count=10):
-        return self.annotate(order=Sum('like__type', default=0)).order_by('-order').values_list('id', flat=True)[:count]
+    def get_hot_ids(self, count=None):
+        ids = self.order_by(*self.hot_ordering).values_list('id', flat=True)
+        return ids[:count] if count else ids
 
-    def get_hot_ids(self, count=10):
-        return self.annotate(order=Count('answer')).order_by('-order').values_list('id', flat=True)[:count]
+    tag_ordering = ('-creating_time', '-question_id')
 
     def get_by_tag_ids(self, tag):
-        return self.filter(tags__title=tag).values_list('id', flat=True)
+        return QuestionTag.objects.filter(tag__title=Tag.objects.normalize(tag)).order_by(
+            *self.tag_ordering
+        ).values_list('question_id', flat=True)
 
 
 class Question(models.Model):
@@ -49,6 +103,11 @@ class Question(models.Model):
         ordering = ['-creating_time']
         verbose_name = 'Вопрос',
         verbose_name_plural = 'Вопросы'
+        indexes = [
+            models.Index(fields=['creating_time', 'id'], name='question_new_idx'),
+            models.Index(fields=['rating', 'id'], name='question_best_idx'),
+            models.Index(fields=['hot_score', 'id'], name='question_hot_idx'),
+        ]
 
     title = models.CharField(
         max_length=255,
@@ -70,6 +129,22 @@ class Question(models.Model):
         default=False,
         verbose_name='Отредактировано'
     )
+    rating = models.IntegerField(
+        default=0,
+        verbose_name='Рейтинг'
+    )
+    answer_count = models.IntegerField(
+        default=0,
+        verbose_name='Количество ответов'
+    )
+    search_length = models.IntegerField(
+        default=0,
+        verbose_name='Длина в поисковом индексе'
+    )
+    hot_score = models.FloatField(
+        default=0,
+        verbose_name='Горячесть'
+    )
     author = models.ForeignKey(
         'Profile',
         on_delete=models.CASCADE,
@@ -80,6 +155,7 @@ class Question(models.Model):
     tags = models.ManyToManyField(
         'Tag',
         blank=True,
+        through='QuestionTag',
         related_name='questions',
         verbose_name='Тег'
     )
@@ -92,27 +168,28 @@ class Question(models.Model):
 
 class AnswerManager(models.Manager):
 
+    # What answer_item.html shows, see load_fields
+    page_fields = {
+        'id': (lambda query: query.pk, None, None),
+        'text': (lambda query: query.description, None, None),
+        'like': (lambda query: query.rating, None, None),
+        'image': (lambda query: query.author.avatar, 'author', None),
+        'correct': (lambda query: query.is_correct, None, None),
+    }
+
     def get_obj(self, query):
-        return {
-                'id': query.pk,
-                'text': query.description,
-                'like': query.like.all().aggregate(Sum('type', default=0))['type__sum'],
-                'image': query.author.avatar,
-                'correct': query.is_correct
-            }
+        return {name: getter(query) for name, (getter, _, _) in self.page_fields.items()}
 
     def get_likes(self, q_id):
-        query = self.filter(pk=q_id).last()
-        return query.like.all().aggregate(Sum('type', default=0))['type__sum']
+        return self.filter(pk=q_id).values_list('rating', flat=True).last()
 
-    def get_all(self, ids):
-        data = []
-        for id in ids:
-            data.append(self.get_obj(self.filter(pk=id).last()))
-        return data
+    def get_all(self, ids, fields=None):
+        return load_fields(self.all(), ids, fields or self.page_fields)
+
+    best_ordering = ('-rating', 'id')
 
     def get_all_ids(self, q_id):
-        return self.filter(question__pk=q_id).annotate(o=Sum('like__type', default=0)).order_by('-o').values_list('id', flat=True)
+        return self.filter(question__pk=q_id).order_by(*self.best_ordering).values_list('id', flat=True)
 
 
 class Answer(models.Model):
@@ -121,6 +198,9 @@ class Answer(models.Model):
     class Meta:
         verbose_name = 'Ответ',
         verbose_name_plural = 'Ответы'
+        indexes = [
+            models.Index(fields=['question', '-rating', 'id'], name='answer_rating_idx'),
+        ]
 
     author = models.ForeignKey(
         'Profile',
@@ -154,14 +234,35 @@ class Answer(models.Model):
         default=False,
         verbose_name='Корректный ответ'
     )
+    rating = models.IntegerField(
+        default=0,
+        verbose_name='Рейтинг'
+    )
 
     def __str__(self):
         return f'Answer #{self.pk} by {self.author}'
 
 
 class TagManager(models.Manager):
+
+    @staticmethod
+    def normalize(title):
+        return ' '.join(title.split()).lower()[:20]
+
+    def resolve(self, titles):
+        titles = list(dict.fromkeys(title for title in map(self.normalize, titles) if title))
+        tags = {tag.title: tag for tag in self.filter(title__in=titles)}
+        missing = [title for title in titles if title not in tags]
+        if missing:
+            self.bulk_create([Tag(title=title) for title in missing], ignore_conflicts=True)
+            tags.update((tag.title, tag) for tag in self.filter(title__in=missing))
+        return [tags[title] for title in titles]
+
     def get_popular(self, count=10):
-        return self.annotate(cnt=Count('questions')).order_by('-cnt')[:count]
+        return self.order_by('-question_count', '-id').values_list('title', flat=True)[:count]
+
+    def get_all(self, ids, fields):
+        return load_fields(self.all(), ids, fields)
 
 
 class Tag(models.Model):
@@ -171,16 +272,55 @@ class Tag(models.Model):
     class Meta:
         verbose_name = 'Тег',
         verbose_name_plural = 'Теги'
+        indexes = [
+            models.Index(fields=['question_count', 'id'], name='tag_popular_idx'),
+        ]
 
     title = models.CharField(
         max_length=20,
+        unique=True,
         verbose_name='Тег'
     )
+    question_count = models.IntegerField(
+        default=0,
+        verbose_name='Количество вопросов'
+    )
 
     def __str__(self):
         return f'{self.title}'
 
 
+class QuestionTag(models.Model):
+
+    class Meta:
+        db_table = 'app_question_tags'
+        verbose_name = 'Тег вопроса'
+        verbose_name_plural = 'Теги вопросов'
+        unique_together = ['question', 'tag']
+        indexes = [
+            models.Index(fields=['tag', 'creating_time', 'question'], name='question_tag_new_idx'),
+        ]
+
+    question = models.ForeignKey(
+        'Question',
+        on_delete=models.CASCADE,
+        verbose_name='Вопрос'
+    )
+    tag = models.ForeignKey(
+        'Tag',
+        on_delete=models.CASCADE,
+        verbose_name='Тег'
+    )
+    # Copy of Question.creating_time so that a tag feed is read from one index
+    creating_time = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='Время создания вопроса'
+    )
+
+    def __str__(self):
+        return f'{self.tag} on {self.question}'
+
+
 class ProfileManager(models.Manager):
 
     def get_user_by_username(self, username):
@@ -192,19 +332,17 @@ class ProfileManager(models.Manager):
         return user
 
     def get_user_by_email(self, email):
-        try:
-            user = User.objects.get(email=email)
-        except ObjectDoesNotExist:
-            user = None
+        # Emails compare case-insensitively through the LOWER(email) index
+        return User.objects.alias(email_lower=Lower('email')).filter(email_lower=email.lower()).first()
 
-        return user
+    def get_users_by_username_or_email(self, username, email):
+        # Both signup checks in one query
+        return User.objects.alias(email_lower=Lower('email')).filter(
+            Q(username=username) | Q(email_lower=(email or '').lower())
+        ).only('username', 'email')
 
     def get_best(self, count=5):
-        ids = self.annotate(cnt=Count('answer')).order_by('-cnt').values_list('id')[:count]
-        names = []
-        for i in ids:
-            names.append(self.get(pk=i[0]).user.username)
-        return names
+        return self.order_by('-answer_count', '-id').values_list('user__username', flat=True)[:count]
 
 
 class Profile(models.Model):
@@ -214,6 +352,9 @@ class Profile(models.Model):
     class Meta:
         verbose_name = 'Профиль',
         verbose_name_plural = 'Профили'
+        indexes = [
+            models.Index(fields=['answer_count', 'id'], name='profile_best_idx'),
+        ]
 
     user = models.OneToOneField(
         User,
@@ -228,6 +369,13 @@ class Profile(models.Model):
         blank=True,
         null=True
     )
+    # Prefix of the avatar's thumbnails, set once app.thumbnails has made them
+    avatar_thumbnail = models.CharField(
+        max_length=64,
+        blank=True,
+        default='',
+        verbose_name='Миниатюры аватарки'
+    )
     nickname = models.CharField(
         max_length=30,
         blank=True,
@@ -239,29 +387,156 @@ class Profile(models.Model):
         blank=True,
         verbose_name='Дата рождения'
     )
+    answer_count = models.IntegerField(
+        default=0,
+        verbose_name='Количество ответов'
+    )
 
     def __str__(self):
         return f'{self.user.username}'
 
 
-class AnswerLikeManager(models.Manager):
-
-    def create_or_change_like(self, answer, profile, vote):
-        like_enum = {"like": 1, "dislike": -1}
-
-        like = AnswerLike.objects.filter(answer=answer).filter(author=profile).last()
-        if not like:
-            AnswerLike.objects.create(
-                answer=answer,
-                author=profile,
-                type=like_enum[vote]
+class LikeManager(models.Manager):
+    like_enum = {"like": 1, "dislike": -1}
+    target = None
+    # Columns of the target that move by the vote delta, rating first
+    score_fields = ('rating',)
+
+    def create_or_change_like(self, obj, profile, vote):
+        if getattr(settings, 'VOTE_BUFFER', False):
+            # Written behind by the buffer, which invalidates the pages when it flushes
+            return vote_buffer.get_buffer().vote(self, obj.pk, profile.pk, self.like_enum[vote])
+        rating = self.vote(obj.pk, profile.pk, self.like_enum[vote])
+        page_cache.invalidate(*self.get_pages(obj))
+        return rating
+
+    def get_pages(self, obj):
+        return []
+
+    def vote_many(self, profile_id, votes):
+        # Applies (object id, value) votes of one user in order and returns the new
+        # ratings. Repeated clicks on one object fold into a single like upsert and a
+        # single rating change, so a burst of clicks costs a fixed number of queries.
+        if getattr(settings, 'VOTE_BUFFER', False):
+            target_model = self.model._meta.get_field(self.target).related_model
+            ratings = {}
+            for obj_id, value in votes:
+                try:
+                    ratings[obj_id] = vote_buffer.get_buffer().vote(self, obj_id, profile_id, value)
+                except target_model.DoesNotExist:
+                    pass
+            return ratings
+        changes = {}
+        for obj_id, value in votes:
+            changes[obj_id, profile_id] = compose_votes(changes.get((obj_id, profile_id), SAME_VOTE), toggle_vote(value))
+        return self.apply_votes(changes)
+
+    def apply_votes(self, changes):
+        # changes maps (object id, profile id) to a vote transition: the like type it
+        # leaves behind for a current type of -1, 0 and 1.
+        target_model = self.model._meta.get_field(self.target).related_model
+        with transaction.atomic(using=self.db):
+            targets = target_model.objects.filter(pk__in={obj_id for obj_id, _ in changes}).order_by('pk')
+            if connections[self.db].features.has_select_for_update:
+                objs = list(targets.select_for_update())
+            else:
+                # SQLite has no row locks: a write takes the database lock before the likes are read.
+                targets.update(rating=F('rating'))
+                objs = list(targets)
+            ids = {obj.pk for obj in objs}
+            if not ids:
+                return {}
+            current = {
+                (obj_id, author_id): type for obj_id, author_id, type in self.filter(**{
+                    self.target + '_id__in': ids, 'author_id__in': {profile_id for _, profile_id in changes}
+                }).values_list(self.target + '_id', 'author_id', 'type')
+            }
+            changed = {}
+            deltas = {}
+            for key, transition in changes.items():
+                old = current.get(key, 0)
+                new = transition[old + 1]
+                if key[0] in ids and new != old:
+                    changed[key] = new
+                    deltas[key[0]] = deltas.get(key[0], 0) + new - old
+            if changed:
+                self.bulk_create(
+                    [self.model(**{self.target + '_id': obj_id, 'author_id': profile_id, 'type': type})
+                     for (obj_id, profile_id), type in changed.items()],
+                    update_conflicts=True, unique_fields=[self.target, 'author'], update_fields=['type']
+                )
+                cases = [When(pk=obj_id, then=delta) for obj_id, delta in deltas.items()]
+                target_model.objects.filter(pk__in=deltas).update(**{
+                    field: F(field) + Case(*cases, output_field=target_model._meta.get_field(field))
+                    for field in self.score_fields
+                })
+            ratings = dict(target_model.objects.filter(pk__in=ids).values_list('pk', 'rating'))
+        pages = [page for obj in objs if obj.pk in deltas for page in self.get_pages(obj)]
+        if pages:
+            page_cache.invalidate(*set(pages))
+        return ratings
+
+    def vote(self, obj_id, profile_id, value):
+        connection = connections[self.db]
+        with transaction.atomic(using=self.db):
+            if connection.vendor not in ('sqlite', 'postgresql'):
+                return self._vote_locked(obj_id, profile_id, value)
+            like_table = connection.ops.quote_name(self.model._meta.db_table)
+            target_model = self.model._meta.get_field(self.target).related_model
+            target_table = connection.ops.quote_name(target_model._meta.db_table)
+            column = connection.ops.quote_name(self.model._meta.get_field(self.target).column)
+            delta = (
+                f'(SELECT CASE WHEN prev.type = %s THEN -prev.type ELSE %s - prev.type END FROM ('
+                f'SELECT COALESCE((SELECT type FROM {like_table} WHERE {column} = %s AND author_id = %s), 0) AS type'
+                f') prev)'
             )
-        elif like.type != like_enum[vote]:
-            like.type = like_enum[vote]
-            like.save()
+            assignments = ', '.join(f'{connection.ops.quote_name(field)} = {connection.ops.quote_name(field)} + {delta}'
+                                    for field in self.score_fields)
+            with connection.cursor() as cursor:
+                # The rating update runs first: it takes the row (or database) write lock,
+                # so the like row it reads cannot change before the upsert below. Under
+                # PostgreSQL's READ COMMITTED an UPDATE that waited for the lock rechecks
+                # only the row it updates, its like subquery keeps the snapshot from before
+                # the wait. The lock is taken by a statement of its own, and the update's
+                # snapshot then includes the vote that held it.
+                if connection.vendor == 'postgresql':
+                    cursor.execute(f'SELECT 1 FROM {target_table} WHERE id = %s FOR UPDATE', [obj_id])
+                cursor.execute(
+                    f'UPDATE {target_table} SET {assignments} WHERE id = %s RETURNING rating',
+                    [value, value, obj_id, profile_id] * len(self.score_fields) + [obj_id]
+                )
+                row = cursor.fetchone()
+                if row is None:
+                    raise target_model.DoesNotExist
+                cursor.execute(
+                    f'INSERT INTO {like_table} ({column}, author_id, type) VALUES (%s, %s, %s) '
+                    f'ON CONFLICT ({column}, author_id) DO UPDATE SET type = '
+                    f'CASE WHEN {like_table}.type = EXCLUDED.type THEN 0 ELSE EXCLUDED.type END',
+                    [obj_id, profile_id, value]
+                )
+        return row[0]
+
+    def _vote_locked(self, obj_id, profile_id, value):
+        target_model = self.model._meta.get_field(self.target).related_model
+        rating = target_model.objects.select_for_update().filter(pk=obj_id).values_list('rating', flat=True).get()
+        like = self.select_for_update().filter(**{self.target + '_id': obj_id, 'author_id': profile_id}).last()
+        if not like:
+            old_type = 0
+            like = self.create(**{self.target + '_id': obj_id, 'author_id': profile_id, 'type': value})
         else:
-            like.type = 0
-            like.save()
+            old_type = like.type
+            like.type = value if like.type != value else 0
+            like.save(update_fields=['type'])
+        delta = like.type - old_type
+        target_model.objects.filter(pk=obj_id).update(**{field: F(field) + delta for field in self.score_fields})
+        return rating + delta
+
+
+class AnswerLikeManager(LikeManager):
+    target = 'answer'
+
+    def get_pages(self, obj):
+        return [page_cache.answers(obj.question_id)]
 
 
 class AnswerLike(models.Model):
@@ -303,24 +578,12 @@ class AnswerLike(models.Model):
         return f'Liked by {self.author}'
 
 
-class QuestionLikeManager(models.Manager):
-
-    def create_or_change_like(self, question, profile, vote):
-        like_enum = {"like": 1, "dislike": -1}
+class QuestionLikeManager(LikeManager):
+    target = 'question'
+    score_fields = ('rating', 'hot_score')
 
-        like = QuestionLike.objects.filter(question=question).filter(author=profile).last()
-        if not like:
-            QuestionLike.objects.create(
-                question=question,
-                author=profile,
-                type=like_enum[vote]
-            )
-        elif like.type != like_enum[vote]:
-            like.type = like_enum[vote]
-            like.save()
-        else:
-            like.type = 0
-            like.save()
+    def get_pages(self, obj):
+        return [page_cache.question(obj.pk), page_cache.feed('best'), page_cache.feed('hot')]
 
 
 class QuestionLike(models.Model):
@@ -360,3 +623,51 @@ class QuestionLike(models.Model):
 
     def __str__(self):
         return f'Liked by {self.author}'
+
+
+class SearchTerm(models.Model):
+
+    class Meta:
+        verbose_name = 'Поисковый терм'
+        verbose_name_plural = 'Поисковые термы'
+
+    word = models.CharField(
+        max_length=40,
+        unique=True,
+        verbose_name='Слово'
+    )
+    doc_count = models.IntegerField(
+        default=0,
+        verbose_name='Число вопросов'
+    )
+
+    def __str__(self):
+        return f'{self.word}'
+
+
+class SearchPosting(models.Model):
+
+    class Meta:
+        verbose_name = 'Вхождение терма'
+        verbose_name_plural = 'Вхождения термов'
+        unique_together = ['term', 'question']
+
+    term = models.ForeignKey(
+        'SearchTerm',
+        on_delete=models.CASCADE,
+        related_name='postings',
+        verbose_name='Терм'
+    )
+    question = models.ForeignKey(
+        'Question',
+        on_delete=models.CASCADE,
+        related_name='postings',
+        verbose_name='Вопрос'
+    )
+    frequency = models.IntegerField(
+        default=0,
+        verbose_name='Частота'
+    )
+
+    def __str__(self):
+        return f'{self.term} in {self.question}'
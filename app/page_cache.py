@@ -0,0 +1,139 @@
+import hashlib
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.crypto import get_random_string
+from django.utils.http import urlencode
+
+PAGE_KEY = 'page:{}'
+VERSION_KEY = 'version:{}'
+# The only query parameters the cached views read; tracking parameters, a different
+# order or repeats of them leave the page and its key the same.
+PAGE_PARAMS = ('after', 'before', 'last', 'page')
+
+
+def get_cache():
+    return caches[getattr(settings, 'PAGE_CACHE_ALIAS', 'default')]
+
+
+def get_timeout():
+    return getattr(settings, 'PAGE_CACHE_TIMEOUT', 60)
+
+
+# Names of the things a cached page is built from; each has a version in the cache.
+
+def feed(name):
+    return f'feed:{name}'
+
+
+def tag_feed(title):
+    return 'feed:tag:' + hashlib.md5(title.encode()).hexdigest()
+
+
+def question(id):
+    return f'question:{id}'
+
+
+def answers(question_id):
+    return f'answers:{question_id}'
+
+
+def profiles():
+    # Nicknames are shown next to every question and answer, renames are rare
+    return 'profiles'
+
+
+def invalidate(*names):
+    # Versions are random tokens rather than counters, so a version that was evicted
+    # can never come back with the value a stale page was stored under. The bump waits
+    # for the commit, otherwise a reader could cache the old rows under the new version.
+    def bump():
+        get_cache().set_many({VERSION_KEY.format(name): get_random_string(12) for name in names}, None)
+    transaction.on_commit(bump)
+
+
+def get_versions(names):
+    cache = get_cache()
+    keys = {VERSION_KEY.format(name): name for name in names}
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        for key in missing:
+            cache.add(key, get_random_string(12), None)
+        versions.update(cache.get_many(missing))
+    return {keys[key]: version for key, version in versions.items()}
+
+
+def depend(request, *names):
+    # Called by a view before it reads the rows behind names, so a write that lands
+    # while the page renders leaves the stored page with an already outdated version.
+    if hasattr(request, 'page_versions'):
+        request.page_versions.update(get_versions(names))
+
+
+def get_page(request):
+    # Returns the cache key and, when every version it was built from is current,
+    # the stored response.
+    params = urlencode([(name, request.GET[name]) for name in PAGE_PARAMS if name in request.GET])
+    key = PAGE_KEY.format(hashlib.md5(f'{request.path}?{params}'.encode()).hexdigest())
+    cache = get_cache()
+    page = cache.get(key)
+    if page is None:
+        return key, None
+    keys = [VERSION_KEY.format(name) for name in page['versions']]
+    current = cache.get_many(keys)
+    if any(current.get(key) != version for key, version in zip(keys, page['versions'].values())):
+        return key, None
+    return key, HttpResponse(page['content'], content_type=page['content_type'])
+
+
+def store_page(request, key, response):
+    if (response.status_code == 200 and not response.streaming and request.page_versions
+            and not response.cookies and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE')):
+        get_cache().set(key, {
+            'content': response.content,
+            'content_type': response['Content-Type'],
+            'versions': request.page_versions,
+        }, get_timeout())
+
+
+def is_cacheable(request):
+    return request.method in ('GET', 'HEAD') and not request.user.is_authenticated
+
+
+def cache_anonymous_page(view):
+    # Whole pages are cached for anonymous visitors only: the header of a logged in
+    # user's page is theirs alone. A hit costs two cache reads and no queries.
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            if await sync_to_async(is_cacheable)(request):
+                key, response = await sync_to_async(get_page)(request)
+                if response is None:
+                    request.page_versions = {}
+                    response = await view(request, *args, **kwargs)
+                    await sync_to_async(store_page)(request, key, response)
+            else:
+                response = await view(request, *args, **kwargs)
+            patch_vary_headers(response, ['Cookie'])
+            return response
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if is_cacheable(request):
+            key, response = get_page(request)
+            if response is None:
+                request.page_versions = {}
+                response = view(request, *args, **kwargs)
+                store_page(request, key, response)
+        else:
+            response = view(request, *args, **kwargs)
+        patch_vary_headers(response, ['Cookie'])
+        return response
+    return wrapper
@@ -0,0 +1,109 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class CursorPage:
+
+    def __init__(self, paginator, object_list, has_next, has_previous):
+        self.paginator = paginator
+        self.object_list = [row[0] for row in object_list]
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.next_cursor = paginator.encode(object_list[-1][1:]) if has_next and object_list else None
+        self.previous_cursor = paginator.encode(object_list[0][1:]) if has_previous and object_list else None
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class CursorPaginator:
+    # Pages are addressed by the ordering values of their edge rows, so `ordering`
+    # has to end with a unique field (usually id).
+    is_cursor = True
+
+    def __init__(self, queryset, ordering, per_page=10, key='pk'):
+        self.queryset = queryset
+        self.key = key
+        self.ordering = list(ordering)
+        self.fields = [name.lstrip('-') for name in self.ordering]
+        self.per_page = per_page
+
+    @property
+    def count(self):
+        return self.queryset.count()
+
+    def encode(self, values):
+        # isoformat() keeps microseconds, which DjangoJSONEncoder would truncate.
+        data = json.dumps(list(values), default=lambda value: value.isoformat()).encode()
+        return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+    def decode(self, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            if not isinstance(values, list) or len(values) != len(self.fields):
+                return None
+            model = self.queryset.model
+            return [model._meta.get_field(name).to_python(value) for name, value in zip(self.fields, values)]
+        except (ValueError, TypeError, binascii.Error, ValidationError):
+            return None
+
+    def _seek(self, values, forward):
+        condition = Q()
+        for i, name in enumerate(self.ordering):
+            field = self.fields[i]
+            descending = name.startswith('-')
+            lookup = 'lt' if descending == forward else 'gt'
+            step = Q(**{f'{field}__{lookup}': values[i]})
+            for prev_field, prev_value in zip(self.fields[:i], values[:i]):
+                step &= Q(**{prev_field: prev_value})
+            condition |= step
+        return condition
+
+    def _reversed(self):
+        return [name[1:] if name.startswith('-') else '-' + name for name in self.ordering]
+
+    def _query(self, values, forward):
+        queryset = self.queryset.order_by(*(self.ordering if forward else self._reversed()))
+        if values is not None:
+            queryset = queryset.filter(self._seek(values, forward))
+        return queryset.values_list(self.key, *self.fields)[:self.per_page + 1]
+
+    def _locate(self, after, before, last):
+        # The cursor the rows are read from, in which direction, and the decoded after
+        after = self.decode(after) if after else None
+        before = self.decode(before) if before else None
+        if before is not None or (last and after is None):
+            return before, False, after
+        return after, True, after
+
+    def _page(self, rows, values, forward, after):
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if not forward:
+            return CursorPage(self, rows[::-1], has_next=values is not None, has_previous=more)
+        return CursorPage(self, rows, has_next=more, has_previous=after is not None)
+
+    def get_page(self, after=None, before=None, last=False):
+        values, forward, after = self._locate(after, before, last)
+        return self._page(list(self._query(values, forward)), values, forward, after)
+
+    async def aget_page(self, after=None, before=None, last=False):
+        values, forward, after = self._locate(after, before, last)
+        return self._page([row async for row in self._query(values, forward)], values, forward, after)
+
+    def start_cursor(self, values):
+        # The after cursor of the page that starts with the row of these ordering values,
+        # None when that is the first page
+        previous = self.queryset.order_by(*self._reversed()).filter(self._seek(values, False))
+        previous = previous.values_list(*self.fields).first()
+        return self.encode(previous) if previous else None
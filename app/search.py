@@ -0,0 +1,170 @@
+import math
+import re
+from collections import Counter, defaultdict
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Avg, Case, Count, ExpressionWrapper, F, FloatField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce
+
+from .models import Question, QuestionTag, Answer, Tag, SearchTerm, SearchPosting
+
+WORD_RE = re.compile(r'\w+')
+TAG_RE = re.compile(r'\[([^\]]+)\]')
+MIN_WORD = 2
+MAX_WORD = 40
+TITLE_WEIGHT = 2
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+STATS_KEY = 'search:stats'
+STATS_TIMEOUT = 60
+
+
+def tokenize(text):
+    return [word for word in WORD_RE.findall(text.lower()) if MIN_WORD <= len(word) <= MAX_WORD]
+
+
+def parse_query(query):
+    tags = [tag.strip() for tag in TAG_RE.findall(query) if tag.strip()]
+    return TAG_RE.sub(' ', query), tags
+
+
+def question_counts(title, description):
+    counts = Counter(tokenize(description))
+    for word in tokenize(title):
+        counts[word] += TITLE_WEIGHT
+    return counts
+
+
+def resolve_terms(words):
+    words = set(words)
+    terms = dict(SearchTerm.objects.filter(word__in=words).values_list('word', 'id'))
+    missing = words - terms.keys()
+    if missing:
+        SearchTerm.objects.bulk_create([SearchTerm(word=word) for word in missing], ignore_conflicts=True)
+        terms.update(SearchTerm.objects.filter(word__in=missing).values_list('word', 'id'))
+    return terms
+
+
+def add_to_index(question_id, counts):
+    if not counts:
+        return
+    with transaction.atomic():
+        terms = resolve_terms(counts)
+        existing = set(SearchPosting.objects.filter(
+            question_id=question_id, term_id__in=terms.values()
+        ).values_list('term_id', flat=True))
+        new = [
+            SearchPosting(term_id=terms[word], question_id=question_id, frequency=count)
+            for word, count in counts.items() if terms[word] not in existing
+        ]
+        SearchPosting.objects.bulk_create(new)
+        SearchTerm.objects.filter(id__in=[posting.term_id for posting in new]).update(doc_count=F('doc_count') + 1)
+
+        by_count = defaultdict(list)
+        for word, count in counts.items():
+            if terms[word] in existing:
+                by_count[count].append(terms[word])
+        for count, term_ids in by_count.items():
+            SearchPosting.objects.filter(question_id=question_id, term_id__in=term_ids).update(
+                frequency=F('frequency') + count
+            )
+        Question.objects.filter(pk=question_id).update(search_length=F('search_length') + sum(counts.values()))
+
+
+def index_question(question):
+    add_to_index(question.pk, question_counts(question.title, question.description))
+
+
+def index_answer(answer):
+    add_to_index(answer.question_id, Counter(tokenize(answer.description)))
+
+
+def get_stats():
+    stats = cache.get(STATS_KEY)
+    if stats is None:
+        stats = Question.objects.aggregate(total=Count('id'), avg_length=Avg('search_length'))
+        cache.set(STATS_KEY, stats, STATS_TIMEOUT)
+    return stats
+
+
+def search_ids(query, tags=()):
+    text, query_tags = parse_query(query)
+    tags = [*tags, *query_tags]
+    words = set(tokenize(text))
+    if not words and tags:
+        # Every question of the tags scores the same, the newest come first as in the
+        # tag feed, which has the index for it.
+        questions = Question.objects.get_by_tag_ids(tags[0])
+        for tag in tags[1:]:
+            questions = questions.filter(question_id__in=QuestionTag.objects.filter(
+                tag__title=Tag.objects.normalize(tag)
+            ).values('question_id'))
+        return questions
+    terms = list(SearchTerm.objects.filter(word__in=words, doc_count__gt=0).values_list('id', 'doc_count'))
+    if not terms:
+        return SearchPosting.objects.none().values_list('question_id', flat=True)
+
+    stats = get_stats()
+    total = stats['total'] or 1
+    avg_length = stats['avg_length'] or 1
+    idf = Case(
+        *[When(term_id=term_id, then=Value(math.log(1 + (total - df + 0.5) / (df + 0.5)))) for term_id, df in terms],
+        output_field=FloatField()
+    )
+    frequency = Cast('frequency', FloatField())
+    length = Cast('question__search_length', FloatField())
+    score = ExpressionWrapper(
+        idf * frequency * (K1 + 1) / (frequency + K1 * (1 - B + B * length / avg_length)),
+        output_field=FloatField()
+    )
+
+    postings = SearchPosting.objects.filter(term_id__in=[term_id for term_id, _ in terms])
+    for tag in tags:
+        tagged = Question.objects.filter(tags__title=Tag.objects.normalize(tag)).values('id')
+        postings = postings.filter(question_id__in=tagged)
+    return postings.values('question_id').annotate(score=Sum(score)).order_by('-score', '-question_id').values_list(
+        'question_id', flat=True
+    )
+
+
+def rebuild_index(batch_size=1000, stdout=None):
+    SearchPosting.objects.all().delete()
+    SearchTerm.objects.all().delete()
+    Question.objects.update(search_length=0)
+    cache.delete(STATS_KEY)
+
+    done = 0
+    last_id = 0
+    while True:
+        questions = list(Question.objects.filter(id__gt=last_id).order_by('id').values_list(
+            'id', 'title', 'description'
+        )[:batch_size])
+        if not questions:
+            break
+        last_id = questions[-1][0]
+        counts = {id: question_counts(title, description) for id, title, description in questions}
+        answers = Answer.objects.filter(question_id__in=counts).values_list('question_id', 'description')
+        for question_id, description in answers.iterator(chunk_size=batch_size):
+            counts[question_id].update(tokenize(description))
+
+        with transaction.atomic():
+            terms = resolve_terms(word for question in counts.values() for word in question)
+            SearchPosting.objects.bulk_create([
+                SearchPosting(term_id=terms[word], question_id=question_id, frequency=count)
+                for question_id, question in counts.items() for word, count in question.items()
+            ], batch_size=batch_size)
+            Question.objects.bulk_update([
+                Question(id=question_id, search_length=sum(question.values()))
+                for question_id, question in counts.items()
+            ], ['search_length'], batch_size=batch_size)
+        done += len(questions)
+        if stdout:
+            stdout.write(f'Indexed {done} questions')
+
+    postings = SearchPosting.objects.filter(term=OuterRef('pk')).order_by().values('term')
+    SearchTerm.objects.update(doc_count=Coalesce(Subquery(postings.annotate(cnt=Count('pk')).values('cnt')), 0))
+    return done
@@ -0,0 +1,84 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+
+from .models import Tag, Profile
+
+SIDEBAR_KEY = 'sidebar'
+LOCK_KEY = 'sidebar:lock'
+LOCK_TIMEOUT = 30
+WAIT_STEP = 0.05
+
+_local_lock = threading.Lock()
+
+
+def get_cache():
+    return caches[getattr(settings, 'SIDEBAR_CACHE_ALIAS', 'default')]
+
+
+def get_timeout():
+    return getattr(settings, 'SIDEBAR_CACHE_TIMEOUT', 60)
+
+
+def build_sidebar():
+    return {
+        'ptags': list(Tag.objects.get_popular()),
+        'bmembers': list(Profile.objects.get_best())
+    }
+
+
+def refresh_sidebar():
+    data = build_sidebar()
+    timeout = get_timeout()
+    # Entries outlive their soft expiry so that readers can be served stale data
+    # while a single worker recomputes them.
+    get_cache().set(SIDEBAR_KEY, {'data': data, 'expires': time.time() + timeout}, timeout * 10)
+    return data
+
+
+def _refresh_in_background():
+    try:
+        refresh_sidebar()
+    finally:
+        get_cache().delete(LOCK_KEY)
+        _local_lock.release()
+        connection.close()
+
+
+def _acquire():
+    if not _local_lock.acquire(blocking=False):
+        return False
+    if not get_cache().add(LOCK_KEY, 1, LOCK_TIMEOUT):
+        _local_lock.release()
+        return False
+    return True
+
+
+def get_sidebar():
+    cache = get_cache()
+    entry = cache.get(SIDEBAR_KEY)
+    if entry and entry['expires'] > time.time():
+        return entry['data']
+
+    if _acquire():
+        if entry:
+            threading.Thread(target=_refresh_in_background, daemon=True).start()
+            return entry['data']
+        try:
+            return refresh_sidebar()
+        finally:
+            cache.delete(LOCK_KEY)
+            _local_lock.release()
+
+    if entry:
+        return entry['data']
+    deadline = time.time() + LOCK_TIMEOUT
+    while time.time() < deadline:
+        time.sleep(WAIT_STEP)
+        entry = cache.get(SIDEBAR_KEY)
+        if entry:
+            return entry['data']
+    return build_sidebar()
@@ -0,0 +1,110 @@
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db import connection
+
+from .models import Question, Tag
+from .search import tokenize
+
+MAX_SCAN = 2000
+
+
+class PrefixIndex:
+    # Title words and tag names kept in sorted arrays; a prefix lookup is one bisect
+    # followed by a forward scan, so suggestions never touch the database.
+
+    def __init__(self):
+        self.words = []
+        self.ids = array('q')
+        self.titles = {}
+        self.tags = []
+        self.lock = threading.Lock()
+        self.built = 0
+
+    def build(self):
+        pairs = []
+        titles = {}
+        for id, title in Question.objects.order_by().values_list('id', 'title').iterator(chunk_size=5000):
+            titles[id] = title
+            pairs.extend((sys.intern(word), id) for word in set(tokenize(title)))
+        pairs.sort()
+        tags = sorted(title.lower() for title in Tag.objects.values_list('title', flat=True))
+        with self.lock:
+            self.words = [word for word, _ in pairs]
+            self.ids = array('q', (id for _, id in pairs))
+            self.titles = titles
+            self.tags = tags
+            self.built = time.monotonic()
+
+    def add_question(self, id, title):
+        with self.lock:
+            if not self.built:
+                return
+            self.titles[id] = title
+            for word in set(tokenize(title)):
+                position = bisect_left(self.words, word)
+                self.words.insert(position, sys.intern(word))
+                self.ids.insert(position, id)
+
+    def add_tag(self, title):
+        title = title.lower()
+        with self.lock:
+            position = bisect_left(self.tags, title)
+            if self.built and (position == len(self.tags) or self.tags[position] != title):
+                self.tags.insert(position, title)
+
+    def suggest(self, query, limit=10):
+        words = tokenize(query)
+        tag_prefix = query.strip().lower()
+        if not tag_prefix:
+            return [], []
+        prefix, rest = (words[-1], words[:-1]) if words else (None, [])
+        questions = []
+        seen = set()
+        with self.lock:
+            position = bisect_left(self.words, prefix) if prefix else len(self.words)
+            end = min(len(self.words), position + MAX_SCAN)
+            while position < end and len(questions) < limit and self.words[position].startswith(prefix):
+                id = self.ids[position]
+                position += 1
+                if id in seen:
+                    continue
+                seen.add(id)
+                title = self.titles[id]
+                if all(word in title.lower() for word in rest):
+                    questions.append({'id': id, 'title': title})
+            position = bisect_left(self.tags, tag_prefix)
+            tags = []
+            while position < len(self.tags) and len(tags) < limit and self.tags[position].startswith(tag_prefix):
+                tags.append(self.tags[position])
+                position += 1
+        return questions, tags
+
+
+index = PrefixIndex()
+_build_lock = threading.Lock()
+
+
+def _rebuild():
+    try:
+        index.build()
+    finally:
+        _build_lock.release()
+        connection.close()
+
+
+def get_index():
+    # Other worker processes add questions too, so the index is rebuilt from the
+    # database in the background once it is older than SUGGEST_REBUILD_INTERVAL.
+    if not index.built:
+        with _build_lock:
+            if not index.built:
+                index.build()
+    elif time.monotonic() - index.built > getattr(settings, 'SUGGEST_REBUILD_INTERVAL', 300):
+        if _build_lock.acquire(blocking=False):
+            threading.Thread(target=_rebuild, daemon=True).start()
+    return index
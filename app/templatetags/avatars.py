@@ -0,0 +1,12 @@
+from django import template
+
+from app.thumbnails import get_variants
+
+register = template.Library()
+
+
+@register.inclusion_tag('avatar.html')
+def avatar(image, size, alt=''):
+    # Serves the thumbnails of an avatar shown at size CSS pixels, or the original
+    # while they are being made.
+    return {'image': image, 'variants': get_variants(image, size), 'alt': alt}
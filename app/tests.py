@@ -1,3 +1,1155 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.cached_db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.template import engines
+from django.templatetags.static import static
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.db.models import F
+from django.contrib.auth.models import AnonymousUser
+from django.test import AsyncRequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.shortcuts import render
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import urlencode
+from PIL import Image
+
+from .backends import CachedModelBackend
+from .checks import check_shared_caches
+from .models import Question, QuestionLike, Answer, AnswerLike, Profile, Tag
+from . import async_views, dump, thumbnails
+from .management.commands import export_qa, import_qa
+from .middleware import RequestStats, _current
+from .pagination import CursorPaginator
+from .search import search_ids
+from .sidebar import get_sidebar, refresh_sidebar
+from .suggest import PrefixIndex
+from .vote_buffer import VoteBuffer
+
+
+def create_profile(username):
+    user = User.objects.create_user(username=username, email=f'{username}@mail.ru', password='password')
+    return Profile.objects.create(user=user, nickname=username)
+
+
+class VoteTestCase(TestCase):
+    # A question and an answer by author, and a voter without votes yet
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_profile('author')
+        cls.voter = create_profile('voter')
+        cls.question = Question.objects.create(title='title', description='text', author=cls.author)
+        cls.answer = Answer.objects.create(description='text', author=cls.author, question=cls.question)
+
+
+class VoteTest(VoteTestCase):
+
+    def test_vote_state_machine(self):
+        steps = [('like', 1), ('like', 0), ('dislike', -1), ('like', 1), ('dislike', -1), ('dislike', 0)]
+        for vote, expected in steps:
+            rating = QuestionLike.objects.create_or_change_like(self.question, self.voter, vote)
+            self.assertEqual(rating, expected)
+            self.assertEqual(Question.objects.get_likes(self.question.pk), expected)
+        self.assertEqual(QuestionLike.objects.filter(question=self.question).count(), 1)
+
+    def test_answer_vote_returns_rating(self):
+        other = create_profile('other')
+        AnswerLike.objects.create_or_change_like(self.answer, self.voter, 'like')
+        rating = AnswerLike.objects.create_or_change_like(self.answer, other, 'like')
+        self.assertEqual(rating, 2)
+        self.assertEqual(Answer.objects.get_likes(self.answer.pk), 2)
+
+
+class VoteBatchTest(VoteTestCase):
+
+    def setUp(self):
+        self.client.login(username='voter', password='password')
+
+    def post(self, votes):
+        return self.client.post(reverse('vote_batch'), json.dumps({'votes': votes}), content_type='application/json')
+
+    def test_clicks_fold_like_single_votes(self):
+        clicks = ['like', 'like', 'dislike', 'like', 'dislike']
+        response = self.post(
+            [{'type': 'question', 'id': self.question.pk, 'vote': vote} for vote in clicks]
+            + [{'type': 'answer', 'id': self.answer.pk, 'vote': 'like'}]
+        )
+        self.assertEqual(response.json(), {'likes': {
+            'question': {str(self.question.pk): -1}, 'answer': {str(self.answer.pk): 1}
+        }})
+        other = Question.objects.create(title='other', description='text', author=self.author)
+        for vote in clicks:
+            QuestionLike.objects.create_or_change_like(other, self.voter, vote)
+        question, other = Question.objects.filter(pk__in=[self.question.pk, other.pk]).order_by('pk')
+        self.assertEqual((question.rating, question.hot_score - other.hot_score), (other.rating, 0))
+        self.assertEqual(QuestionLike.objects.get(question=self.question, author=self.voter).type, -1)
+
+    def test_query_count_does_not_grow_with_clicks(self):
+        with CaptureQueriesContext(connection) as few:
+            self.post([{'type': 'question', 'id': self.question.pk, 'vote': 'like'}] * 2)
+        with CaptureQueriesContext(connection) as many:
+            self.post([{'type': 'question', 'id': self.question.pk, 'vote': 'like'}] * 40)
+        self.assertEqual(len(few.captured_queries), len(many.captured_queries))
+
+    def test_invalid_batch(self):
+        self.assertEqual(self.post([{'type': 'user', 'id': 1, 'vote': 'like'}]).status_code, 404)
+        self.assertEqual(self.post([{'type': [], 'id': 1, 'vote': 'like'}]).status_code, 404)
+        self.assertEqual(self.post([{'type': 'question', 'id': 1, 'vote': {}}]).status_code, 404)
+        self.assertEqual(self.post(['question']).status_code, 404)
+        self.assertEqual(self.post([]).status_code, 404)
+
+
+class VoteBufferTest(VoteTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.buffer = VoteBuffer(self.directory, interval=0)
+
+    def test_clicks_answer_projected_rating_without_writes(self):
+        steps = [(1, 1), (1, 0), (-1, -1), (1, 1)]
+        with CaptureQueriesContext(connection) as context:
+            for value, expected in steps:
+                self.assertEqual(self.buffer.vote(QuestionLike.objects, self.question.pk, self.voter.pk, value), expected)
+        self.assertFalse([q for q in context.captured_queries if not q['sql'].startswith('SELECT')])
+        self.assertEqual(Question.objects.get_likes(self.question.pk), 0)
+
+        self.buffer.flush()
+        self.assertEqual(Question.objects.get_likes(self.question.pk), 1)
+        self.assertEqual(QuestionLike.objects.get(question=self.question, author=self.voter).type, 1)
+        self.assertEqual(self.buffer.vote(QuestionLike.objects, self.question.pk, self.voter.pk, 1), 0)
+        self.assertEqual(os.listdir(self.directory), [os.path.basename(self.buffer.journal.name)])
+
+    def test_toggles_that_cancel_out_write_nothing(self):
+        AnswerLike.objects.create_or_change_like(self.answer, self.voter, 'like')
+        for value in (1, 1, -1, 1):
+            self.buffer.vote(AnswerLike.objects, self.answer.pk, self.voter.pk, value)
+        with CaptureQueriesContext(connection) as context:
+            self.buffer.flush()
+        # Only the lock of the answer whose like is checked
+        self.assertFalse([q for q in context.captured_queries if 'INSERT' in q['sql'] or 'CASE' in q['sql']])
+        self.assertEqual(Answer.objects.get_likes(self.answer.pk), 1)
+
+    def test_clicks_buffered_by_two_workers_toggle_in_turn(self):
+        other = VoteBuffer(self.directory, interval=0)
+        # Neither worker has seen the other's click when it takes its own
+        self.assertEqual(self.buffer.vote(AnswerLike.objects, self.answer.pk, self.voter.pk, 1), 1)
+        self.assertEqual(other.vote(AnswerLike.objects, self.answer.pk, self.voter.pk, 1), 1)
+        self.buffer.flush()
+        other.flush()
+        self.assertEqual(Answer.objects.get_likes(self.answer.pk), 0)
+        self.assertEqual(AnswerLike.objects.get(answer=self.answer, author=self.voter).type, 0)
+
+    def test_journal_of_dead_process_is_replayed(self):
+        self.buffer.vote(QuestionLike.objects, self.question.pk, self.voter.pk, 1)
+        self.buffer.vote(AnswerLike.objects, self.answer.pk, self.voter.pk, -1)
+        # A crash releases the journal lock without flushing
+        self.buffer.journal.close()
+
+        recovered = VoteBuffer(self.directory, interval=0)
+        self.assertEqual(Question.objects.get_likes(self.question.pk), 1)
+        self.assertEqual(Answer.objects.get_likes(self.answer.pk), -1)
+        self.assertEqual(os.listdir(self.directory), [os.path.basename(recovered.journal.name)])
+
+    @override_settings(VOTE_BUFFER=True)
+    def test_vote_view_uses_buffer(self):
+        with mock.patch('app.vote_buffer.get_buffer', return_value=self.buffer):
+            self.client.login(username='voter', password='password')
+            response = self.client.post(reverse('vote'), {'id': self.question.pk, 'type': 'question', 'vote': 'like'})
+        self.assertEqual(response.json()['likes'], 1)
+        self.assertEqual(Question.objects.get_likes(self.question.pk), 0)
+        self.buffer.flush()
+        self.assertEqual(Question.objects.get_likes(self.question.pk), 1)
+
+
+def make_image(width, height, format='PNG'):
+    data = BytesIO()
+    Image.new('RGB', (width, height), (200, 40, 40)).save(data, format)
+    return data.getvalue()
+
+
+@override_settings(AVATAR_THUMBNAIL_WORKERS=0, AVATAR_THUMBNAIL_SIZES=(96, 192))
+class ThumbnailTest(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def assertThumbnails(self, profile):
+        self.assertEqual(profile.avatar_thumbnail, thumbnails.get_prefix(profile.avatar.name))
+        for size in (96, 192):
+            for ext, format in (('webp', 'WEBP'), ('jpg', 'JPEG')):
+                with default_storage.open(thumbnails.get_name(profile.avatar_thumbnail, size, ext)) as file:
+                    image = Image.open(file)
+                    self.assertEqual((image.format, image.size), (format, (size, size)))
+
+    def test_signup_makes_thumbnails_after_commit(self):
+        avatar = SimpleUploadedFile('me.png', make_image(640, 480), content_type='image/png')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('signup'), {
+                'username': 'user', 'email': 'user@mail.ru', 'password': 'password', 'password_check': 'password',
+                'avatar': avatar
+            })
+        self.assertThumbnails(Profile.objects.get(user__username='user'))
+
+    def test_backfill_and_avatar_tag(self):
+        name = default_storage.save('img/old.jpg', ContentFile(make_image(300, 500, 'JPEG')))
+        profile = create_profile('author')
+        Profile.objects.filter(pk=profile.pk).update(avatar=name)
+        question = Question.objects.create(title='title', description='text', author=profile)
+        self.assertIn(f'src="{default_storage.url(name)}"', self.client.get(reverse('question', args=[question.pk])).content.decode())
+
+        call_command('make_thumbnails', stdout=StringIO())
+        profile.refresh_from_db()
+        self.assertThumbnails(profile)
+        cache.clear()
+        content = self.client.get(reverse('question', args=[question.pk])).content.decode()
+        self.assertIn(default_storage.url(thumbnails.get_name(profile.avatar_thumbnail, 192, 'webp')) + ' 1x', content)
+        self.assertNotIn(default_storage.url(name), content)
+
+
+class FileServingTest(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        settings = override_settings(MEDIA_ROOT=os.path.join(self.root, 'media'),
+                                     STATIC_ROOT=os.path.join(self.root, 'static'))
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.data = bytes(range(256)) * 4
+        os.makedirs(os.path.join(self.root, 'media', 'img'))
+        with open(os.path.join(self.root, 'media', 'img', 'a.jpg'), 'wb') as file:
+            file.write(self.data)
+        self.url = '/uploads/img/a.jpg'
+
+    def test_etag_revalidation(self):
+        response = self.client.get(self.url)
+        self.assertEqual(b''.join(response.streaming_content), self.data)
+        self.assertEqual(response['Content-Length'], str(len(self.data)))
+        self.assertIn('max-age=86400', response['Cache-Control'])
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_ranges(self):
+        etag = self.client.head(self.url)['ETag']
+        cases = [('bytes=10-19', 10, 19), ('bytes=1000-', 1000, 1023), ('bytes=-4', 1020, 1023), ('bytes=1020-5000', 1020, 1023)]
+        for header, start, end in cases:
+            response = self.client.get(self.url, HTTP_RANGE=header, HTTP_IF_RANGE=etag)
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response['Content-Range'], f'bytes {start}-{end}/1024')
+            self.assertEqual(b''.join(response.streaming_content), self.data[start:end + 1])
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=2000-').status_code, 416)
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"old"').status_code, 200)
+        self.assertEqual(self.client.get('/uploads/img/%2e%2e/%2e%2e/%2e%2e/askme/settings.py').status_code, 400)
+
+    def test_collected_static_is_hashed_and_immutable(self):
+        call_command('collectstatic', interactive=False, verbosity=0)
+        url = static('js/vote.js')
+        self.assertRegex(url, r'/static/js/vote\.[0-9a-f]{12}\.js$')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn(url, self.client.get(reverse('index')).content.decode())
+
+
+class AuthTest(TestCase):
+
+    def setUp(self):
+        create_profile('user')
+
+    def test_login_hashes_password_once(self):
+        verify = mock.patch.object(PBKDF2PasswordHasher, 'verify', autospec=True,
+                                   side_effect=PBKDF2PasswordHasher.verify)
+        with verify as verify, CaptureQueriesContext(connection) as context:
+            response = self.client.post(reverse('login'), {'username': 'user', 'password': 'password'})
+        self.assertRedirects(response, reverse('index'), fetch_redirect_response=False)
+        self.assertEqual(verify.call_count, 1)
+        self.assertEqual(len([q for q in context.captured_queries if 'FROM "auth_user"' in q['sql']]), 1)
+
+    def test_wrong_credentials(self):
+        for username, password in (('user', 'wrong'), ('nobody', 'password')):
+            response = self.client.post(reverse('login'), {'username': username, 'password': password})
+            self.assertContains(response, 'Wrong username or password')
+
+    def test_signup_checks_username_and_email_in_one_query(self):
+        data = {'username': 'other', 'email': 'USER@mail.ru', 'password': 'pass', 'password_check': 'pass'}
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(reverse('signup'), data)
+        self.assertEqual(list(response.context['form'].errors), ['email'])
+        self.assertEqual(len([q for q in context.captured_queries if 'FROM "auth_user"' in q['sql']]), 1)
+
+        response = self.client.post(reverse('signup'), {**data, 'email': 'other@mail.ru'})
+        self.assertRedirects(response, reverse('index'), fetch_redirect_response=False)
+        self.assertEqual(Profile.objects.get_user_by_email('Other@Mail.ru').username, 'other')
+        self.assertEqual(int(self.client.session['_auth_user_id']), User.objects.get(username='other').pk)
+
+    def test_password_change_keeps_session(self):
+        self.client.login(username='user', password='password')
+        self.client.post(reverse('settings'), {
+            'nickname': 'user', 'old_password': 'password', 'password_check': 'password', 'new_password': 'secret'
+        })
+        self.assertEqual(self.client.get(reverse('settings')).status_code, 200)
+        self.assertTrue(User.objects.get(username='user').check_password('secret'))
+
+
+def shared_caches(test, *aliases):
+    # Every alias is its own client of one file cache, like workers sharing memcached
+    directory = tempfile.TemporaryDirectory()
+    test.addCleanup(directory.cleanup)
+    backend = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory.name}
+    return {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            **{alias: backend for alias in aliases}}
+
+
+class SessionCacheTest(TestCase):
+
+    def setUp(self):
+        override = override_settings(
+            CACHES=shared_caches(self, 'shared', 'worker_a', 'worker_b'),
+            SESSION_ENGINE='django.contrib.sessions.backends.cached_db', SESSION_CACHE_ALIAS='shared',
+            USER_CACHE_ALIAS='shared'
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        cache.clear()
+        self.profile = create_profile('user')
+        self.client.login(username='user', password='password')
+
+    def identity_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        tables = ('"django_session"', '"auth_user"', '"app_profile"')
+        return [q['sql'] for q in context.captured_queries if any(table in q['sql'] for table in tables)]
+
+    def test_cached_hit_reads_no_identity(self):
+        self.identity_queries(reverse('ask'))
+        self.assertEqual(self.identity_queries(reverse('ask')), [])
+
+    def test_profile_change_refreshes_header(self):
+        self.identity_queries(reverse('ask'))
+        self.client.post(reverse('settings'), {'nickname': 'renamed'})
+        self.assertContains(self.client.get(reverse('ask')), 'renamed')
+
+    def test_workers_see_each_others_logouts_and_passwords(self):
+        backend = CachedModelBackend()
+        with self.settings(SESSION_CACHE_ALIAS='worker_a', USER_CACHE_ALIAS='worker_a'):
+            session = SessionStore()
+            session['user'] = self.profile.user_id
+            session.create()
+            old_hash = backend.get_user(self.profile.user_id).password
+        with self.settings(SESSION_CACHE_ALIAS='worker_b', USER_CACHE_ALIAS='worker_b'):
+            SessionStore(session.session_key).flush()
+            user = User.objects.get(pk=self.profile.user_id)
+            user.set_password('changed')
+            user.save()
+        with self.settings(SESSION_CACHE_ALIAS='worker_a', USER_CACHE_ALIAS='worker_a'):
+            self.assertFalse(SessionStore(session.session_key).exists(session.session_key))
+            self.assertNotEqual(backend.get_user(self.profile.user_id).password, old_hash)
+
+    def test_per_process_caches_are_refused(self):
+        self.assertEqual(check_shared_caches(None), [])
+        with self.settings(SESSION_CACHE_ALIAS='default', USER_CACHE_ALIAS='default'):
+            self.assertEqual([error.id for error in check_shared_caches(None)], ['app.E001', 'app.E002'])
+        with self.settings(SESSION_ENGINE='django.contrib.sessions.backends.db', USER_CACHE_ALIAS=None):
+            self.assertEqual(check_shared_caches(None), [])
+            # Without a shared cache every request reads its user, and sees every change
+            with self.assertNumQueries(2):
+                CachedModelBackend().get_user(self.profile.user_id)
+                CachedModelBackend().get_user(self.profile.user_id)
+
+    def test_purge_sessions_in_batches(self):
+        past = timezone.now() - timedelta(days=1)
+        for i in range(5):
+            Session.objects.create(session_key=f'expired{i}', session_data='', expire_date=past)
+        out = StringIO()
+        call_command('purge_sessions', batch_size=2, stdout=out)
+        self.assertIn('Deleted 5', out.getvalue())
+        self.assertEqual(Session.objects.count(), 1)
+
+
+class ApiTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.author = create_profile('author')
+        self.tag = Tag.objects.create(title='python', question_count=3)
+        self.questions = []
+        for i in range(3):
+            question = Question.objects.create(title=f'title {i}', description='text', author=self.author)
+            question.tags.add(self.tag)
+            self.questions.append(question)
+        self.answers = [
+            Answer.objects.create(description=f'answer {i}', author=self.author, question=self.questions[0])
+            for i in range(3)
+        ]
+
+    def test_cursor_pages_with_sparse_fields(self):
+        url = reverse('api_questions')
+        with CaptureQueriesContext(connection) as context:
+            first = self.client.get(url, {'fields': 'id,title', 'limit': 2}).json()
+        # ids and rows only: neither authors nor tags were asked for
+        self.assertEqual(len(context.captured_queries), 2)
+        self.assertEqual(first['results'], [{'id': q.pk, 'title': q.title} for q in self.questions[:0:-1]])
+        second = self.client.get(url, {'fields': 'id,tags,author', 'limit': 2, 'cursor': first['next']}).json()
+        self.assertEqual(second, {'results': [{'id': self.questions[0].pk, 'tags': ['python'], 'author': 'author'}],
+                                  'next': None})
+        self.assertEqual(self.client.get(url, {'fields': 'id,password'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'order': 'random'}).status_code, 400)
+
+    def test_etag_follows_object_versions(self):
+        url = reverse('api_answers', args=[self.questions[0].pk])
+        # A per-process cache cannot tell one worker about another's writes
+        self.assertFalse(self.client.get(url).has_header('ETag'))
+        override = override_settings(CACHES=shared_caches(self, 'shared'), PAGE_CACHE_ALIAS='shared')
+        override.enable()
+        self.addCleanup(override.disable)
+
+        response = self.client.get(url, {'fields': 'id,rating'})
+        self.assertEqual([row['id'] for row in response.json()['results']], [answer.pk for answer in self.answers])
+        etag = response['ETag']
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.client.get(url, {'fields': 'id,rating'}, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertFalse([q for q in context.captured_queries if 'app_answer"."description' in q['sql']])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            AnswerLike.objects.create_or_change_like(self.answers[2], self.author, 'like')
+        response = self.client.get(url, {'fields': 'id,rating'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0], {'id': self.answers[2].pk, 'rating': 1})
+
+        etag = self.client.get(url, {'fields': 'id,author'})['ETag']
+        self.client.login(username='author', password='password')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('settings'), {'nickname': 'renamed'})
+        response = self.client.get(url, {'fields': 'id,author'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.json()['results'][0]['author'], 'renamed')
+
+    def test_export_streams_every_row(self):
+        with mock.patch('app.api.EXPORT_CHUNK', 2):
+            response = self.client.get(reverse('api_questions'), {'export': 1, 'tag': 'Python', 'fields': 'id'})
+            self.assertTrue(response.streaming)
+            data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(data['results'], [{'id': q.pk} for q in reversed(self.questions)])
+        tags = self.client.get(reverse('api_tags')).json()
+        self.assertEqual(tags['results'], [{'id': self.tag.pk, 'title': 'python', 'questions': 3}])
+
+
+class AnswerPositionTest(TestCase):
+
+    def test_start_cursor_opens_the_page_at_the_answer(self):
+        author = create_profile('author')
+        question = Question.objects.create(title='title', description='text', author=author)
+        for i in range(12):
+            Answer.objects.create(description='text', author=author, question=question, rating=i % 3)
+        paginator = CursorPaginator(Answer.objects.get_all_ids(question.pk), Answer.objects.best_ordering, 5)
+        ids = list(Answer.objects.get_all_ids(question.pk))
+        for i, id in enumerate(ids):
+            cursor = paginator.start_cursor(Answer.objects.filter(pk=id).values_list(*paginator.fields).get())
+            self.assertEqual(cursor is None, i == 0)
+            self.assertEqual(list(paginator.get_page(after=cursor)), ids[i:i + 5])
+
+    def test_new_answer_redirects_to_its_page(self):
+        author = create_profile('author')
+        question = Question.objects.create(title='title', description='text', author=author)
+        for i in range(7):
+            Answer.objects.create(description='text', author=author, question=question, rating=1)
+        self.client.login(username='author', password='password')
+        response = self.client.post(reverse('question', args=[question.pk]), {'description': 'new answer'})
+        answer = Answer.objects.latest('id')
+        self.assertTrue(response['Location'].endswith(f'#answer_{answer.pk}'))
+        self.assertIn('?after=', response['Location'])
+        page = self.client.get(response['Location'])
+        self.assertEqual([item['id'] for item in page.context['data']], [answer.pk])
+        self.assertTrue(page.context['page_obj'].has_previous)
+        self.assertEqual(Question.objects.get(pk=question.pk).answer_count, 1)
+
+
+class QuestionPageTest(TestCase):
+
+    def setUp(self):
+        self.author = create_profile('author')
+        self.question = Question.objects.create(title='title', description='text', author=self.author)
+        self.question.tags.add(Tag.objects.create(title='python'))
+        self.client.login(username='author', password='password')
+
+    def get(self):
+        # The first request loads the session user and the sidebar into the cache
+        self.client.get(reverse('question', args=[self.question.pk]))
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('question', args=[self.question.pk]))
+        return response, len(context.captured_queries)
+
+    def test_query_count_does_not_grow_with_answers(self):
+        Answer.objects.create(description='text', author=self.author, question=self.question)
+        response, few = self.get()
+        self.assertTrue(response.context['author'])
+        for i in range(4):
+            Answer.objects.create(description='text', author=create_profile(f'user{i}'), question=self.question)
+        response, many = self.get()
+        self.assertEqual(few, many)
+        self.assertEqual(len(response.context['data']), 5)
+        self.assertEqual([tag.title for tag in response.context['question']['tags']], ['python'])
+
+    def test_missing_question(self):
+        self.assertEqual(self.client.get(reverse('question', args=[self.question.pk + 1])).status_code, 404)
+
+
+class SearchTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.author = create_profile('author')
+        self.client.login(username='author', password='password')
+
+    def ask(self, title, description, tags):
+        self.client.post(reverse('ask'), {'title': title, 'description': description, 'tags': tags})
+        return Question.objects.latest('id')
+
+    def test_ranking_and_tag_filter(self):
+        first = self.ask('Django ORM subquery', 'How to annotate with a subquery', 'django')
+        second = self.ask('Python lists', 'Sorting lists with django templates', 'python')
+        self.ask('Cooking', 'Nothing relevant here', 'food')
+        self.assertEqual(list(search_ids('django')), [first.pk, second.pk])
+        self.assertEqual(list(search_ids('django [python]')), [second.pk])
+        self.assertEqual(list(search_ids('missingword')), [])
+        self.assertEqual(list(search_ids('[python]')), [second.pk])
+        self.assertEqual(list(search_ids('', ['Python', 'django'])), [])
+        response = self.client.get(reverse('search'), {'tag': 'python'})
+        self.assertContains(response, f'question_{second.pk}')
+
+    def test_answers_are_indexed(self):
+        question = self.ask('Question', 'Text', 'misc')
+        self.client.post(reverse('question', args=[question.pk]), {'description': 'use select_related'})
+        self.assertEqual(list(search_ids('select_related')), [question.pk])
+        response = self.client.get(reverse('search'), {'q': 'select_related'})
+        self.assertContains(response, f'question_{question.pk}')
+
+
+class TagResolveTest(TestCase):
+
+    def test_resolve_normalizes_and_reuses_tags(self):
+        existing = Tag.objects.create(title='django')
+        with self.assertNumQueries(3):
+            tags = Tag.objects.resolve([' Django', 'new  Tag', 'NEW tag', ''])
+        self.assertEqual([tag.title for tag in tags], ['django', 'new tag'])
+        self.assertEqual(tags[0].pk, existing.pk)
+        self.assertEqual(Tag.objects.count(), 2)
+
+    def test_ask_attaches_tags(self):
+        create_profile('author')
+        self.client.login(username='author', password='password')
+        self.client.post(reverse('ask'), {'title': 'title', 'description': 'text', 'tags': 'One,two, ONE'})
+        question = Question.objects.latest('id')
+        self.assertEqual(sorted(question.tags.values_list('title', flat=True)), ['one', 'two'])
+
+
+class SuggestTest(TestCase):
+
+    def test_prefix_lookup_and_incremental_add(self):
+        author = create_profile('author')
+        Question.objects.create(title='Django migrations', description='text', author=author)
+        index = PrefixIndex()
+        index.build()
+        self.assertEqual([item['title'] for item in index.suggest('migr')[0]], ['Django migrations'])
+        self.assertEqual(index.suggest('flask')[0], [])
+        index.add_question(100, 'Flask blueprints')
+        index.add_tag('Flask')
+        with self.assertNumQueries(0):
+            questions, tags = index.suggest('fla')
+        self.assertEqual(questions, [{'id': 100, 'title': 'Flask blueprints'}])
+        self.assertEqual(tags, ['flask'])
+
+    def test_tag_suggestion_finds_its_questions(self):
+        author = create_profile('author')
+        question = Question.objects.create(title='Sorting lists', description='text', author=author)
+        question.tags.add(Tag.objects.create(title='python'))
+        index = PrefixIndex()
+        index.build()
+        tags = index.suggest('pyt')[1]
+        self.assertEqual(tags, ['python'])
+        # suggest.js puts a chosen tag into the search box as [tag]
+        response = self.client.get(reverse('search'), {'q': f'[{tags[0]}]'})
+        self.assertContains(response, f'question_{question.pk}')
+
+
+class FillDbTest(TestCase):
+
+    def test_counters_match_and_likes_are_unique(self):
+        call_command('fill_db', 3, batch_size=7, stdout=StringIO())
+        self.assertEqual(Question.objects.count(), 30)
+        self.assertEqual(Question.objects.filter(tags__isnull=True).count(), 0)
+        out = StringIO()
+        call_command('rebuild_counters', dry_run=True, stdout=out)
+        self.assertEqual(out.getvalue().count(' 0 rows drifted'), 4)
+        out = StringIO()
+        call_command('rebuild_rankings', dry_run=True, stdout=out)
+        self.assertIn('0 hot scores rebuilt', out.getvalue())
+
+    def test_rebuild_counters_repairs_drift_and_hot_score(self):
+        call_command('fill_db', 1, batch_size=7, stdout=StringIO())
+        question = Question.objects.order_by('id').first()
+        expected = Question.objects.hot_score(question.rating, question.answer_count, question.creating_time)
+        Question.objects.filter(pk=question.pk).update(rating=F('rating') + 5, answer_count=F('answer_count') + 1)
+        Tag.objects.update(question_count=0)
+        out = StringIO()
+        call_command('rebuild_counters', batch_size=2, show=1, stdout=out)
+        self.assertIn('Question: 1 rows drifted', out.getvalue())
+        self.assertEqual(out.getvalue().count('Tag #'), 1)
+        question.refresh_from_db()
+        self.assertAlmostEqual(question.hot_score, expected)
+        out = StringIO()
+        call_command('rebuild_counters', dry_run=True, stdout=out)
+        self.assertEqual(out.getvalue().count(' 0 rows drifted'), 4)
+
+    def test_seed_is_deterministic(self):
+        call_command('fill_db', 2, seed=5, batch_size=3, stdout=StringIO())
+        first = list(Question.objects.order_by('id').values_list('title', 'creating_time', 'rating'))
+        Question.objects.all().delete()
+        call_command('fill_db', 2, seed=5, batch_size=3, stdout=StringIO())
+        self.assertEqual(list(Question.objects.order_by('id').values_list('title', 'creating_time', 'rating')), first)
+        Question.objects.all().delete()
+        # More chunks than the two workers may generate ahead, still written in order
+        call_command('fill_db', 2, seed=5, batch_size=3, workers=2, stdout=StringIO())
+        self.assertEqual(list(Question.objects.order_by('id').values_list('title', 'creating_time', 'rating')), first)
+
+
+class ExportImportTest(TestCase):
+
+    def setUp(self):
+        call_command('fill_db', 2, batch_size=7, stdout=StringIO())
+        self.rows = self.snapshot()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.path = os.path.join(self.directory, 'qa.jsonl.gz')
+
+    @staticmethod
+    def snapshot():
+        return {model: list(model.objects.order_by('pk').values_list(*dump.get_fields(model))) for model in dump.MODELS}
+
+    @staticmethod
+    def clear():
+        User.objects.all().delete()
+        Tag.objects.all().delete()
+
+    @staticmethod
+    def fail_after(command, calls):
+        # Lets the first calls of the command's write through and interrupts the next one
+        original = command.write
+        done = []
+
+        def write(*args):
+            if len(done) == calls:
+                raise KeyboardInterrupt
+            done.append(original(*args))
+        return mock.patch.object(command, 'write', side_effect=write)
+
+    def test_round_trip(self):
+        call_command('export_qa', self.path, chunk_size=3, stdout=StringIO())
+        self.clear()
+        out = StringIO()
+        call_command('import_qa', self.path, batch_size=2, stdout=out)
+        self.assertEqual(self.snapshot(), self.rows)
+        self.assertIn('app.answerlike: ', out.getvalue())
+        self.assertEqual(os.listdir(self.directory), ['qa.jsonl.gz'])
+        # Sequences continue after the imported ids
+        question = Question.objects.create(title='title', description='text', author=Profile.objects.first())
+        self.assertGreater(question.pk, max(row[0] for row in self.rows[Question]))
+        with self.assertRaisesMessage(CommandError, 'freshly migrated'):
+            call_command('import_qa', self.path, stdout=StringIO())
+
+    def test_interrupted_export_and_import_resume(self):
+        with self.fail_after(export_qa.Command, 10), self.assertRaises(KeyboardInterrupt):
+            call_command('export_qa', self.path, chunk_size=3, stdout=StringIO())
+        with open(self.path, 'ab') as file:
+            file.write(b'half of a chunk')
+        out = StringIO()
+        call_command('export_qa', self.path, chunk_size=3, stdout=out)
+        self.assertIn('Resuming', out.getvalue())
+        self.clear()
+
+        with self.fail_after(import_qa.Command, 12), self.assertRaises(KeyboardInterrupt):
+            call_command('import_qa', self.path, stdout=StringIO())
+        self.assertTrue(Question.objects.exists())
+        call_command('import_qa', self.path, stdout=StringIO())
+        self.assertEqual(self.snapshot(), self.rows)
+        self.assertEqual(os.listdir(self.directory), ['qa.jsonl.gz'])
+
+
+class BenchTest(TestCase):
+
+    def test_results_and_compare(self):
+        call_command('fill_db', 2, stdout=StringIO())
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'bench.json')
+            call_command('bench', requests=2, warmup=0, output=output, stdout=StringIO())
+            with open(output) as file:
+                endpoints = json.load(file)['endpoints']
+            self.assertEqual(sorted(endpoints), sorted(['index', 'hot_questions', 'best_questions', 'new_questions',
+                                                        'tag_questions', 'question', 'vote', 'ask']))
+            self.assertEqual(sum(result['errors'] for result in endpoints.values()), 0)
+
+            endpoints['index']['queries'] = 0
+            with open(output, 'w') as file:
+                json.dump({'endpoints': endpoints}, file)
+            with self.assertRaisesMessage(CommandError, 'Regression'):
+                call_command('bench', requests=2, warmup=0, endpoints=['index'], compare=output, stdout=StringIO())
+
+
+class RequestTimingTest(TestCase):
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('index'))
+        self.assertRegex(response['Server-Timing'],
+                         r'^db;dur=[\d.]+;desc="\d+ queries", tpl;dur=[\d.]+, view;dur=[\d.]+, total;dur=')
+
+    @override_settings(REQUEST_QUERY_BUDGET=0, REQUEST_LOG_SAMPLE_RATE=0)
+    def test_over_budget_is_logged(self):
+        with self.assertLogs('app.requests', 'WARNING') as logs:
+            self.client.get(reverse('index'))
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line['view'], 'index')
+        self.assertIn('queries', line['over_budget'])
+        self.assertGreaterEqual(line['total_ms'] + 0.2, line['db_ms'] + line['template_ms'] + line['view_ms'])
+        self.assertGreater(line['view_ms'], 0)
+
+    def test_template_time_leaves_out_queries(self):
+        stats = RequestStats()
+
+        def query():
+            time.sleep(0.05)
+            stats.db_time += 0.05
+
+        token = _current.set(stats)
+        try:
+            engines.all()[0].from_string('{{ query }}').render({'query': query})
+        finally:
+            _current.reset(token)
+        self.assertLess(stats.template_time, 0.04)
+
+    def test_counts_queries_from_parallel_threads(self):
+        stats = RequestStats()
+
+        def run():
+            for _ in range(1000):
+                stats(lambda *args: None, 'SELECT 1', None, False, {})
+
+        threads = [threading.Thread(target=run) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(stats.queries, 8000)
+        self.assertEqual(stats.statements['SELECT 1'], 8000)
+
+    def test_duplicate_fingerprints(self):
+        stats = RequestStats()
+        for sql in ['SELECT 1 FROM a WHERE id IN (%s, %s)', 'SELECT 1 FROM a WHERE id IN (%s)',
+                    'SELECT 1 FROM a WHERE id = 7', 'SELECT 1 FROM a WHERE id = 8', 'SELECT 1 FROM b']:
+            stats(lambda *args: None, sql, None, False, {})
+        self.assertEqual(stats.queries, 5)
+        self.assertEqual(stats.duplicates(2), [
+            ('SELECT N FROM a WHERE id IN (...)', 2), ('SELECT N FROM a WHERE id = N', 2)
+        ])
+
+
+class PageCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.author = create_profile('author')
+        self.question = Question.objects.create(title='Cached title', description='text', author=self.author)
+
+    def test_anonymous_hit_needs_no_queries(self):
+        first = self.client.get(reverse('index'))
+        with self.assertNumQueries(0):
+            second = self.client.get(reverse('index'))
+        self.assertEqual(first.content, second.content)
+        self.assertIn('Cookie', second['Vary'])
+
+    def test_key_ignores_unknown_params(self):
+        cursor = CursorPaginator(Question.objects.none(), Question.objects.new_ordering).encode(
+            [self.question.creating_time, self.question.pk + 1]
+        )
+        first = self.client.get(reverse('index'), {'after': cursor})
+        with self.assertNumQueries(0):
+            second = self.client.get(reverse('index'), {'utm_source': 'mail', 'after': cursor})
+        self.assertEqual(first.content, second.content)
+        self.assertNotEqual(self.client.get(reverse('index')).content, first.content)
+
+    def test_vote_invalidates_question_pages(self):
+        self.client.get(reverse('best_questions'))
+        self.client.get(reverse('question', args=[self.question.pk]))
+        with self.captureOnCommitCallbacks(execute=True):
+            QuestionLike.objects.create_or_change_like(self.question, create_profile('voter'), 'like')
+        for url in [reverse('best_questions'), reverse('question', args=[self.question.pk])]:
+            self.assertContains(self.client.get(url), f'question_{self.question.pk}">1<')
+
+    def test_new_answer_invalidates_question_page(self):
+        url = reverse('question', args=[self.question.pk])
+        self.client.get(url)
+        self.client.login(username='author', password='password')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url, {'description': 'Fresh answer'})
+        self.client.logout()
+        self.assertContains(self.client.get(url), 'Fresh answer')
+
+    def test_authenticated_pages_are_not_shared(self):
+        self.client.get(reverse('index'))
+        self.client.login(username='author', password='password')
+        self.assertContains(self.client.get(reverse('index')), 'log out')
+
+    def test_fragment_cache_timeout_setting(self):
+        self.client.login(username='author', password='password')
+        with override_settings(FRAGMENT_CACHE_TIMEOUT=0):
+            self.client.get(reverse('index'))
+            Question.objects.filter(pk=self.question.pk).update(title='Edited title')
+            self.assertContains(self.client.get(reverse('index')), 'Edited title')
+        self.client.get(reverse('index'))
+        Question.objects.filter(pk=self.question.pk).update(title='Stale title')
+        self.assertContains(self.client.get(reverse('index')), 'Edited title')
+
+
+class HotRankingTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.author = create_profile('author')
+        self.client.login(username='author', password='password')
+
+    def ask(self, title):
+        self.client.post(reverse('ask'), {'title': title, 'description': 'text', 'tags': 'tag'})
+        return Question.objects.get(title=title)
+
+    def test_votes_and_answers_move_hot_score(self):
+        question = self.ask('first')
+        base = question.hot_score
+        self.assertAlmostEqual(base, Question.objects.hot_score(0, 0, question.creating_time))
+        QuestionLike.objects.create_or_change_like(question, create_profile('voter'), 'like')
+        self.client.post(reverse('question', args=[question.pk]), {'description': 'answer'})
+        question.refresh_from_db()
+        self.assertAlmostEqual(question.hot_score, base + 1 + Question.objects.hot_answer_weight)
+
+    def test_newer_question_outranks_older_by_decay(self):
+        old = self.ask('old')
+        new = self.ask('new')
+        day_old = old.creating_time - timedelta(days=1)
+        Question.objects.filter(pk=old.pk).update(
+            creating_time=day_old, hot_score=Question.objects.hot_score(1, 0, day_old)
+        )
+        self.assertEqual(list(Question.objects.get_hot_ids()), [new.pk, old.pk])
+
+        Question.objects.filter(pk=old.pk).update(rating=10)
+        out = StringIO()
+        call_command('rebuild_rankings', stdout=out)
+        self.assertIn('1 hot scores rebuilt', out.getvalue())
+        self.assertEqual(list(Question.objects.get_hot_ids()), [old.pk, new.pk])
+        old.refresh_from_db()
+        self.assertAlmostEqual(old.hot_score, Question.objects.hot_score(10, 0, day_old))
+
+
+class AsyncViewsTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        refresh_sidebar()
+        self.author = create_profile('author')
+        self.question = Question.objects.create(title='Async title', description='text', author=self.author)
+        self.question.tags.add(Tag.objects.create(title='python'))
+        self.answer = Answer.objects.create(description='Async answer', author=self.author, question=self.question)
+        self.factory = AsyncRequestFactory()
+
+    def request(self, method, url, user=None, **data):
+        if method == 'post':
+            request = self.factory.post(url, urlencode(data), content_type='application/x-www-form-urlencoded')
+        else:
+            request = self.factory.get(url, data)
+        request.user = user or AnonymousUser()
+        return request
+
+    async def test_question_page(self):
+        response = await async_views.question(self.request('get', reverse('question', args=[self.question.pk])),
+                                              self.question.pk)
+        self.assertContains(response, 'Async answer')
+        cursor = CursorPaginator(Answer.objects.none(), Answer.objects.best_ordering).encode([0, self.answer.pk])
+        response = await async_views.question(
+            self.request('get', reverse('question', args=[self.question.pk]), after=cursor), self.question.pk
+        )
+        self.assertNotContains(response, 'Async answer')
+
+    async def test_question_loads_sidebar_once_and_renders_without_queries(self):
+        loads = mock.Mock(wraps=get_sidebar)
+        rendered = []
+
+        def counted_render(*args, **kwargs):
+            with CaptureQueriesContext(connection) as context:
+                response = render(*args, **kwargs)
+            rendered.append(len(context.captured_queries))
+            return response
+
+        with mock.patch('app.async_views.get_sidebar', loads), mock.patch('app.context_processors.get_sidebar', loads), \
+                mock.patch('app.async_views.render', counted_render):
+            response = await async_views.question(self.request('get', reverse('question', args=[self.question.pk])),
+                                                  self.question.pk)
+        self.assertContains(response, 'python')
+        self.assertEqual(loads.call_count, 1)
+        self.assertEqual(rendered, [0])
+
+    async def test_vote_and_correct(self):
+        voter = await User.objects.aget(username='author')
+        response = await async_views.vote(self.request(
+            'post', reverse('vote'), voter, id=self.question.pk, vote='like', type='question'
+        ))
+        self.assertEqual(json.loads(response.content), {'likes': 1})
+        answer = await Answer.objects.aget(question=self.question)
+        await async_views.correct(self.request('post', reverse('correct'), voter, id=answer.pk, correct='true'))
+        self.assertTrue((await Answer.objects.aget(pk=answer.pk)).is_correct)
+
+    async def test_anonymous_vote_redirects_to_login(self):
+        response = await async_views.vote(self.request('post', reverse('vote'), id=1, vote='like', type='question'))
+        self.assertEqual(response.status_code, 302)
+
+    async def test_middleware_counts_queries_under_asgi(self):
+        response = await self.async_client.get(reverse('index'))
+        self.assertRegex(response['Server-Timing'], r'desc="[1-9]\d* queries"')
+
+
+class CursorPaginatorTest(TestCase):
+
+    def setUp(self):
+        author = create_profile('author')
+        for i in range(23):
+            Question.objects.create(title=f'title {i}', description='text', author=author, rating=i % 4)
+
+    def walk(self, queryset, ordering):
+        paginator = CursorPaginator(queryset, ordering, 5)
+        pages = [paginator.get_page()]
+        while pages[-1].has_next:
+            pages.append(paginator.get_page(after=pages[-1].next_cursor))
+        back = [pages[-1]]
+        while back[0].has_previous:
+            back.insert(0, paginator.get_page(before=back[0].previous_cursor))
+        return pages, back
+
+    def test_pages_follow_ordering(self):
+        for ordering in (Question.objects.new_ordering, Question.objects.best_ordering):
+            pages, back = self.walk(Question.objects.all(), ordering)
+            ids = [id for page in pages for id in page]
+            self.assertEqual(ids, list(Question.objects.order_by(*ordering).values_list('id', flat=True)))
+            self.assertEqual([list(page) for page in back], [list(page) for page in pages])
+
+    def test_last_page_and_bad_cursor(self):
+        paginator = CursorPaginator(Question.objects.all(), Question.objects.new_ordering, 5)
+        ids = list(Question.objects.get_all_ids())
+        self.assertEqual(list(paginator.get_page(last=True)), ids[-5:])
+        self.assertEqual(list(paginator.get_page(after='garbage')), ids[:5])
+
+
+class QueryPlanTest(TestCase):
+    # Every manager query must be answered through an index: no bare table scans and
+    # no temporary B-trees for sorting, grouping or DISTINCT.
+
+    @classmethod
+    def setUpTestData(cls):
+        profiles = [create_profile(f'user{i}') for i in range(5)]
+        tags = [Tag.objects.create(title=f'tag{i}') for i in range(5)]
+        for i in range(30):
+            question = Question.objects.create(title=f'title {i}', description='text', author=profiles[i % 5])
+            question.tags.add(tags[i % 5])
+            QuestionLike.objects.create_or_change_like(question, profiles[i % 3], 'like')
+            answer = Answer.objects.create(description='text', author=profiles[i % 4], question=question)
+            AnswerLike.objects.create_or_change_like(answer, profiles[i % 2], 'dislike')
+        cls.question = Question.objects.latest('id')
+        cls.answer = Answer.objects.latest('id')
+        cls.profile = profiles[0]
+
+    def setUp(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('query plans are checked with SQLite EXPLAIN QUERY PLAN')
+
+    def assertIndexed(self, call):
+        with CaptureQueriesContext(connection) as context:
+            result = call()
+            if hasattr(result, '__iter__') and not isinstance(result, (str, dict)):
+                list(result)
+        self.assertTrue(context.captured_queries)
+        tables = connection.introspection.table_names()
+        for query in context.captured_queries:
+            sql = query['sql']
+            if not sql.startswith(('SELECT', 'UPDATE', 'DELETE', 'WITH')):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                plan = [row[-1] for row in cursor.fetchall()]
+            for step in plan:
+                self.assertNotIn(step, [f'SCAN {table}' for table in tables], f'full scan in {sql}\n{plan}')
+                self.assertNotIn('TEMP B-TREE', step, f'temporary sort in {sql}\n{plan}')
+
+    def test_question_manager(self):
+        paginator = CursorPaginator(Question.objects.get_all_ids(), Question.objects.new_ordering, 5)
+        cursor = paginator.get_page().next_cursor
+        calls = [
+            lambda: Question.objects.get_likes(self.question.pk),
+            lambda: Question.objects.get_all([self.question.pk, self.question.pk - 1]),
+            lambda: Question.objects.get_all_ids()[:10],
+            lambda: Question.objects.get_new_ids(10),
+            lambda: Question.objects.get_best_ids(10),
+            lambda: Question.objects.get_hot_ids(10),
+            lambda: Question.objects.get_by_tag_ids('tag1')[:10],
+            lambda: paginator.get_page(after=cursor),
+            lambda: paginator.get_page(before=cursor),
+            lambda: CursorPaginator(Question.objects.get_best_ids(), Question.objects.best_ordering, 5).get_page(
+                after=paginator.encode([1, self.question.pk])),
+            lambda: CursorPaginator(Question.objects.get_by_tag_ids('tag1'), Question.objects.tag_ordering, 5,
+                                    'question_id').get_page(after=cursor),
+        ]
+        for call in calls:
+            self.assertIndexed(call)
+
+    def test_answer_manager(self):
+        calls = [
+            lambda: Answer.objects.get_likes(self.answer.pk),
+            lambda: Answer.objects.get_all([self.answer.pk]),
+            lambda: Answer.objects.get_all_ids(self.question.pk)[:5],
+            lambda: CursorPaginator(Answer.objects.get_all_ids(self.question.pk), Answer.objects.best_ordering,
+                                    5).start_cursor([0, self.answer.pk]),
+        ]
+        for call in calls:
+            self.assertIndexed(call)
+
+    def test_tag_and_profile_managers(self):
+        calls = [
+            lambda: Tag.objects.resolve(['tag1', 'tag2']),
+            lambda: Tag.objects.get_popular(),
+            lambda: Profile.objects.get_user_by_username('user1'),
+            lambda: Profile.objects.get_user_by_email('user1@mail.ru'),
+            lambda: Profile.objects.get_users_by_username_or_email('user1', 'USER2@mail.ru'),
+            lambda: Profile.objects.get_best(),
+        ]
+        for call in calls:
+            self.assertIndexed(call)
+
+    def test_like_managers(self):
+        calls = [
+            lambda: QuestionLike.objects.create_or_change_like(self.question, self.profile, 'like'),
+            lambda: AnswerLike.objects.create_or_change_like(self.answer, self.profile, 'dislike'),
+        ]
+        for call in calls:
+            self.assertIndexed(call)
+
+
+class VoteConcurrencyTest(TransactionTestCase):
+    threads = 8
+    votes_per_thread = 25
+
+    def setUp(self):
+        self.author = create_profile('author')
+        self.question = Question.objects.create(title='title', description='text', author=self.author)
+        self.voters = [create_profile(f'voter{i}') for i in range(self.threads)]
+
+    def run_threads(self, target, args):
+        errors = []
+
+        def wrapper(*args):
+            try:
+                target(*args)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=wrapper, args=arg) for arg in args]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_parallel_votes_keep_exact_totals(self):
+        sequence = ['like', 'dislike', 'dislike', 'like', 'like']
+
+        def vote(profile):
+            for i in range(self.votes_per_thread):
+                QuestionLike.objects.create_or_change_like(self.question, profile, sequence[i % len(sequence)])
+
+        self.run_threads(vote, [(profile,) for profile in self.voters])
+
+        expected = 0
+        for i in range(self.votes_per_thread):
+            vote_type = QuestionLike.objects.like_enum[sequence[i % len(sequence)]]
+            expected = 0 if expected == vote_type else vote_type
+        types = list(QuestionLike.objects.filter(question=self.question).values_list('type', flat=True))
+        self.assertEqual(types, [expected] * self.threads)
+        self.assertEqual(Question.objects.get_likes(self.question.pk), expected * self.threads)
+
+    def test_parallel_clicks_by_one_user(self):
+        voter = self.voters[0]
+
+        def vote(_):
+            for _ in range(self.votes_per_thread):
+                QuestionLike.objects.create_or_change_like(self.question, voter, 'like')
+
+        self.run_threads(vote, [(i,) for i in range(self.threads)])
+
+        like = QuestionLike.objects.get(question=self.question, author=voter)
+        total = self.threads * self.votes_per_thread
+        self.assertEqual(like.type, total % 2)
+        self.assertEqual(Question.objects.get_likes(self.question.pk), like.type)
+
+    @skipUnless(connection.vendor == 'postgresql', 'READ COMMITTED snapshots per statement')
+    def test_click_waiting_for_the_lock_sees_the_committed_like(self):
+        voter = self.voters[0]
+        holding = threading.Event()
+
+        def first():
+            with transaction.atomic():
+                QuestionLike.objects.create_or_change_like(self.question, voter, 'like')
+                holding.set()
+                # The second click waits for the row lock until this commits
+                time.sleep(0.3)
+
+        def second():
+            holding.wait()
+            QuestionLike.objects.create_or_change_like(self.question, voter, 'like')
+
+        self.run_threads(lambda click: click(), [(first,), (second,)])
+
+        like = QuestionLike.objects.get(question=self.question, author=voter)
+        self.assertEqual(like.type, 0)
+        self.assertEqual(Question.objects.get_likes(self.question.pk), 0)
+
+    def test_parallel_batches_by_one_user(self):
+        voter = self.voters[0]
+
+        def vote(_):
+            for _ in range(self.votes_per_thread):
+                QuestionLike.objects.vote_many(voter.pk, [(self.question.pk, 1)] * 3)
+
+        self.run_threads(vote, [(i,) for i in range(self.threads)])
+
+        like = QuestionLike.objects.get(question=self.question, author=voter)
+        self.assertEqual(like.type, self.threads * self.votes_per_thread * 3 % 2)
+        self.assertEqual(Question.objects.get_likes(self.question.pk), like.type)
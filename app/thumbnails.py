@@ -0,0 +1,119 @@
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from PIL import Image, ImageOps
+
+from .backends import forget_user
+from .models import Profile
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {'webp': ('WEBP', {'quality': 80, 'method': 4}), 'jpg': ('JPEG', {'quality': 85, 'optimize': True})}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_sizes():
+    return sorted(getattr(settings, 'AVATAR_THUMBNAIL_SIZES', (96, 192)))
+
+
+def get_prefix(name):
+    # Thumbnails are named after the original, and an upload never reuses a name, so
+    # their URLs can be cached forever and change with every new avatar.
+    digest = hashlib.md5(name.encode()).hexdigest()
+    return f'thumbs/{digest[:2]}/{digest}'
+
+
+def get_name(prefix, size, ext):
+    return f'{prefix}-{size}.{ext}'
+
+
+def render(file, sizes):
+    image = Image.open(file)
+    # JPEG is decoded straight at the nearest scale above the largest thumbnail.
+    image.draft('RGB', (sizes[-1], sizes[-1]))
+    image = ImageOps.exif_transpose(image)
+    if image.mode == 'P' and 'transparency' in image.info:
+        image = image.convert('RGBA')
+    if image.mode in ('RGBA', 'LA'):
+        # JPEG has no alpha, transparent avatars go on white like the page
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    image = image.convert('RGB')
+    for size in sizes:
+        # Square crops: avatars are shown in circles with object-fit: cover
+        thumb = ImageOps.fit(image, (size, size), Image.LANCZOS)
+        for ext, (format, options) in FORMATS.items():
+            data = BytesIO()
+            thumb.save(data, format, **options)
+            yield size, ext, data.getvalue()
+
+
+def make_thumbnails(name, force=False):
+    # Writes the missing variants of the avatar stored under name and returns their prefix.
+    prefix = get_prefix(name)
+    sizes = get_sizes()
+    if not force and all(default_storage.exists(get_name(prefix, size, ext)) for size in sizes for ext in FORMATS):
+        return prefix
+    with default_storage.open(name) as file:
+        for size, ext, data in render(file, sizes):
+            target = get_name(prefix, size, ext)
+            if default_storage.exists(target):
+                default_storage.delete(target)
+            default_storage.save(target, ContentFile(data))
+    return prefix
+
+
+def update_profile(profile_id, name, close=False):
+    try:
+        prefix = make_thumbnails(name)
+        # The avatar may have been replaced while the thumbnails were made.
+        Profile.objects.filter(pk=profile_id, avatar=name).update(avatar_thumbnail=prefix)
+        forget_user(Profile.objects.filter(pk=profile_id).values_list('user_id', flat=True).first())
+    except Exception:
+        logger.exception('Making thumbnails of %s failed', name)
+    finally:
+        if close:
+            connection.close()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(getattr(settings, 'AVATAR_THUMBNAIL_WORKERS', 2), 'thumbnails')
+    return _executor
+
+
+def schedule(profile):
+    # Runs once the new avatar is committed; until then the page shows the original.
+    name = profile.avatar.name
+    if not name:
+        return
+    if getattr(settings, 'AVATAR_THUMBNAIL_WORKERS', 2):
+        transaction.on_commit(lambda: get_executor().submit(update_profile, profile.pk, name, True))
+    else:
+        transaction.on_commit(lambda: update_profile(profile.pk, name))
+
+
+def get_variants(avatar, size):
+    # The smallest thumbnails covering size at 1x and at 2x, or None until they exist.
+    prefix = getattr(avatar.instance, 'avatar_thumbnail', None) if avatar else None
+    sizes = get_sizes()
+    if not prefix or prefix != get_prefix(avatar.name):
+        return None
+    one = next((s for s in sizes if s >= size), sizes[-1])
+    two = next((s for s in sizes if s >= 2 * size), sizes[-1])
+    return {
+        ext: {'1x': default_storage.url(get_name(prefix, one, ext)), '2x': default_storage.url(get_name(prefix, two, ext))}
+        for ext in FORMATS
+    }
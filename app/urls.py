@@ -1,5 +1,8 @@
+from django.conf import settings
 from django.urls import path
-from app import views
+from app import async_views, views
+
+question_views = async_views if settings.ASYNC_VIEWS else views
 
 urlpatterns = [
     path('', views.index, name='index'),
@@ -7,5 +10,5 @@ urlpatterns = [
     path('best/', views.best_questions, name='best_questions'),
     path('new/', views.new_questions, name='new_questions'),
     path('tag/<str:tag>', views.tag_questions, name='tag_questions'),
-    path('question/<int:question_id>', views.question, name='question')
+    path('question/<int:question_id>', question_views.question, name='question')
 ]
\ No newline at end of file
@@ -1,16 +1,27 @@
+import json
+
+from django.db import transaction
 from django.shortcuts import render
 from django.views.decorators.http import require_http_methods
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
 from django.shortcuts import get_object_or_404, redirect, reverse
-from django.contrib.auth.models import User
 from django.http import JsonResponse
+from django.utils.http import urlencode
 from django.forms import model_to_dict
 from django.contrib import auth
-from .models import Question, QuestionLike, AnswerLike, Answer, Tag, Profile
+from .models import Question, QuestionLike, AnswerLike, Answer, Tag
+from . import page_cache
+from .page_cache import cache_anonymous_page
+from .pagination import CursorPaginator
+from .search import search_ids
+from .suggest import get_index
 from .forms import LoginForm, RegistrationForm, SettingsForm, QuestionForm, AnswerForm
 from django.http import Http404
 
+ANSWERS_PER_PAGE = 5
+VOTE_BATCH_LIMIT = 100
+
 
 def paginate(request, data, count=10):
     paginator = Paginator(data, count)
@@ -20,80 +31,88 @@ def paginate(request, data, count=10):
     return page_obj, last_page
 
 
-@require_http_methods(['GET'])
-def index(request):
-    questions = Question.objects.get_all_ids()
-    page_obj, last_page = paginate(request, questions, 10)
-    data = Question.objects.get_all(page_obj)
-    context = {
-        'last_page': last_page,
+def cursor_paginate(request, data, ordering, count=10, key='pk'):
+    paginator = CursorPaginator(data, ordering, count, key)
+    return paginator.get_page(
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+        last='last' in request.GET
+    )
+
+
+def feed_context(request, questions, ordering, feed, key='pk'):
+    page_cache.depend(request, feed)
+    page_obj = cursor_paginate(request, questions, ordering, 10, key)
+    page_cache.depend(request, *map(page_cache.question, page_obj))
+    return {
         'page_obj': page_obj,
-        'data': data,
-        'ptags': Tag.objects.get_popular(),
-        'bmembers': Profile.objects.get_best()
+        'data': Question.objects.get_all(page_obj)
     }
+
+
+@require_http_methods(['GET'])
+@cache_anonymous_page
+def index(request):
+    context = feed_context(request, Question.objects.get_all_ids(), Question.objects.new_ordering, page_cache.feed('new'))
     return render(request, 'all_questions.html', context=context)
 
 
 @require_http_methods(['GET'])
+@cache_anonymous_page
 def tag_questions(request, tag):
-    questions = Question.objects.get_by_tag_ids(tag)
-    page_obj, last_page = paginate(request, questions, 10)
-    data = Question.objects.get_all(page_obj)
-    context = {
-        'tag': tag,
-        'page_obj': page_obj,
-        'data': data,
-        'last_page': last_page,
-        'ptags': Tag.objects.get_popular(),
-        'bmembers': Profile.objects.get_best()
-    }
+    context = feed_context(
+        request, Question.objects.get_by_tag_ids(tag), Question.objects.tag_ordering,
+        page_cache.tag_feed(Tag.objects.normalize(tag)), 'question_id'
+    )
+    context['tag'] = tag
     return render(request, 'tag_questions.html', context=context)
 
 
 @require_http_methods(['GET'])
+@cache_anonymous_page
 def hot_questions(request):
-    questions = Question.objects.get_hot_ids(30)
-    page_obj, last_page = paginate(request, questions, 10)
-    data = Question.objects.get_all(page_obj)
-    context = {
-        'page_obj': page_obj,
-        'data': data,
-        'last_page': last_page,
-        'ptags': Tag.objects.get_popular(),
-        'bmembers': Profile.objects.get_best()
-    }
+    context = feed_context(request, Question.objects.get_hot_ids(), Question.objects.hot_ordering, page_cache.feed('hot'))
     return render(request, 'hot_questions.html', context=context)
 
 
 @require_http_methods(['GET'])
+@cache_anonymous_page
 def best_questions(request):
-    questions = Question.objects.get_best_ids(30)
-    page_obj, last_page = paginate(request, questions, 10)
-    data = Question.objects.get_all(page_obj)
-    context = {
-        'page_obj': page_obj,
-        'data': data,
-        'last_page': last_page,
-        'ptags': Tag.objects.get_popular(),
-        'bmembers': Profile.objects.get_best()
-    }
+    context = feed_context(request, Question.objects.get_best_ids(), Question.objects.best_ordering, page_cache.feed('best'))
     return render(request, 'best_questions.html', context=context)
 
 
 @require_http_methods(['GET'])
+@cache_anonymous_page
 def new_questions(request):
-    questions = Question.objects.get_new_ids()
+    context = feed_context(request, Question.objects.get_new_ids(), Question.objects.new_ordering, page_cache.feed('new'))
+    return render(request, 'new_questions.html', context=context)
+
+
+@require_http_methods(['GET'])
+def search(request):
+    query = request.GET.get('q', '').strip()
+    tags = request.GET.getlist('tag')
+    questions = search_ids(query, tags)
     page_obj, last_page = paginate(request, questions, 10)
     data = Question.objects.get_all(page_obj)
     context = {
+        'query': query,
+        'page_query': urlencode({'q': query, 'tag': tags}, doseq=True) + '&',
         'page_obj': page_obj,
         'data': data,
-        'last_page': last_page,
-        'ptags': Tag.objects.get_popular(),
-        'bmembers': Profile.objects.get_best()
+        'last_page': last_page
     }
-    return render(request, 'new_questions.html', context=context)
+    return render(request, 'search.html', context=context)
+
+
+@require_http_methods(['GET'])
+def suggest(request):
+    questions, tags = get_index().suggest(request.GET.get('q', ''))
+    return JsonResponse({
+        'questions': questions,
+        'tags': tags
+    })
 
 
 @require_http_methods(['GET', 'POST'])
@@ -103,16 +122,11 @@ def signup(request):
     if request.method == 'POST':
         user_form = RegistrationForm(request.POST, request.FILES)
         if user_form.is_valid():
-            user = user_form.save()
-            if user:
-                login_form = LoginForm(request.POST)
-                login_form.is_valid()
-                user_auth = auth.authenticate(request=request, **login_form.cleaned_data)
-                auth.login(request, user_auth)
-                return redirect(reverse('index'))
+            profile = user_form.save()
+            # The password was just set, there is nothing to check again
+            auth.login(request, profile.user, backend='app.backends.CachedModelBackend')
+            return redirect(reverse('index'))
     context = {
-        'ptags': Tag.objects.get_popular(),
-        'bmembers': Profile.objects.get_best(),
         'form': user_form
     }
     return render(request, 'signup.html', context=context)
@@ -124,17 +138,13 @@ def log_in(request):
     if request.method == 'GET':
         login_form = LoginForm()
     else:
-        login_form = LoginForm(request.POST)
+        login_form = LoginForm(request.POST, request=request)
         if login_form.is_valid():
-            user = auth.authenticate(request=request, **login_form.cleaned_data)
-            if user:
-                auth.login(request, user)
-                cont = request.POST.get("continue", None)
-                return redirect(cont if cont and cont != "None" else reverse('index'))
+            auth.login(request, login_form.user)
+            cont = request.POST.get("continue", None)
+            return redirect(cont if cont and cont != "None" else reverse('index'))
 
     context = {
-        'ptags': Tag.objects.get_popular(),
-        'bmembers': Profile.objects.get_best(),
         'form': login_form,
         'continue': cont
     }
@@ -152,8 +162,7 @@ def logout(request):
 @login_required(login_url="login", redirect_field_name="continue")
 @require_http_methods(['GET', 'POST'])
 def settings(request):
-    user = get_object_or_404(User, id=request.user.id)
-    user_id = user.id
+    user = request.user
     if request.method == "GET":
         initial_data = model_to_dict(user)
         nickname = user.profile.nickname
@@ -165,19 +174,11 @@ def settings(request):
         form = SettingsForm(request.POST, request.FILES, instance=request.user)
         if form.is_valid():
             form.save()
-            user = get_object_or_404(User, id=user_id)
-            data = {
-                'username': user.username,
-                'password': user.password
-            }
-            login_form = LoginForm(data)
-            login_form.is_valid()
-            user_auth = auth.authenticate(request=request, **login_form.cleaned_data)
-            auth.login(request, user_auth)
+            if form.cleaned_data.get('new_password'):
+                # Keeps this session valid without hashing the password again
+                auth.update_session_auth_hash(request, user)
 
     context = {
-        'ptags': Tag.objects.get_popular(),
-        'bmembers': Profile.objects.get_best(),
         'form': form
     }
     return render(request, 'settings.html', context=context)
@@ -194,54 +195,46 @@ def ask(request):
             q_id = question_form.save(request.user.profile)
             return redirect('question', q_id)
     context = {
-        'ptags': Tag.objects.get_popular(),
-        'bmembers': Profile.objects.get_best(),
         'form': question_form
     }
     return render(request, 'ask.html', context=context)
 
 
-def custom_paginate(obj, data, count=10):
-    page = obj // count + 1
-    paginator = Paginator(data, count)
-    page_obj = paginator.get_page(page)
-    last_page = len(paginator.page_range)
-    return page_obj, last_page
-
-
 @require_http_methods(['GET', 'POST'])
+@cache_anonymous_page
 def question(request, question_id: int):
-    question_item = get_object_or_404(Question, pk=question_id)
+    page_cache.depend(request, page_cache.question(question_id), page_cache.answers(question_id))
 
     if request.method == 'POST':
         if not hasattr(request.user, 'profile'):
             return redirect('login')
         answer_form = AnswerForm(request.POST)
         if answer_form.is_valid():
-            ans_id = answer_form.save(request.user.profile, question_item)
-            answers_ids = Answer.objects.get_all_ids(question_id)
-            ind = list(answers_ids).index(ans_id)
-            page_obj, last_page = custom_paginate(ind, answers_ids, 5)
-            data = Answer.objects.get_all(page_obj)
-        answer_form = AnswerForm()
+            ans_id = answer_form.save(request.user.profile, get_object_or_404(Question, pk=question_id))
+            # To the page that starts with the new answer
+            paginator = CursorPaginator(Answer.objects.get_all_ids(question_id), Answer.objects.best_ordering,
+                                        ANSWERS_PER_PAGE)
+            cursor = paginator.start_cursor(Answer.objects.filter(pk=ans_id).values_list(*paginator.fields).get())
+            query = f'?after={cursor}' if cursor else ''
+            return redirect(f"{reverse('question', args=[question_id])}{query}#answer_{ans_id}")
     else:
         answer_form = AnswerForm()
-        answers = Answer.objects.get_all_ids(question_id)
-        page_obj, last_page = paginate(request, answers, 5)
-        data = Answer.objects.get_all(page_obj)
+    # The header and the answers come from the batch loaders the feeds use, so the
+    # page costs the same few queries whatever the number of answers on it.
+    header = Question.objects.get_all([question_id])
+    if not header:
+        raise Http404
+    answers = Answer.objects.get_all_ids(question_id)
+    page_obj = cursor_paginate(request, answers, Answer.objects.best_ordering, ANSWERS_PER_PAGE)
+    data = Answer.objects.get_all(page_obj)
 
-    is_author = False
-    if question_item.author.user == request.user:
-        is_author = True
+    profile = getattr(request.user, 'profile', None)
     context = {
-        'question': Question.objects.get_obj(question_item),
+        'question': header[0],
         'page_obj': page_obj,
         'data': data,
-        'last_page': last_page,
-        'ptags': Tag.objects.get_popular(),
-        'bmembers': Profile.objects.get_best(),
         'form': answer_form,
-        'author': is_author
+        'author': profile is not None and header[0]['author_id'] == profile.pk
     }
     return render(request, 'question.html', context=context)
 
@@ -260,12 +253,43 @@ def vote(request):
         raise Http404
     if type == "question":
         question_item = get_object_or_404(Question, pk=id)
-        QuestionLike.objects.create_or_change_like(question_item, request.user.profile, vote)
-        likes = Question.objects.get_likes(id)
+        likes = QuestionLike.objects.create_or_change_like(question_item, request.user.profile, vote)
     if type == 'answer':
         answer_item = get_object_or_404(Answer, pk=id)
-        AnswerLike.objects.create_or_change_like(answer_item, request.user.profile, vote)
-        likes = Answer.objects.get_likes(id)
+        likes = AnswerLike.objects.create_or_change_like(answer_item, request.user.profile, vote)
+    return JsonResponse({
+        'likes': likes
+    })
+
+
+@login_required(login_url="login", redirect_field_name="continue")
+@require_http_methods(['POST'])
+def vote_batch(request):
+    try:
+        votes = json.loads(request.body)['votes']
+    except (ValueError, KeyError, TypeError):
+        raise Http404
+    if not isinstance(votes, list) or not votes or len(votes) > VOTE_BATCH_LIMIT:
+        raise Http404
+    if not hasattr(request.user, 'profile'):
+        raise Http404
+    managers = {'question': QuestionLike.objects, 'answer': AnswerLike.objects}
+    by_type = {type: [] for type in managers}
+    for item in votes:
+        try:
+            type, id, vote = item['type'], int(item['id']), item['vote']
+            if not isinstance(type, str) or not isinstance(vote, str):
+                # Lists and objects cannot even be looked up in managers
+                raise TypeError
+        except (KeyError, TypeError, ValueError):
+            raise Http404
+        if type not in managers or vote not in ["like", "dislike"]:
+            raise Http404
+        by_type[type].append((id, managers[type].like_enum[vote]))
+    with transaction.atomic():
+        likes = {
+            type: managers[type].vote_many(request.user.profile.pk, items) for type, items in by_type.items() if items
+        }
     return JsonResponse({
         'likes': likes
     })
@@ -288,6 +312,7 @@ def correct(request):
         raise Http404
     answer.is_correct = enum_states[correct]
     answer.save()
+    page_cache.invalidate(page_cache.answers(answer.question_id))
     return JsonResponse({
         'correct': correct
     })
@@ -0,0 +1,219 @@
+import atexit
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connection, connections, transaction
+
+from .votes import SAME_VOTE, compose_votes, toggle_vote
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_SUFFIX = '.journal'
+
+
+class VoteBuffer:
+    # Write-behind votes, used when settings.VOTE_BUFFER is on. A click is folded into
+    # the in-process state of its (like model, object, user) and answered with the
+    # projected rating; a background thread writes the net changes of all buffered
+    # clicks every interval in one transaction with apply_votes. Every click is first
+    # appended to a journal segment, so votes of a process that died before its flush
+    # are applied by the next buffer that starts on the same directory.
+    #
+    # A flush writes the clicks as a vote transition, applied to the like apply_votes
+    # locks: clicks of one user buffered by two workers toggle in turn instead of the
+    # later flush overwriting the earlier one with the type its worker expected.
+    # Journal lines hold the like type a click leaves behind rather than the click,
+    # which makes replaying a segment that was partly or fully flushed harmless.
+
+    def __init__(self, directory, interval=0.2, fsync=False):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.interval = interval
+        self.fsync = fsync
+        self.pid = os.getpid()
+        self.token = f'{time.time_ns():x}-{self.pid}'
+        self.sequence = 0
+        self.lock = threading.Lock()
+        self.flushed = threading.Condition(self.lock)
+        # Odd while a flush is writing: its changes may or may not be in the database yet.
+        self.generation = 0
+        # (like model label, object id, profile id) ->
+        #     [type in the database, buffered type, transition of the buffered clicks]
+        self.pending = {}
+        self.flushing = {}
+        # (like model label, object id) -> sum of the rating changes not yet written
+        self.deltas = {}
+        self.journal = self.open_segment()
+        self.flushing_journal = None
+        self.thread = None
+        self.recover()
+
+    def open_segment(self):
+        self.sequence += 1
+        file = open(self.directory / f'{self.token}-{self.sequence:08d}{JOURNAL_SUFFIX}', 'a')
+        # Held until the segment is flushed and removed; a lock that can be taken
+        # means the process that wrote the segment is gone.
+        fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return file
+
+    def start(self):
+        if self.thread is None and self.interval > 0:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+            atexit.register(self.flush)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Flushing buffered votes failed, retrying')
+            finally:
+                connection.close()
+
+    def vote(self, manager, obj_id, profile_id, value):
+        label = manager.model._meta.label
+        key = label, obj_id, profile_id
+        self.start()
+        while True:
+            with self.lock:
+                self.flushed.wait_for(lambda: self.generation % 2 == 0)
+                generation = self.generation
+            rating, type = read(manager, obj_id, profile_id)
+            if rating is None:
+                raise manager.model._meta.get_field(manager.target).related_model.DoesNotExist
+            with self.lock:
+                # A flush that finished in between may already have the buffered
+                # changes in the rating that was read.
+                if generation != self.generation:
+                    continue
+                if key not in self.pending:
+                    base = self.flushing[key][1] if key in self.flushing else type or 0
+                    self.pending[key] = [base, base, SAME_VOTE]
+                entry = self.pending[key]
+                new = 0 if entry[1] == value else value
+                entry[2] = compose_votes(entry[2], toggle_vote(value))
+                self.deltas[label, obj_id] = self.deltas.get((label, obj_id), 0) + new - entry[1]
+                entry[1] = new
+                self.journal.write(json.dumps([label, obj_id, profile_id, new]) + '\n')
+                self.journal.flush()
+                if self.fsync:
+                    os.fsync(self.journal.fileno())
+                return rating + self.deltas[label, obj_id]
+
+    def flush(self):
+        with self.lock:
+            # A flush that failed is retried before anything newer is taken.
+            if not self.flushing:
+                if not self.pending:
+                    return
+                self.flushing, self.pending = self.pending, {}
+                self.flushing_journal, self.journal = self.journal, self.open_segment()
+            self.generation += 1
+            entries = dict(self.flushing)
+        try:
+            write({key: transition for key, (_, _, transition) in entries.items()})
+        except BaseException:
+            with self.lock:
+                self.generation += 1
+                self.flushed.notify_all()
+            raise
+        with self.lock:
+            for (label, obj_id, profile_id), (base, type, _) in entries.items():
+                self.deltas[label, obj_id] = self.deltas.get((label, obj_id), 0) - (type - base)
+            self.deltas = {key: delta for key, delta in self.deltas.items() if delta}
+            self.flushing = {}
+            os.unlink(self.flushing_journal.name)
+            self.flushing_journal.close()
+            self.flushing_journal = None
+            self.generation += 1
+            self.flushed.notify_all()
+
+    def recover(self):
+        # Applies the segments of dead processes, oldest first so that the last
+        # line of a user's votes on an object wins.
+        entries = {}
+        segments = []
+        for path in sorted(self.directory.glob('*' + JOURNAL_SUFFIX)):
+            file = open(path)
+            try:
+                fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                file.close()
+                continue
+            segments.append(file)
+            for line in file:
+                try:
+                    label, obj_id, profile_id, type = json.loads(line)
+                except ValueError:
+                    # The line a crash cut short never got its answer either.
+                    continue
+                # The journaled type, whatever the like is now: the clicks may be in already
+                entries[label, obj_id, profile_id] = (type, type, type)
+        if entries:
+            write(entries)
+            logger.info('Recovered %d buffered votes from %d journal segments', len(entries), len(segments))
+        for file in segments:
+            os.unlink(file.name)
+            file.close()
+        return len(entries)
+
+    def close(self):
+        self.flush()
+        self.journal.close()
+        os.unlink(self.journal.name)
+
+
+def read(manager, obj_id, profile_id):
+    # One statement on the click path: the rating and the user's like. Built by hand
+    # like LikeManager.vote, the ORM costs more than the query here.
+    connection = connections[manager.db]
+    like_table = connection.ops.quote_name(manager.model._meta.db_table)
+    target_model = manager.model._meta.get_field(manager.target).related_model
+    target_table = connection.ops.quote_name(target_model._meta.db_table)
+    column = connection.ops.quote_name(manager.model._meta.get_field(manager.target).column)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rating, (SELECT type FROM {like_table} WHERE {column} = %s AND author_id = %s) '
+            f'FROM {target_table} WHERE id = %s',
+            [obj_id, profile_id, obj_id]
+        )
+        return cursor.fetchone() or (None, None)
+
+
+def write(transitions):
+    changes = {}
+    for (label, obj_id, profile_id), transition in transitions.items():
+        if transition != SAME_VOTE:
+            changes.setdefault(label, {})[obj_id, profile_id] = transition
+    if not changes:
+        return
+    with transaction.atomic():
+        for label, items in changes.items():
+            apps.get_model(label)._default_manager.apply_votes(items)
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    global _buffer
+    # A buffer belongs to one process: a forked worker starts its own.
+    if _buffer is None or _buffer.pid != os.getpid():
+        with _buffer_lock:
+            if _buffer is None or _buffer.pid != os.getpid():
+                _buffer = VoteBuffer(
+                    getattr(settings, 'VOTE_BUFFER_DIR', settings.BASE_DIR / 'var' / 'votes'),
+                    getattr(settings, 'VOTE_BUFFER_FLUSH_MS', 200) / 1000,
+                    getattr(settings, 'VOTE_BUFFER_FSYNC', False),
+                )
+    return _buffer
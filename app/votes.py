@@ -0,0 +1,10 @@
+# A vote transition is the like type left behind for a current type of -1, 0 and 1.
+SAME_VOTE = (-1, 0, 1)
+
+
+def toggle_vote(value):
+    return tuple(0 if type == value else value for type in (-1, 0, 1))
+
+
+def compose_votes(first, then):
+    return tuple(then[type + 1] for type in first)
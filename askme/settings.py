@@ -19,6 +19,12 @@ except ImportError:
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# SQLite test databases are files, not the in-memory default: the vote concurrency
+# tests write from several threads, and every connection to :memory: gets its own.
+for alias, database in globals().get('DATABASES', {}).items():
+    if database.get('ENGINE') == 'django.db.backends.sqlite3':
+        database.setdefault('TEST', {}).setdefault('NAME', str(BASE_DIR / f'test_{alias}.sqlite3'))
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/4.1/howto/deployment/checklist/
@@ -43,6 +49,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'app.middleware.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -56,7 +63,8 @@ ROOT_URLCONF = 'askme.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates timing renders for app.middleware.RequestTimingMiddleware
+        'BACKEND': 'app.middleware.TimedDjangoTemplates',
         'DIRS': ['templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -65,6 +73,8 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'app.context_processors.sidebar',
+                'app.context_processors.fragment_cache',
             ],
         },
     },
@@ -79,6 +89,87 @@ WSGI_APPLICATION = 'askme.wsgi.application'
 
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# A file cache shares the sidebar between worker processes:
+# 'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': '/var/tmp/askme_cache'
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+SIDEBAR_CACHE_ALIAS = 'default'
+SIDEBAR_CACHE_TIMEOUT = 60
+
+# Whole pages served to anonymous visitors, see app/page_cache.py. Writes invalidate
+# them through versions; the timeout only bounds changes nothing invalidates (avatars).
+# The API only sends ETags built from the versions when this cache is shared.
+PAGE_CACHE_ALIAS = 'default'
+PAGE_CACHE_TIMEOUT = 60
+
+# Rendered questions and answers, keyed by what they show that changes (rating,
+# answer count, avatar); the timeout bounds how long an edited text stays stale.
+FRAGMENT_CACHE_TIMEOUT = 600
+
+# Seconds before the in-memory search suggestion index is reloaded from the database
+SUGGEST_REBUILD_INTERVAL = 300
+
+# Serve the question page, vote and correct from app/async_views.py; the feeds have
+# nothing to run concurrently and stay sync. Only worth it under an ASGI server
+# (askme/asgi.py); under WSGI every async view costs a loop hop.
+ASYNC_VIEWS = False
+
+# Answer votes from a per-process buffer and write their net changes every
+# VOTE_BUFFER_FLUSH_MS, see app/vote_buffer.py. Clicks are journaled to VOTE_BUFFER_DIR
+# first; VOTE_BUFFER_FSYNC also survives a machine crash at one fsync per click.
+VOTE_BUFFER = False
+VOTE_BUFFER_DIR = BASE_DIR / 'var' / 'votes'
+VOTE_BUFFER_FLUSH_MS = 200
+VOTE_BUFFER_FSYNC = False
+
+# With a cache shared by all workers (memcached, redis, a file cache), set
+#   SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+# to read sessions from it and write them through to the database. A per-process
+# LocMemCache would keep accepting sessions other workers logged out, app.checks
+# refuses it.
+SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+SESSION_CACHE_ALIAS = 'default'
+
+# With a shared USER_CACHE_ALIAS the user of a session and their profile come from the
+# cache for USER_CACHE_TIMEOUT seconds, see app/backends.py; with None from one query.
+# ModelBackend stays listed for sessions it logged in.
+AUTHENTICATION_BACKENDS = [
+    'app.backends.CachedModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+USER_CACHE_ALIAS = None
+USER_CACHE_TIMEOUT = 300
+
+# Per-request query and timing instrumentation, see app/middleware.py.
+# Requests over a budget, or repeating one query REQUEST_DUPLICATE_THRESHOLD times,
+# are always logged; the rest are logged with REQUEST_LOG_SAMPLE_RATE probability.
+REQUEST_LOG_SAMPLE_RATE = 0.01
+REQUEST_QUERY_BUDGET = 30
+REQUEST_TIME_BUDGET_MS = 500
+REQUEST_DUPLICATE_THRESHOLD = 5
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'plain': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'plain'},
+    },
+    'loggers': {
+        'app.requests': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -115,10 +206,14 @@ USE_TZ = True
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/4.1/howto/static-files/
 
-# STATIC_ROOT = os.path.join(BASE_DIR, 'static')
+# collectstatic copies the files here under content-hashed names, which app/files.py
+# serves with a year long Cache-Control; templates link them through {% static %}.
+STATIC_ROOT = BASE_DIR / 'collected_static'
 
 STATIC_URL = 'static/'
 
+STATICFILES_STORAGE = 'app.storage.HashedStaticFilesStorage'
+
 STATICFILES_DIRS = [
     BASE_DIR / 'static'
 ]
@@ -129,4 +224,14 @@ STATICFILES_DIRS = [
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 MEDIA_ROOT = BASE_DIR / 'uploads'
-MEDIA_URL = '/uploads/'
\ No newline at end of file
+MEDIA_URL = '/uploads/'
+
+# Seconds a browser may reuse an upload before revalidating it with its ETag.
+# Thumbnails never change under their name and are cached for a year.
+MEDIA_CACHE_MAX_AGE = 24 * 60 * 60
+
+# Square avatar thumbnails in pixels, made as WebP and JPEG by app/thumbnails.py in
+# AVATAR_THUMBNAIL_WORKERS background threads (0 makes them in the request).
+# Avatars are shown at 60-100 CSS pixels, the larger size serves 2x screens.
+AVATAR_THUMBNAIL_SIZES = (96, 192)
+AVATAR_THUMBNAIL_WORKERS = 2
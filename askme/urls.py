@@ -1,8 +1,11 @@
+import re
+
 from django.contrib import admin
 from django.conf import settings
-from django.conf.urls.static import static
-from django.urls import path, include
-from app import views
+from django.urls import path, include, re_path
+from app import api, async_views, files, views
+
+json_views = async_views if settings.ASYNC_VIEWS else views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -12,9 +15,16 @@ urlpatterns = [
     path('logout', views.logout, name='logout'),
     path('profile/edit', views.settings, name='settings'),
     path('ask', views.ask, name='ask'),
-    path('vote', views.vote, name='vote'),
-    path('correct', views.correct, name='correct')
-]
-
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+    path('search', views.search, name='search'),
+    path('suggest', views.suggest, name='suggest'),
+    path('vote', json_views.vote, name='vote'),
+    path('vote/batch', views.vote_batch, name='vote_batch'),
+    path('correct', json_views.correct, name='correct'),
+    path('api/questions', api.questions, name='api_questions'),
+    path('api/questions/<int:question_id>/answers', api.answers, name='api_answers'),
+    path('api/tags', api.tags, name='api_tags'),
+    # In production a front server may take these over; the views send validators
+    # and ranges either way.
+    re_path(r'^%s(?P<path>.*)$' % re.escape(settings.MEDIA_URL.lstrip('/')), files.media, name='media'),
+    re_path(r'^%s(?P<path>.*)$' % re.escape(settings.STATIC_URL.lstrip('/')), files.static, name='static'),
+]
\ No newline at end of file
@@ -0,0 +1,23 @@
+let suggestTimer = null
+let suggestQuery = ""
+
+$("#search-q").on("input", function () {
+    const query = $(this).val().trim()
+    clearTimeout(suggestTimer)
+    if (query.length < 2 || query == suggestQuery) {
+        return
+    }
+    suggestTimer = setTimeout(() => {
+        suggestQuery = query
+        fetch(`/suggest?q=${encodeURIComponent(query)}`).then((response) => {
+            if (!response.ok) {
+                return
+            }
+            response.json().then((data) => {
+                const list = $("#search-suggestions").empty()
+                data.tags.forEach((tag) => list.append($("<option>").val(`[${tag}]`)))
+                data.questions.forEach((question) => list.append($("<option>").val(question.title)))
+            })
+        });
+    }, 100)
+});
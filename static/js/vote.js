@@ -1,22 +1,46 @@
-$(".like").on("click", function (ev) {
-    const id = $(this).data("id")
-    const vote = $(this).data("vote")
-    const type = $(this).data("type")
-    var component = $(`.${type}_${id}`);
+// Clicks are queued and sent in one /vote/batch request once they pause for
+// FLUSH_DELAY ms, so a burst of clicks costs one request and one transaction.
+const FLUSH_DELAY = 300
+const MAX_PENDING = 50
+let pending = []
+let timer = null
+
+function flushVotes() {
+    clearTimeout(timer)
+    timer = null
+    const votes = pending
+    pending = []
 
-    fetch("/vote", {
+    fetch("/vote/batch", {
         method: "POST",
-        headers: { "X-CSRFToken": csrf_token, "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8"},
-        body: `id=${id}&vote=${vote}&type=${type}`,
+        headers: { "X-CSRFToken": csrf_token, "Content-Type": "application/json"},
+        body: JSON.stringify({ votes: votes }),
     }).then((response) => {
         if (response.ok) {
             response.json().then((data) => {
-                component.text(data.likes)
-                console.log(data)
+                for (const [type, ratings] of Object.entries(data.likes)) {
+                    for (const [id, likes] of Object.entries(ratings)) {
+                        $(`.${type}_${id}`).text(likes)
+                    }
+                }
             })
             console.log("OK")
         } else {
             console.log("FAIL")
         }
     });
-});
\ No newline at end of file
+}
+
+$(".like").on("click", function (ev) {
+    pending.push({
+        id: $(this).data("id"),
+        vote: $(this).data("vote"),
+        type: $(this).data("type"),
+    })
+    if (pending.length >= MAX_PENDING) {
+        flushVotes()
+    } else {
+        clearTimeout(timer)
+        timer = setTimeout(flushVotes, FLUSH_DELAY)
+    }
+});